@@ -1,20 +1,9 @@
 from datetime import datetime
 import pandas as pd
-import pytz
 import streamlit as st
-from utils.db import DataBaseManagement
-from utils.decandenc import decrypt, generate_key
-from utils.send_mail import send_email
-
-st.set_page_config(page_title="Email Management System", page_icon=":Home:")
-st.image("./image/2.jpeg", use_column_width=True)
-
-# ---------------- Helper ----------------
-def make_aware(dt):
-    tehran_tz = pytz.timezone("Asia/Tehran")
-    if dt is None:
-        return None
-    return dt if dt.tzinfo else tehran_tz.localize(dt)
+from utils.db import LOCAL_TZ, DataBaseManagement
+from utils.scheduler import get_dispatcher, start_background
+from utils.session import check_session, issue_token
 
 # ---------------- Main Page ----------------
 def main_page():
@@ -25,8 +14,8 @@ def main_page():
     if "user_email" in st.session_state and "user_id" in st.session_state:
         if user_authentication(st.session_state.user_id, st.session_state.user_email):
             db = DataBaseManagement()
-            user_profile = db.get_user_profile(st.session_state.user_id, st.session_state.user_email)
-            user_name = user_profile[1]
+            user_profile = db.get_user_profile(st.session_state.user_id, st.session_state.user_email, fields=("name",))
+            user_name = user_profile.name
 
             # 🔹 نمایش تعداد ایمیل‌های جدید
             new_email_count = db.get_newly_sent_emails_count(st.session_state.user_email)
@@ -35,7 +24,7 @@ def main_page():
                 db.mark_emails_as_notified(st.session_state.user_email)
 
             # 🔹 آمار ایمیل‌ها
-            email_data = get_sent_email_statistics(st.session_state.user_email)
+            email_data = get_sent_email_statistics(db, st.session_state.user_id)
             if email_data:
                 st.title(f"Welcome, {user_name} :crown:")
                 col1, col2 = st.columns([2, 1])
@@ -43,14 +32,13 @@ def main_page():
                 # ---------------- Last 10 Sent Emails ----------------
                 with col1:
                     st.subheader("Last 10 Sent Emails")
-                    sent_emails = db.get_all_sent_emails(st.session_state.user_id)
-                    sent_emails = sent_emails[-10:] if sent_emails else []
+                    sent_emails, _ = db.get_sent_emails_page(st.session_state.user_id, limit=10)
                     if sent_emails:
-                        df = pd.DataFrame(sent_emails, columns=[
-                            "Email_id", "Recipients", "Subject", "Body", "Sent_date", "notified", "user_id",
-                        ]).set_index("Email_id")
+                        df = pd.DataFrame(sent_emails).set_index("email_id").rename(columns={
+                            "recipients": "Recipients", "subject": "Subject", "sent_date": "Sent_date",
+                        })
                         st.dataframe(df[["Recipients", "Subject", "Sent_date"]].style.format({
-                            "Sent_date": lambda x: x.strftime("%Y-%m-%d %H:%M:%S") if pd.notnull(x) else ""
+                            "Sent_date": lambda x: x.astimezone(LOCAL_TZ).strftime("%Y-%m-%d %H:%M:%S") if pd.notnull(x) else ""
                         }))
                     else:
                         st.write("No emails sent yet.")
@@ -59,77 +47,24 @@ def main_page():
                 with col2:
                     st.subheader("Upcoming Scheduled Emails")
                     # حالا فقط از جدول Schedules استفاده می‌کنیم
-                    schedules = db.get_all_schedules()
-                    now_tehran = datetime.now(pytz.timezone("Asia/Tehran"))
+                    # one joined query per window, filtered by owner and due time in SQL
+                    now_tehran = datetime.now(LOCAL_TZ)
+                    upcoming_schedules = db.get_schedules_view(st.session_state.user_id, start=now_tehran, pending=True)
+                    due_schedules = db.get_schedules_view(st.session_state.user_id, end=now_tehran, pending=True)
 
                     # جدا کردن تاریخ‌های آینده
-                    upcoming_schedules = [s for s in schedules if s[1] and make_aware(s[1]) > now_tehran]
                     if upcoming_schedules:
                         for schedule in upcoming_schedules:
-                            email_id = schedule[0]
-                            scheduled_time = make_aware(schedule[1])
-                            email_info = db.get_sent_email(email_id)
-                            if email_info:
-                                recipient = email_info[1]
-                                subject = email_info[2]
-                                st.write(f"📨 To: {recipient} | 🧾 Subject: {subject} | 🕒 At: {scheduled_time.strftime('%Y-%m-%d %H:%M')}")
-                            else:
-                                st.write(f"Email ID {email_id} → Scheduled for: {scheduled_time.strftime('%Y-%m-%d %H:%M')}")
+                            scheduled_time = schedule.scheduled_date.astimezone(LOCAL_TZ)
+                            st.write(f"📨 To: {schedule.recipients} | 🧾 Subject: {schedule.subject} | 🕒 At: {scheduled_time.strftime('%Y-%m-%d %H:%M')}")
                     else:
                         st.write("No upcoming scheduled emails.")
 
                     # 🔹 ایمیل‌های سررسیدشده (Due)
-                    due_schedules = [s for s in schedules if s[1] and make_aware(s[1]) <= now_tehran]
                     if due_schedules:
-                        st.markdown("**⏱ Sending Due Scheduled Emails...**")
-                        sent_any = False
-                        for schedule in due_schedules:
-                            email_id = schedule[0]
-                            email_info = db.get_sent_email(email_id)
-                            if email_info:
-                                recipient = email_info[1]
-                                subject = email_info[2]
-                                body = email_info[3]
-                                notified = email_info[5]  # ستون notified
-
-                                if not notified:
-                                    user_profile = db.get_user_profile(st.session_state.user_id, st.session_state.user_email)
-                                    sender_email = st.session_state.user_email
-                                    sender_password = decrypt(user_profile[6], generate_key("securepassword"))
-
-                                    send_result = send_email(
-                                        sender_email=sender_email,
-                                        sender_password=sender_password,
-                                        subject=subject,
-                                        to=[recipient],
-                                        contents=body,
-                                        attachments=None,
-                                    )
-
-                                    if send_result:
-                                        db.update_sent_email_date(email_id=email_id, sent_date=now_tehran)
-                                        db.mark_email_as_notified(email_id)
-                                        st.session_state["last_success_message"] = f"✅ Sent scheduled email to {recipient} (Subject: {subject})"
-                                        sent_any = True
-                                    else:
-                                        st.error(f"❌ Failed to send email to {recipient}")
-                        if sent_any:
-                            st.experimental_rerun()
-
-                    # 🔹 ایمیل‌های آینده
-                    upcoming_schedules = [s for s in schedules if s[1] and make_aware(s[1]) > now_tehran]
-                    if upcoming_schedules:
-                        st.markdown("**Scheduled Emails:**")
-                        for s in upcoming_schedules:
-                            email_id = s[0]
-                            scheduled_time = make_aware(s[1])
-                            email_info = db.get_sent_email(email_id)
-                            if email_info:
-                                st.write(f"📨 To: {email_info[1]} | 🧾 Subject: {email_info[2]} | 🕒 At: {scheduled_time.strftime('%Y-%m-%d %H:%M')}")
-                            else:
-                                st.write(f"Email ID {email_id} → Scheduled for: {scheduled_time.strftime('%Y-%m-%d %H:%M')}")
-                    else:
-                        st.write("No upcoming scheduled emails.")
+                        # delivered by the schedule dispatcher, independent of page renders
+                        get_dispatcher().wake()
+                        st.markdown(f"**⏱ {len(due_schedules)} due scheduled email(s) are being sent...**")
 
                 # ---------------- Email Statistics ----------------
                 st.markdown("--" * 30)
@@ -140,10 +75,11 @@ def main_page():
                 success_pct = (successful_sent / total_sent) * 100 if total_sent else 0
                 fail_pct = (failed_sent / total_sent) * 100 if total_sent else 0
 
-                c1, c2, c3 = st.columns(3)
+                c1, c2, c3, c4 = st.columns(4)
                 c1.metric("Sent Emails", f"{total_sent} emails")
                 c2.metric("Successful", f"{success_pct:.2f}%", delta="↑")
                 c3.metric("Failed", f"{fail_pct:.2f}%", delta="↓")
+                c4.metric("Retrying", f"{email_data['Retrying']} emails")
 
     else:
         st.warning("Please log in first.")
@@ -151,14 +87,17 @@ def main_page():
 
 # ---------------- Authentication ----------------
 def user_authentication(user_id, user_email):
-    db = DataBaseManagement()
-    return bool(db.get_user_profile(user_id, user_email))
+    # verified in memory from the signed session token; the database is only asked on expiry
+    return check_session(st.session_state, user_id, user_email)
 
-def get_sent_email_statistics(user_email):
-    return {"Total Sent": 25, "Failed Sent": 2, "Successful Sent": 23}
+def get_sent_email_statistics(db, user_id):
+    # finished deliveries from the outbox: only 'dead' rows failed for good, 'failed' ones are still being retried
+    stats = db.get_outbox_stats(user_id)
+    return {"Total Sent": stats["sent"] + stats["dead"], "Failed Sent": stats["dead"],
+            "Successful Sent": stats["sent"], "Retrying": stats["failed"]}
 
 # ---------------- Login ----------------
-if "logged_in" not in st.session_state or not st.session_state.logged_in:
+def login_page():
     user_email = st.text_input("Please Enter your email")
     user_password = st.text_input("Please Enter your password", type="password")
 
@@ -169,10 +108,21 @@ if "logged_in" not in st.session_state or not st.session_state.logged_in:
             st.session_state.logged_in = True
             st.session_state.user_email = user_email
             st.session_state.user_id = user_id
+            st.session_state.session_token = issue_token(user_id, user_email)
             st.success("Logged in successfully!")
             st.experimental_rerun() 
         else:
             st.error("Invalid email or password!")
-else:
-    main_page()
+
+
+# side effects only when Streamlit runs this script, not when a child process imports it
+if __name__ == "__main__":
+    st.set_page_config(page_title="Email Management System", page_icon=":Home:")
+    # scheduled emails and reminders go out from the first script run on, not only while Home is open
+    start_background()
+    st.image("./image/2.jpeg", use_column_width=True)
+    if "logged_in" not in st.session_state or not st.session_state.logged_in:
+        login_page()
+    else:
+        main_page()
 
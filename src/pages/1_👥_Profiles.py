@@ -2,6 +2,7 @@ import pandas as pd
 import streamlit as st
 
 from utils.db import DataBaseManagement
+from utils.session import check_session
 
 st.set_page_config(page_title="Profiles", page_icon=":zap:")
 
@@ -12,14 +13,14 @@ def profile_page():
         user_email = st.session_state.user_email
         if user_authentication(user_id, user_email):
             db = DataBaseManagement()
-            user_profile = db.get_user_profile(user_id=user_id, email=user_email)
+            user_profile = db.get_user_profile(user_id=user_id, email=user_email, fields=("name", "title"))
 
             if not user_profile:
                 st.error("User profile not found!")
                 return
 
-            user_name = user_profile[1]
-            user_title = user_profile[2]
+            user_name = user_profile.name
+            user_title = user_profile.title
             st.title(f"{user_title} {user_name} Please Add Profiles")
             st.markdown("##### Add people you want to send emails to 📨 ")
             st.write("---" * 100)
@@ -50,11 +51,11 @@ def profile_page():
                 profiles = db.get_all_profiles(user_id)
                 if profiles:
                     profile_data = {
-                        "Id": [prof[0] for prof in profiles],
-                        "Name": [prof[1] for prof in profiles],
-                        "Title": [prof[3] for prof in profiles],
-                        "Email": [prof[2] for prof in profiles],
-                        "Profession": [prof[4] for prof in profiles],
+                        "Id": [prof.id for prof in profiles],
+                        "Name": [prof.name for prof in profiles],
+                        "Title": [prof.title for prof in profiles],
+                        "Email": [prof.email for prof in profiles],
+                        "Profession": [prof.profession for prof in profiles],
                     }
                     dataframe = pd.DataFrame(profile_data).set_index("Id")
                     st.dataframe(dataframe)
@@ -69,11 +70,11 @@ def profile_page():
                 searched_profile = db.get_profile(email=search_email, user_id=user_id)
                 if searched_profile:
                     dataframe = pd.DataFrame([{
-                        "Id": searched_profile[0],
-                        "Name": searched_profile[1],
-                        "Title": searched_profile[3],
-                        "Email": searched_profile[2],
-                        "Profession": searched_profile[4],
+                        "Id": searched_profile.id,
+                        "Name": searched_profile.name,
+                        "Title": searched_profile.title,
+                        "Email": searched_profile.email,
+                        "Profession": searched_profile.profession,
                     }]).set_index("Id")
                     st.dataframe(dataframe)
                 else:
@@ -90,8 +91,6 @@ def user_authentication(user_id: int, user_email: str):
     Returns:
         bool: True if the user is authorized, False otherwise.
     """
-    db = DataBaseManagement()
-    profile = db.get_user_profile(user_id=user_id, email=user_email)
-    return bool(profile)
+    return check_session(st.session_state, user_id, user_email)
 
 profile_page()
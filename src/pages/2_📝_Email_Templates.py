@@ -1,10 +1,11 @@
 import streamlit as st
 
 from utils.db import DataBaseManagement
+from utils.session import check_session
 
 st.set_page_config(page_title="Profiles", page_icon=":zap:")
 
-def user_authentication(user_email):
+def user_authentication(user_id, user_email):
     """Checks if the user with the given user_id and user_email exists and is authorized.
     Args:
     user_id (int): Unique identifier for the user.
@@ -12,26 +13,21 @@ def user_authentication(user_email):
     Returns:
     bool: True if the user is authorized, False otherwise.
     """
-    db = DataBaseManagement()
-    user_id = db.get_user_id_by_email(user_email)
-    if user_id is None:
-        return False
-    return bool(db.get_user_profile(user_id=user_id, email=user_email))
+    return check_session(st.session_state, user_id, user_email)
 
 def email_templates():
-    if "user_email" not in st.session_state:
+    if "user_email" not in st.session_state or "user_id" not in st.session_state:
         st.warning("Please log in first.")
         st.markdown("[Go to User Profile page](User_Profile_SignIn)")
         return
 
-    if not user_authentication(st.session_state.user_email):
+    if not user_authentication(st.session_state.user_id, st.session_state.user_email):
         st.warning("Please fill user profile form in 'User Profile' page first.")
         st.markdown("[Go to User Profile page](User_Profile_SignIn)")
         return
 
     db = DataBaseManagement()
-    user_email = st.session_state.user_email
-    user_id = db.get_user_id_by_email(user_email)
+    user_id = st.session_state.user_id
 
     #* Show templates after when user logged in...
     if "template_success_msg" in st.session_state:
@@ -59,14 +55,14 @@ def email_templates():
                 st.error("❌ Please fill in all fields")
 
     st.header("Existing Templates")
-    templates = db.get_all_templates(user_id)
+    templates = db.get_all_templates(user_id, fields=("id", "name", "body"))
     if not templates:
         st.info("No templates found. Add a new template above.")
     else:
         for template in templates:
-            template_id = template[0]
-            template_name = template[1]
-            template_body = template[2]
+            template_id = template.id
+            template_name = template.name
+            template_body = template.body
             with st.expander(f"Template: {template_name}"):
                 st.write("**Template ID:**", template_id)
                 st.text_area("", value=template_body, height=150, key=f"Body_{template_id}", disabled=True)
@@ -80,7 +76,7 @@ def email_templates():
             try:
                 delete_id_int = int(delete_id)
                 #* check if template exists before deleting
-                existing_template = [t for t in templates if t[0] == delete_id_int]
+                existing_template = [t for t in templates if t.id == delete_id_int]
                 if not existing_template:
                     st.error(f"❌ No template found with ID {delete_id_int}")
                 else:
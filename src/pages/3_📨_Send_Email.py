@@ -1,14 +1,17 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import streamlit as st
 import re
+import uuid
 
 from utils.db import DataBaseManagement
-from utils.decandenc import decrypt, generate_key
-from utils.send_mail import send_email
-from utils.reg_engine import generate_email_with_rag
+from utils.outbox import delivery_status, get_outbox_worker, idempotency_key, new_entry
+from utils.planner import get_planner
+from utils.recurrence import first_occurrence, parse_rule
+from utils.scheduler import get_dispatcher, start_background
+from utils.session import check_session
+from utils.reg_engine import generate_email_with_rag, index_async
 
-st.set_page_config(page_title="Send Email", page_icon="📨")
 
 
 def replace_placeholders_in_body(template_body, profile_data):
@@ -16,9 +19,38 @@ def replace_placeholders_in_body(template_body, profile_data):
     return re.sub(r"[\{\[]\s*(\w+)\s*[\}\]]", lambda m: lowered_profile.get(m.group(1).lower(), ""), template_body)
 
 
+def template_body(db, templates, template_name):
+    """ Fetch the body of the named template; the template list itself is loaded without bodies """
+    template = next((temp for temp in templates if temp.name == template_name), None)
+    if template is None:
+        return ""
+    full_template = db.get_template(template.id, template.user_id)
+    return full_template.body if full_template else ""
+
+
 def user_authentication(user_id, user_email):
-    db = DataBaseManagement()
-    return bool(db.get_user_profile(user_id, user_email))
+    return check_session(st.session_state, user_id, user_email)
+
+
+def show_delivery_status(db):
+    """ Report the emails of earlier sends whose first attempt is over; one outbox read, no waiting """
+    pending = st.session_state.get("pending_sends")
+    if not pending:
+        return
+    settled, st.session_state["pending_sends"] = delivery_status(db, pending)
+    index_async(st.session_state.user_id, [entry.email_id for entry in settled if entry.state == "sent"])
+    for entry in settled:
+        if entry.state == "sent":
+            st.success(f"✅ Email sent to {entry.recipient}")
+        elif entry.state == "failed":
+            st.warning(f"⏳ Sending to {entry.recipient} failed, it will be retried: {entry.last_error}")
+        elif entry.state == "dead":
+            st.error(f"❌ Failed to send email to {entry.recipient}: {entry.last_error}")
+        else:
+            st.info(f"📆 Email to {entry.recipient} is deferred to the next free slot: {entry.last_error}")
+    if st.session_state["pending_sends"]:
+        st.info(f"📤 {len(st.session_state['pending_sends'])} email(s) are on their way.")
+        st.button("🔄 Check delivery")
 
 
 def send_email_page():
@@ -32,8 +64,6 @@ def send_email_page():
 
     db = DataBaseManagement()
     sender_email = st.session_state.user_email
-    user_profile = db.get_user_profile(st.session_state.user_id, sender_email)
-    sender_password = decrypt(user_profile[6], generate_key("securepassword"))
 
     templates = db.get_all_templates(st.session_state.user_id)
     profiles = db.get_all_profiles(st.session_state.user_id)
@@ -43,8 +73,9 @@ def send_email_page():
     st.markdown("### You could choose templates too!")
     st.markdown("#### What are you waiting for!?")
     st.markdown("---" * 30)
+    show_delivery_status(db)
 
-    email_options = [prof[2] for prof in profiles] if profiles else []
+    email_options = [prof.email for prof in profiles] if profiles else []
     if not email_options:
         st.info("No profiles found to send emails to.")
         return
@@ -57,11 +88,15 @@ def send_email_page():
     if "preview_body" not in st.session_state:
         st.session_state["preview_body"] = ""
 
+    #! one token per submission: reruns and double clicks of a send reuse it, the next send gets a new one
+    if "send_token" not in st.session_state:
+        st.session_state["send_token"] = uuid.uuid4().hex
+
     with st.form("send_email_form"):
         selected_emails = st.multiselect("Select recipients", options=email_options)
         subject = st.text_input("Subject", placeholder="Enter subject of email")
 
-        template_options = ["None"] + [temp[1] for temp in templates]
+        template_options = ["None"] + [temp.name for temp in templates]
         selected_template = st.selectbox("Select a template", options=template_options)
 
         if selected_template == "None":
@@ -73,13 +108,15 @@ def send_email_page():
 
         selected_date = st.date_input("Select scheduled send date (optional)", value=None)
         selected_time = st.time_input("Select scheduled send time (optional)", value=None)
+        repeat = st.selectbox("Repeat", options=["Once", "Daily", "Weekly", "Custom (cron)"])
+        cron_expression = st.text_input("Cron expression (minute hour day month weekday)", placeholder="0 9 * * 1-5")
 
         preview_clicked = st.form_submit_button("Preview Template")
         send_clicked = st.form_submit_button("Send Email")
 
     if preview_clicked:
         if selected_template != "None":
-            st.session_state["preview_body"] = next((temp[2] for temp in templates if temp[1] == selected_template), "")
+            st.session_state["preview_body"] = template_body(db, templates, selected_template)
         else:
             st.session_state["preview_body"] = st.session_state["email_body"]
 
@@ -98,7 +135,8 @@ def send_email_page():
             base_text = st.session_state["email_body"] if selected_template == "None" else st.session_state["preview_body"]
             if base_text.strip():
                 with st.spinner("Generating smart suggestion with RAG..."):
-                    rag_result = generate_email_with_rag(base_text, title=subject, tone=tone)
+                    rag_result = generate_email_with_rag(base_text, title=subject, tone=tone,
+                                                         user_id=st.session_state.user_id)
                 st.subheader("📩 پیشنهاد ایمیل هوشمند (RAG):")
                 st.text_area("RAG Suggested Email", value=rag_result, height=200)
             else:
@@ -114,14 +152,14 @@ def send_email_page():
 
         selected_template_body = ""
         if selected_template != "None":
-            selected_template_body = next((temp[2] for temp in templates if temp[1] == selected_template), "")
+            selected_template_body = template_body(db, templates, selected_template)
 
         # ساخت بدنه نهایی ایمیل‌ها
         final_bodies = {}
         for email in selected_emails:
-            prof = next((p for p in profiles if p[2] == email), None)
-            profile_data = {"name": prof[1], "title": prof[3], "profession": prof[4]} if prof else {}
-            body = replace_placeholders_in_body(email_body, profile_data) if selected_template == "None" \
+            prof = next((p for p in profiles if p.email == email), None)
+            profile_data = {"name": prof.name, "title": prof.title, "profession": prof.profession} if prof else {}
+            body = replace_placeholders_in_body(st.session_state["email_body"], profile_data) if selected_template == "None" \
                 else replace_placeholders_in_body(selected_template_body, profile_data)
             final_bodies[email] = body
 
@@ -134,24 +172,82 @@ def send_email_page():
                 st.warning("Selected date is in the past.")
                 scheduled_date = None
 
+        # تکرار: only the rule and the first occurrence are stored
+        recurrence = None
+        if repeat != "Once":
+            recurrence = cron_expression.strip() if repeat == "Custom (cron)" else repeat.lower()
+            try:
+                parse_rule(recurrence)
+                if repeat == "Custom (cron)":
+                    # an expression like "0 0 31 2 *" parses but never fires
+                    scheduled_date = first_occurrence(recurrence, scheduled_date or datetime.now(tehran_tz))
+            except ValueError as e:
+                st.error(str(e))
+                return
+            if scheduled_date is None:
+                st.error("Please select the date and time of the first email.")
+                return
+
         # ارسال یا زمان‌بندی
         if scheduled_date is None:
             with st.spinner("Sending emails..."):
-                for email, body in final_bodies.items():
-                    result = send_email(sender_email, sender_password, subject, [email], body, uploaded_file)
-                    db.add_sent_email(email, subject, body, datetime.now(tehran_tz), st.session_state.user_id)
-                    if result:
-                        st.success(f"✅ Email sent to {email}")
-                    else:
-                        st.error(f"❌ Failed to send email to {email}")
+                # queued in the outbox at the slots the planner picked within the sender's quota;
+                # the worker sends, retries and records the history
+                plan = get_planner().plan(sender_email, len(final_bodies))
+                attachment = uploaded_file.getvalue() if uploaded_file else None
+                outbox_ids = db.enqueue_outbox([
+                    new_entry(st.session_state.user_id, sender_email, email, subject, body,
+                              attachment=attachment, attachment_name=uploaded_file.name if uploaded_file else None,
+                              send_at=slot, submission=st.session_state["send_token"])
+                    for (email, body), slot in zip(final_bodies.items(), plan.slots)
+                ])
+                if not outbox_ids:
+                    st.error("❌ Could not queue the emails, please try again.")
+                    return
+                get_outbox_worker().wake()
+                deferred = plan.deferred()
+                if deferred:
+                    completes_at = plan.completes_at.astimezone(tehran_tz).strftime('%Y-%m-%d %H:%M')
+                    st.info(f"📆 {deferred} emails are spread over your sending quota, "
+                            f"projected completion {completes_at}.")
+                    outbox_ids = outbox_ids[:len(outbox_ids) - deferred]
+                # the worker sends in the background; results show up on the next reruns of this page
+                pending = st.session_state.get("pending_sends", [])
+                st.session_state["pending_sends"] = pending + [i for i in outbox_ids if i not in pending]
+                del st.session_state["send_token"]
+                st.info(f"📤 {len(outbox_ids)} email(s) queued for sending.")
+                st.button("🔄 Check delivery", key="check_after_send")
         else:
             with st.spinner("Scheduling emails..."):
-                for email, body in final_bodies.items():
-                    email_id = db.add_sent_email(email, subject, body, None, st.session_state.user_id)
-                    if email_id:
-                        db.add_schedule(email_id=email_id, scheduled_date=scheduled_date, user_id=st.session_state.user_id)
-                st.success(f"📅 Emails scheduled for {scheduled_date.strftime('%Y-%m-%d %H:%M:%S')}.")
+                # drafts are keyed by the submission, so a rerun or double click gets the same drafts back
+                email_ids = db.add_sent_emails_bulk(
+                    [(email, subject, body, None) for email, body in final_bodies.items()],
+                    st.session_state.user_id,
+                    keys=[idempotency_key(st.session_state.user_id, email, subject, body, st.session_state["send_token"])
+                          for email, body in final_bodies.items()],
+                )
+                if not email_ids:
+                    st.error("❌ Could not schedule the emails, please try again.")
+                    return
+                # every occurrence of a recurring campaign starts together; one-off campaigns follow the quota plan
+                if recurrence:
+                    slots = [scheduled_date] * len(email_ids)
+                else:
+                    slots = get_planner().plan(sender_email, len(email_ids), start=scheduled_date).slots
+                db.add_schedules_bulk(list(zip(email_ids, slots)), st.session_state.user_id, recurrence=recurrence)
+                get_dispatcher().wake()
+                del st.session_state["send_token"]
+                first_send = scheduled_date.astimezone(tehran_tz).strftime('%Y-%m-%d %H:%M:%S')
+                if recurrence:
+                    st.success(f"🔁 Emails scheduled {recurrence}, starting {first_send}.")
+                else:
+                    st.success(f"📅 Emails scheduled for {first_send}.")
+                    if slots and slots[-1] > scheduled_date + timedelta(minutes=1):
+                        completes_at = slots[-1].astimezone(tehran_tz).strftime('%Y-%m-%d %H:%M')
+                        st.info(f"📆 The campaign is spread over your sending quota, projected completion {completes_at}.")
 
 
 if __name__ == "__main__":
+    st.set_page_config(page_title="Send Email", page_icon="📨")
+    start_background()
     send_email_page()
@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import pytz
+import streamlit as st
+
+from utils.db import DataBaseManagement
+from utils.scheduler import get_dispatcher, start_background
+from utils.session import check_session
+
+
+#! label -> minutes
+SNOOZE_OPTIONS = {"10 minutes": 10, "1 hour": 60, "1 day": 24 * 60}
+#! newest sent emails offered for a new reminder; one keyset page, however long the history
+RECENT_EMAILS = 50
+
+
+def page_reminders():
+    if "user_email" not in st.session_state or "user_id" not in st.session_state:
+        st.warning("Please log in first.")
+        return
+
+    if not user_authentication(st.session_state.user_id, st.session_state.user_email):
+        st.warning("Please log in first.")
+        return
+
+    db = DataBaseManagement()
+    tehran_tz = pytz.timezone("Asia/Tehran")
+    st.markdown("## 🔔 Reminders")
+    st.markdown("##### Get an email when it is time to follow up on something you sent")
+
+    reminders = db.get_reminders_view(st.session_state.user_id)
+    reminded = {reminder.email_id for reminder in reminders}
+    recent, _ = db.get_sent_emails_page(st.session_state.user_id, limit=RECENT_EMAILS)
+    sent_emails = [email for email in recent if email.email_id not in reminded]
+
+    with st.form("add_reminder_form"):
+        labels = {f"{email.recipients} | {email.subject} | {email.sent_date.astimezone(tehran_tz):%Y-%m-%d %H:%M}": email.email_id
+                  for email in sent_emails}
+        selected = st.selectbox("Email", options=list(labels))
+        remind_day = st.date_input("Remind me on")
+        remind_time = st.time_input("At")
+        note = st.text_input("Note (optional)", max_chars=500)
+        add_clicked = st.form_submit_button("Add Reminder")
+
+    if add_clicked:
+        remind_date = tehran_tz.localize(datetime.combine(remind_day, remind_time))
+        if not selected:
+            st.error("There is no sent email to set a reminder for.")
+        elif remind_date < datetime.now(tehran_tz):
+            st.warning("Selected date is in the past.")
+        elif db.add_reminder(labels[selected], remind_date, note or None):
+            get_dispatcher().wake()
+            st.success("🔔 Reminder set.")
+            st.experimental_rerun()
+        else:
+            st.error("Could not set the reminder, please try again.")
+
+    if not reminders:
+        st.info("You have no reminders.")
+        return
+
+    pending = [reminder for reminder in reminders if reminder.fired_at is None]
+    fired = [reminder for reminder in reminders if reminder.fired_at is not None]
+
+    st.markdown("### ⏰ Upcoming")
+    if not pending:
+        st.info("No upcoming reminders.")
+    for reminder in pending:
+        email_id = reminder.email_id
+        remind_date = reminder.remind_date.astimezone(tehran_tz)
+        with st.container():
+            st.write(f"**To:** {reminder.recipients}")
+            st.write(f"**Subject:** {reminder.subject}")
+            st.write(f"**Remind Date:** {remind_date.strftime('%Y-%m-%d %H:%M')}")
+            if reminder.note:
+                st.write(f"**Note:** {reminder.note}")
+
+            new_day = st.date_input("New date", value=remind_date.date(), key=f"day_{email_id}")
+            new_time = st.time_input("New time", value=remind_date.time(), key=f"time_{email_id}")
+            if st.button(f"✏️ Move Reminder #{email_id}", key=f"move_{email_id}"):
+                db.update_reminder(email_id, tehran_tz.localize(datetime.combine(new_day, new_time)))
+                get_dispatcher().wake()
+                st.experimental_rerun()
+            if st.button(f"❌ Delete Reminder #{email_id}", key=f"delete_{email_id}"):
+                db.delete_reminder(email_id)
+                st.experimental_rerun()
+
+    st.markdown("### 📬 Fired")
+    if not fired:
+        st.info("No fired reminders.")
+    for reminder in fired:
+        email_id = reminder.email_id
+        with st.container():
+            st.write(f"**To:** {reminder.recipients}")
+            st.write(f"**Subject:** {reminder.subject}")
+            st.write(f"**Fired At:** {reminder.fired_at.astimezone(tehran_tz).strftime('%Y-%m-%d %H:%M')}")
+            if reminder.note:
+                st.write(f"**Note:** {reminder.note}")
+
+            snooze = st.selectbox("Snooze for", options=list(SNOOZE_OPTIONS), key=f"snooze_for_{email_id}")
+            if st.button(f"😴 Snooze Reminder #{email_id}", key=f"snooze_{email_id}"):
+                db.snooze_reminder(email_id, SNOOZE_OPTIONS[snooze])
+                get_dispatcher().wake()
+                st.experimental_rerun()
+            if st.button(f"✅ Dismiss Reminder #{email_id}", key=f"dismiss_{email_id}"):
+                db.delete_reminder(email_id)
+                st.experimental_rerun()
+
+
+def user_authentication(user_id, user_email):
+    """Checks if the user with the given user_id and user_email exists and is authorized.
+    Args:
+    user_id (int): Unique identifier for the user.
+    user_email (str): Email address of the user.
+    Returns:
+    bool: True if the user is authorized, False otherwise.
+    """
+    return check_session(st.session_state, user_id, user_email)
+
+
+if __name__ == "__main__":
+    st.set_page_config(page_title="Reminders", page_icon="🔔")
+    start_background()
+    page_reminders()
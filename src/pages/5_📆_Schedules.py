@@ -1,11 +1,11 @@
 from datetime import datetime
 
-import pytz
 import streamlit as st
 
-from utils.db import DataBaseManagement
+from utils.db import LOCAL_TZ, DataBaseManagement
+from utils.scheduler import start_background
+from utils.session import check_session
 
-st.set_page_config(page_title="Schedules", page_icon="📅")
 
 def page_schedules():
     if "user_email" not in st.session_state:
@@ -17,45 +17,40 @@ def page_schedules():
         st.markdown("## 📅 Scheduled Emails")
         st.markdown("##### Here you can view and manage upcoming scheduled emails")
 
-        all_schedules = db.get_all_schedules()
+        now_tehran = datetime.now(LOCAL_TZ)
 
-        if not all_schedules:
-            st.info("No scheduled emails found.")
-            return
-
-        tehran_tz = pytz.timezone("Asia/Tehran")
-        now_tehran = datetime.now(tehran_tz)
+        # owner, time window and Sent_Emails join all resolved in one query
+        upcoming_schedules = db.get_schedules_view(st.session_state.user_id, start=now_tehran, pending=True)
+        # schedules the outbox gave up on are no longer retried
+        failed_schedules = db.get_schedules_view(st.session_state.user_id, failed=True)
 
-        upcoming_schedules = []
-        for s in all_schedules:
-            scheduled_date = s[1]
-            if scheduled_date.tzinfo is None:
-                scheduled_date = tehran_tz.localize(scheduled_date)
-            if scheduled_date > now_tehran:
-                upcoming_schedules.append((s[0], scheduled_date))
+        for schedule in failed_schedules:
+            failed_at = schedule.failed_at.astimezone(LOCAL_TZ).strftime("%Y-%m-%d %H:%M")
+            st.error(f"Schedule #{schedule.email_id} to {schedule.recipients} ({schedule.subject}) "
+                     f"could not be delivered, gave up at {failed_at}.")
+            if st.button(f"❌ Remove Schedule #{schedule.email_id}", key=f"cancel_{schedule.email_id}"):
+                db.delete_schedule(schedule.email_id)
+                st.experimental_rerun()
 
         if not upcoming_schedules:
             st.info("There are no upcoming scheduled emails.")
             return
 
         for schedule in upcoming_schedules:
-            email_id = schedule[0]
-            scheduled_date = schedule[1]
-
-            email_info = db.get_sent_email(email_id)
-            if email_info:
-                recipient = email_info[1]   # Recipients
-                subject = email_info[2]     # Subject
+            email_id = schedule.email_id
+            scheduled_date = schedule.scheduled_date.astimezone(LOCAL_TZ)
 
-                with st.container():
-                    st.write(f"**To:** {recipient}")
-                    st.write(f"**Subject:** {subject}")
-                    st.write(f"**Scheduled Date:** {scheduled_date}")
+            with st.container():
+                st.write(f"**To:** {schedule.recipients}")
+                st.write(f"**Subject:** {schedule.subject}")
+                st.write(f"**Scheduled Date:** {scheduled_date}")
+                if schedule.recurrence:
+                    st.write(f"**Repeats:** {schedule.recurrence}")
 
-                    if st.button(f"❌ Cancel Schedule #{email_id}", key=f"cancel_{email_id}"):
-                        db.delete_schedule(email_id)
-                        st.success(f"Schedule #{email_id} canceled.")
-                        st.experimental_rerun()
+                if st.button(f"❌ Cancel Schedule #{email_id}", key=f"cancel_{email_id}"):
+                    db.delete_schedule(email_id)
+                    st.success(f"Schedule #{email_id} canceled.")
+                    st.experimental_rerun()
 
 
 def user_authentication(user_id, user_email):
@@ -66,10 +61,10 @@ def user_authentication(user_id, user_email):
     Returns:
     bool: True if the user is authorized, False otherwise.
     """
-    db = DataBaseManagement()
-    profile = db.get_user_profile(user_id=user_id, email=user_email)
-    return bool(profile)
+    return check_session(st.session_state, user_id, user_email)
 
 
 if __name__ == "__main__":
+    st.set_page_config(page_title="Schedules", page_icon="📅")
+    start_background()
     page_schedules()
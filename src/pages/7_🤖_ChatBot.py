@@ -2,7 +2,7 @@ import requests
 import streamlit as st
 import os
 from dotenv import load_dotenv
-from utils.db import DataBaseManagement
+from utils.session import check_session
 
 load_dotenv()
 PROXY_URL = os.getenv("CF_WORKER_URL")
@@ -67,9 +67,7 @@ def user_authentication(user_id, user_email):
     Returns:
         bool: True if the user is authorized, False otherwise.
     """
-    db = DataBaseManagement()
-    profile = db.get_user_profile(user_id=user_id, email=user_email)
-    return bool(profile)
+    return check_session(st.session_state, user_id, user_email)
 
 
 if __name__ == "__main__":
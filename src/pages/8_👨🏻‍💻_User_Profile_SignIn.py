@@ -2,7 +2,8 @@ import pandas as pd
 import streamlit as st
 
 from utils.db import DataBaseManagement
-from utils.decandenc import encrypt, generate_key
+from utils.credentials import app_key
+from utils.decandenc import encrypt
 
 """
 A Streamlit-based User Profile Management page.
@@ -31,7 +32,7 @@ if st.button("Submit Profile"):
     if name and title and proffesion and signiture and email and password:
         db = DataBaseManagement()
         # Decrypt the password before send it to datbase
-        encrypted_password = encrypt(password, generate_key("securepassword"))
+        encrypted_password = encrypt(password, app_key())
         # set user profile in dateabse
         result = db.set_user_profile(name, title, proffesion, signiture, email, encrypted_password)
         if result:
@@ -49,13 +50,13 @@ user_profiles = db.get_all_user_profile()
 
 if user_profiles:
     user_data = {
-        "User_id": [user[0] for user in user_profiles],
-        "Name": [user[1] for user in user_profiles],  # indx 1 for name
-        "Title": [user[2] for user in user_profiles],  # indx 2 for title
-        "Profession": [user[3] for user in user_profiles],  # indx 3 for profession
-        "Signature": [user[4] for user in user_profiles],  # indx 4 for signature
-        "Email": [user[5] for user in user_profiles],  #indx 5 for email
-        "Password": ["*" * len(user[6]) for user in user_profiles], # indx 6 for password
+        "User_id": [user.user_id for user in user_profiles],
+        "Name": [user.name for user in user_profiles],
+        "Title": [user.title for user in user_profiles],
+        "Profession": [user.profession for user in user_profiles],
+        "Signature": [user.signature for user in user_profiles],
+        "Email": [user.email for user in user_profiles],
+        "Password": ["********" for _ in user_profiles],  # credentials are never loaded for the listing
     }
     dataframe = pd.DataFrame(user_data)
     dataframe = dataframe.set_index("User_id")
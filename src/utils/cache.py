@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+""" Per-user read-through cache for rarely changing EMS lists.
+
+    Profiles and templates are read on every rerun of the Send Email, Profiles and
+    Templates pages but change only when the user edits them. ``ReadThroughCache`` keeps
+    the last result per (kind, user, projection) in a bounded LRU and tags it with a
+    per-(kind, user) version counter. Every write bumps the counter, so readers never get
+    a list loaded before the write; the stale entry simply ages out of the LRU.
+
+    The cache is per process. Writes made by another process are not seen until the
+    entry is evicted, which is acceptable for the single-process Streamlit deployment.
+
+    Classes:
+        ReadThroughCache: Versioned LRU cache with hit / miss counters.
+
+    Functions:
+        get_cache(): The process-wide ReadThroughCache.
+
+    Environment variables:
+        EMS_CACHE_MAX_ENTRIES: LRU bound (default 1024).
+"""
+
+
+class ReadThroughCache:
+    def __init__(self, max_entries: int = 1024):
+        """Versioned read-through LRU cache
+
+        :param max_entries: least recently used entries beyond this are evicted
+        :type max_entries: int
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, list] = OrderedDict()
+        self._versions: dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, user_id: int, variant: Hashable, loader: Callable[[], list]) -> list:
+        """ Return the cached ``kind`` list of ``user_id``, calling ``loader`` on a miss.
+
+        :param kind: list name, e.g. "profiles"
+        :type kind: str
+        :param user_id: owner of the list
+        :type user_id: int
+        :param variant: anything else the result depends on, e.g. the selected fields
+        :type variant: Hashable
+        :param loader: loads the list from the database
+        :type loader: Callable[[], list]
+        :return: a copy of the cached list
+        :rtype: list
+        """
+        with self._lock:
+            version = self._versions.get((kind, user_id), 0)
+            key = (kind, user_id, variant, version)
+            rows = self._entries.get(key)
+            if rows is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(rows)
+            self.misses += 1
+
+        rows = loader()
+
+        with self._lock:
+            #! a write during the load bumped the version: hand the rows out but don't cache them
+            if self._versions.get((kind, user_id), 0) == version:
+                self._entries[key] = list(rows)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return rows
+
+    def invalidate(self, kind: str, user_id: int):
+        """ Bump the version of ``kind`` for ``user_id`` so cached lists are no longer served """
+        with self._lock:
+            self._versions[(kind, user_id)] = self._versions.get((kind, user_id), 0) + 1
+
+    def stats(self) -> dict:
+        """ Hit / miss counters and current size """
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "hit_rate": self.hits / total if total else 0.0}
+
+
+_cache: ReadThroughCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ReadThroughCache:
+    """ Return the process-wide read-through cache """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ReadThroughCache(int(os.getenv("EMS_CACHE_MAX_ENTRIES", 1024)))
+    return _cache
@@ -0,0 +1,173 @@
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+from utils.decandenc import decrypt, encrypt, generate_key
+
+""" Credential service for EMS.
+
+    ``generate_key`` runs 100,000 PBKDF2-SHA256 iterations, which used to be paid on every
+    page render. This module derives the application key once per process and keeps the
+    decrypted sender passwords per user for a short TTL, so a render costs a dictionary
+    lookup instead of a key derivation plus an AES decrypt.
+
+    Cached secrets are held in ``bytearray`` buffers that are zeroed when an entry expires,
+    is evicted or is invalidated. The ``str`` handed to the SMTP layer is an unavoidable
+    copy and is not wiped.
+
+    Classes:
+        CredentialService: TTL / LRU cache of decrypted sender passwords.
+
+    Functions:
+        app_key(): The derived application key, computed once per process.
+        get_credential_service(): The process-wide CredentialService.
+
+    Environment variables:
+        EMS_APP_SECRET: secret the application key is derived from (default "securepassword").
+        EMS_CREDENTIAL_TTL: seconds a decrypted password stays cached (default 300).
+
+    Benchmark:
+        cd src && python -m utils.credentials --bench
+"""
+
+_app_key: bytes | None = None
+_app_key_lock = threading.Lock()
+
+
+def app_key() -> bytes:
+    """ Return the application encryption key, deriving it on first use only """
+    global _app_key
+    if _app_key is None:
+        with _app_key_lock:
+            if _app_key is None:
+                _app_key = generate_key(os.getenv("EMS_APP_SECRET", "securepassword"))
+    return _app_key
+
+
+def _wipe(buffer: bytearray):
+    for i in range(len(buffer)):
+        buffer[i] = 0
+
+
+class _Entry:
+    __slots__ = ("secret", "expires_at")
+
+    def __init__(self, secret: bytearray, expires_at: float):
+        self.secret = secret
+        self.expires_at = expires_at
+
+
+class CredentialService:
+    def __init__(self, ttl: float | None = None, max_entries: int = 256):
+        """Cache of decrypted sender passwords keyed by user id
+
+        :param ttl: seconds an entry stays valid, defaults to EMS_CREDENTIAL_TTL or 300
+        :type ttl: float | None
+        :param max_entries: least recently used entries beyond this are evicted
+        :type max_entries: int
+        """
+        self.ttl = ttl if ttl is not None else float(os.getenv("EMS_CREDENTIAL_TTL", 300))
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sender_password(self, db, user_id: int, email: str) -> str | None:
+        """ Return the decrypted sender password of ``user_id``, loading it through ``db`` on a miss.
+
+        :param db: DataBaseManagement used to load the encrypted password
+        :param user_id: owner of the credentials
+        :type user_id: int
+        :param email: owner's email, checked together with user_id
+        :type email: str
+        :return: the plaintext password, None if the user does not exist
+        :rtype: str | None
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(user_id)
+                return entry.secret.decode()
+            if entry is not None:
+                self._drop(user_id)
+
+        user_profile = db.get_user_profile(user_id, email, fields=("encrypted_password",))
+        if not user_profile:
+            return None
+        password = decrypt(user_profile.encrypted_password, app_key())
+
+        with self._lock:
+            if user_id in self._entries:
+                self._drop(user_id)
+            self._entries[user_id] = _Entry(bytearray(password.encode()), now + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        return password
+
+    def invalidate(self, user_id: int):
+        """ Forget and wipe the cached password of ``user_id`` """
+        with self._lock:
+            if user_id in self._entries:
+                self._drop(user_id)
+
+    def clear(self):
+        """ Forget and wipe every cached password """
+        with self._lock:
+            for user_id in list(self._entries):
+                self._drop(user_id)
+
+    def _drop(self, user_id: int):
+        _wipe(self._entries.pop(user_id).secret)
+
+
+_service: CredentialService | None = None
+_service_lock = threading.Lock()
+
+
+def get_credential_service() -> CredentialService:
+    """ Return the process-wide credential service """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = CredentialService()
+    return _service
+
+
+def _benchmark(renders: int):
+    """ Per-render cost of resolving a sender password, before and after caching """
+    from timeit import timeit
+
+    from utils.rows import UserProfile
+
+    encrypted = encrypt("app-password-1234", app_key())
+
+    class _StubDB:
+        def get_user_profile(self, user_id, email, fields=None):
+            return UserProfile(encrypted_password=encrypted)
+
+    before = timeit(lambda: decrypt(encrypted, generate_key("securepassword")), number=renders) / renders
+    service = CredentialService()
+    db = _StubDB()
+    after = timeit(lambda: service.sender_password(db, 1, "user@example.com"), number=renders) / renders
+
+    logger.info(f"per render, generate_key + decrypt: {before * 1e3:.3f} ms")
+    logger.info(f"per render, cached credential service: {after * 1e6:.3f} µs")
+    logger.info(f"speedup: {before / after:,.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EMS credential service")
+    parser.add_argument("--bench", action="store_true", help="run the per-render micro-benchmark")
+    parser.add_argument("--renders", type=int, default=20, help="renders to time in the benchmark")
+    args = parser.parse_args()
+    if args.bench:
+        _benchmark(args.renders)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
+import hmac
+import os
 import re
-from datetime import datetime
+import socket
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 import mariadb
+import pytz
 from loguru import logger
 
-from utils.decandenc import decrypt, generate_key
+from utils import queries
+from utils.cache import get_cache
+from utils.credentials import app_key, get_credential_service
+from utils.decandenc import decrypt
+from utils.migrations import MigrationError, ensure_schema, migrate
+from utils.pool import get_pool
+from utils.rows import (LIST_FIELDS, DueReminder, DueSchedule, OutboxEntry, Profile, Reminder, ReminderView,
+                        Schedule, ScheduleView, SentEmail, SocialMedia, Template, UserProfile, select_columns,
+                        to_rows)
+from utils.session import revoke_user
 
 """ Database management utilities for EMS.
 
@@ -18,16 +32,43 @@ from utils.decandenc import decrypt, generate_key
 
     Functions:
         parse_datetime_repr(text): Safely parses a string representation of a datetime object.
+        to_utc(dt): Normalizes a datetime to naive UTC for storage.
+        from_utc(dt): Marks a naive UTC datetime read from the database as UTC.
+
+    Outgoing mail goes through the Outbox table (enqueue_outbox / claim_outbox /
+    mark_outbox_sent / mark_outbox_failed), which utils.outbox drains; Sent_Emails only
+    receives an email once it was actually delivered.
+
+    Profile and template lists are served from the per-user read-through cache in
+    utils.cache; every write to those tables bumps the owner's cache version after commit.
+
+    Read methods return the typed NamedTuples from utils.rows and accept an optional
+    ``fields`` projection; list views skip the body and credential columns by default.
+
+    Every operation borrows a connection from the process-wide pool in utils.pool for
+    the duration of one unit of work and returns it afterwards, so constructing a
+    DataBaseManagement is cheap and safe to do on every Streamlit rerun.
 
     Dependencies:
         - mariadb
         - loguru
-        - utils.decandenc (encrypt, generate_key, decrypt)
+        - utils.pool (get_pool)
+        - utils.queries (SQL of the indexed hot-path queries)
+        - utils.migrations (ensure_schema, migrate, MigrationError)
+        - utils.rows (typed row objects and column projection)
+        - utils.decandenc (decrypt)
+        - utils.cache (get_cache)
+        - utils.credentials (app_key, get_credential_service)
+        - utils.session (revoke_user)
         - hashlib
         - datetime
+        - pytz
         - re
 """
 
+#! naive datetimes coming from the UI are wall-clock times in this zone
+LOCAL_TZ = pytz.timezone("Asia/Tehran")
+
 
 def parse_datetime_repr(text):
     """ Parse string like 'datetime.datetime(2025, 7, 25, 18, 9)' safely """
@@ -38,102 +79,90 @@ def parse_datetime_repr(text):
     return None
 
 
+def to_utc(dt: datetime | None) -> datetime | None:
+    """ Convert ``dt`` to a naive UTC datetime for storage; naive input is taken as LOCAL_TZ """
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = LOCAL_TZ.localize(dt)
+    return dt.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def from_utc(dt: datetime | None) -> datetime | None:
+    """ Attach UTC to a naive datetime read back from a UTC column """
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return pytz.utc.localize(dt)
+
+
+def _utc_now() -> datetime:
+    return datetime.now(pytz.utc).replace(tzinfo=None)
+
+
+def _placeholders(values) -> str:
+    return ", ".join("?" * len(values))
+
+
+def _utc_rows(row_type: type, fields: tuple[str, ...], rows: list, dates: tuple[str, ...]) -> list:
+    """ Wrap fetched tuples like ``to_rows``, with the selected ``dates`` fields as aware UTC """
+    wrapped = to_rows(row_type, fields, rows)
+    dates = [name for name in dates if name in fields]
+    if dates:
+        wrapped = [row._replace(**{name: from_utc(getattr(row, name)) for name in dates}) for row in wrapped]
+    return wrapped
+
+
+def _sent_rows(fields: tuple[str, ...], rows: list) -> list[SentEmail]:
+    """ Wrap fetched Sent_Emails tuples, with Sent_date as aware UTC """
+    return _utc_rows(SentEmail, fields, rows, ("sent_date",))
+
+
 class DataBaseManagement:
     def __init__(self):
         """Data base management for EMS
         """
-        #! Connect to database
+        #! Borrow connections from the shared pool, one per operation
         try:
-            self.conn = mariadb.connect(
-                user="root",
-                password="",
-                host="localhost",
-                database="EMSdb",
-            )
-            self.cursor = self.conn.cursor()
-            self.create_tables()
+            self.pool = get_pool()
+            #! DDL runs once per process, not on every construct
+            ensure_schema(self.pool)
 
         except mariadb.Error as e:
-            logger.success(f"Error connecting to MariaDB: {e}")
+            logger.error(f"Error connecting to MariaDB: {e}")
 
-    def create_tables(self):
-            """Creates necessary tables in the database if they don't exist.
-            The tables created include:
-            - Profiles: Stores information about profiles.
-            - Templates: Stores email templates.
-            - Sent_Emails: Stores sent email records.
-            - Reminders: Stores email reminder information.
-            - Schedules: Stores email scheduling information.
-            - User_profile: Stores user profile information with encrypted password.
-            - Social_media: Stores social media links for each user.
-            """
+        except MigrationError as e:
+            logger.error(f"Database migration stopped: {e}")
+
+    @contextmanager
+    def _cursor(self):
+        """ Borrow a pooled connection and yield a cursor on it.
+        The transaction commits when the block exits cleanly and rolls back on error.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
             try:
-                self.cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS Profiles (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        Name VARCHAR(100),
-                        Email VARCHAR(100),
-                        Title VARCHAR(200),
-                        Profession VARCHAR(100)
-                    );
-                """)
-                self.cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS Templates (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        Name VARCHAR(100),
-                        Body VARCHAR(500)
-                    );
-                """)
-                self.cursor.execute("""
-                                    CREATE TABLE IF NOT EXISTS Sent_Emails(
-                                        Email_id INT AUTO_INCREMENT PRIMARY KEY,
-                                        Recipients VARCHAR(200),
-                                        Subject VARCHAR(100),
-                                        Body VARCHAR(500),
-                                        Sent_date DATETIME
-                                    );
-                                    """)
-                self.cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS Reminders (
-                        Email_id INT,
-                        Remind_date DATETIME,
-                        FOREIGN KEY (Email_id) REFERENCES Sent_Emails(Email_id)
-                    );
-                """)
-                self.cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS Schedules (
-                        Email_id INT,
-                        Scheduled_date DATETIME,
-                        FOREIGN KEY (Email_id) REFERENCES Sent_Emails(Email_id)
-                    );
-                """)
-                self.cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS User_profile (
-                        User_id INT AUTO_INCREMENT PRIMARY KEY,
-                        Name VARCHAR(100),
-                        Title VARCHAR(200),
-                        Proffesion VARCHAR(100),
-                        Signiture VARCHAR(100),
-                        Email VARCHAR(100) UNIQUE,
-                        Encrypted_password VARCHAR(200) NOT NULL
-                    );
-                    """)
-                self.cursor.execute("""
-                                    CREATE TABLE IF NOT EXISTS Social_media(
-                                        User_id int,
-                                        LinkedIn VARCHAR(200),
-                                        X VARCHAR(200),
-                                        Telegram VARCHAR(200),
-                                        Github VARCHAR(200),
-                                        FOREIGN KEY (User_id) REFERENCES User_profile(User_id)
-                                    );
-                                    """)
-
-                self.conn.commit()
-                logger.success("Tables created successfully")
-
-            except mariadb.Error as e:
-                logger.error(f"Error creating tables: {e}")
+                yield cursor
+            finally:
+                cursor.close()
+
+    def create_tables(self):
+        """Creates or upgrades the necessary tables by applying pending schema migrations.
+        The tables managed include:
+        - Profiles: Stores information about profiles.
+        - Templates: Stores email templates.
+        - Sent_Emails: Stores sent email records.
+        - Reminders: Stores email reminder information.
+        - Schedules: Stores email scheduling information.
+        - User_profile: Stores user profile information with encrypted password.
+        - Social_media: Stores social media links for each user.
+        See utils.migrations for the versioned DDL.
+        """
+        try:
+            migrate(self.pool)
+            logger.success("Tables created successfully")
+
+        except mariadb.Error as e:
+            logger.error(f"Error creating tables: {e}")
 
     def add_profile(self, name:str , email: str, title: str, proffesion: str, user_id: int) -> bool:
         """ Add a profile to the database.
@@ -142,8 +171,9 @@ class DataBaseManagement:
             sql = """
                     INSERT INTO Profiles (Name, Email, Title, Profession, User_id) VALUES (? , ? ,? ,?, ?)
                     """
-            self.cursor.execute(sql,(name, email, title,proffesion, user_id ))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql,(name, email, title,proffesion, user_id ))
+            get_cache().invalidate("profiles", user_id)
 
         except Exception as e:
             logger.error(f"Failed to add profile \n {e}")
@@ -152,13 +182,16 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_profile(self, email: str, user_id: int) -> tuple :
+    def get_profile(self, email: str, user_id: int, fields: tuple | None = None) -> Profile | None :
         """ Retrieve a profile by ID.
         """
         try:
-            sql = " SELECT * FROM Profiles WHERE Email = %s AND User_id = %s"
-            self.cursor.execute(sql,(email,user_id))
-            return self.cursor.fetchone()
+            fields, columns = select_columns(Profile, fields)
+            sql = queries.PROFILE_BY_EMAIL.format(columns=columns)
+            with self._cursor() as cursor:
+                cursor.execute(sql,(email,user_id))
+                row = cursor.fetchone()
+            return to_rows(Profile, fields, [row])[0] if row else None
 
         except Exception as e:
             logger.error(f"Failed to show {email} to you \n {e}")
@@ -174,12 +207,15 @@ class DataBaseManagement:
             sql = """UPDATE Profiles
                     SET Name = ?, Email = ?, Title = ?, Profession = ?
                     WHERE id = ?"""
-            self.cursor.execute(sql, (name, email, title, profession, profile_id))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                owner = self._profile_owner(cursor, profile_id)
+                cursor.execute(sql, (name, email, title, profession, profile_id))
+                updated = cursor.rowcount > 0
 
             #! checks the row to make sure upadate has been done correctly :
 
-            if self.cursor.rowcount > 0:
+            if updated:
+                get_cache().invalidate("profiles", owner)
                 logger.success(f"Profile with ID {profile_id} updated successfully")
                 return True
             logger.warning(f"Profile with ID {profile_id} not found")
@@ -196,8 +232,10 @@ class DataBaseManagement:
         """
         try:
             sql = "DELETE FROM Profiles WHERE id = ? "
-            self.cursor.execute(sql, (profile_id,))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                owner = self._profile_owner(cursor, profile_id)
+                cursor.execute(sql, (profile_id,))
+            get_cache().invalidate("profiles", owner)
             logger.success(f"{profile_id} Deleted successfuly")
 
         except Exception as e:
@@ -207,11 +245,24 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_all_profiles(self, user_id: int):
-        """Retrieve all profiles belonging to a specific user."""
-        sql = "SELECT * FROM Profiles WHERE user_id = ?"
-        self.cursor.execute(sql, (user_id,))
-        return self.cursor.fetchall()
+    @staticmethod
+    def _profile_owner(cursor, profile_id: int) -> int | None:
+        """ User_id owning ``profile_id``, read inside the caller's transaction """
+        cursor.execute("SELECT User_id FROM Profiles WHERE id = ?", (profile_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_all_profiles(self, user_id: int, fields: tuple | None = None) -> list[Profile]:
+        """Retrieve all profiles belonging to a specific user, through the read-through cache."""
+        fields, columns = select_columns(Profile, fields or LIST_FIELDS[Profile])
+
+        def load():
+            sql = queries.PROFILES_OF_USER.format(columns=columns)
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id,))
+                return to_rows(Profile, fields, cursor.fetchall())
+
+        return get_cache().get("profiles", user_id, fields, load)
 
     def add_template(self, name: str, body: str, user_id: int) -> bool:
         """ Add a template to Templates table in db
@@ -220,8 +271,9 @@ class DataBaseManagement:
             sql = """
                     INSERT INTO Templates (Name, Body, User_id) VALUES (? , ?, ?)
             """
-            self.cursor.execute(sql, (name, body, user_id))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (name, body, user_id))
+            get_cache().invalidate("templates", user_id)
             logger.success("Values Inserted Successfuly")
 
         except Exception as e:
@@ -231,20 +283,37 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_all_templates(self, user_id: int) -> tuple:
-        """ Retrieve all templates form Templates table
+    def get_all_templates(self, user_id: int, fields: tuple | None = None) -> list[Template]:
+        """ Retrieve all templates form Templates table through the read-through cache,
+        without Body unless asked for in ``fields``
         """
-        sql = "SELECT * FROM Templates WHERE User_id = ?"
-        self.cursor.execute(sql, (user_id,))
-        return self.cursor.fetchall()
+        fields, columns = select_columns(Template, fields or LIST_FIELDS[Template])
+
+        def load():
+            sql = queries.TEMPLATES_OF_USER.format(columns=columns)
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id,))
+                return to_rows(Template, fields, cursor.fetchall())
+
+        return get_cache().get("templates", user_id, fields, load)
+
+    def get_template(self, template_id: int, user_id: int) -> Template | None:
+        """ Retrieve one template, including its Body, by ID
+        """
+        sql = "SELECT id, Name, Body, User_id FROM Templates WHERE id = ? AND User_id = ?"
+        with self._cursor() as cursor:
+            cursor.execute(sql, (template_id, user_id))
+            row = cursor.fetchone()
+        return Template._make(row) if row else None
 
     def delete_template(self, template_id: int, user_id:int) -> bool:
         """ Delete a template by ID
         """
         try:
             sql = "DELETE FROM Templates WHERE id = ? AND User_id = ?"
-            self.cursor.execute(sql, (template_id,user_id))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (template_id,user_id))
+            get_cache().invalidate("templates", user_id)
             logger.success(f"{template_id} Deleted successfuly")
 
         except Exception as e :
@@ -254,14 +323,14 @@ class DataBaseManagement:
         else:
             return True
 
-    def add_sent_email(self, recipients: str, subject: str, body: str, sent_date: str, user_id) -> bool:
-        """ Add a sent email to Sent_Emails table in db
+    def add_sent_email(self, recipients: str, subject: str, body: str, sent_date: datetime | None, user_id) -> bool:
+        """ Add a sent email to Sent_Emails table in db; ``sent_date`` is aware or LOCAL_TZ wall time
         """
         try:
             sql = "INSERT INTO Sent_Emails(Recipients, Subject, Body, Sent_date, User_id) VALUES (?, ?, ?, ?, ?)"
-            self.cursor.execute(sql, (recipients, subject, body, sent_date, user_id))
-            self.conn.commit()
-            email_id = self.cursor.lastrowid
+            with self._cursor() as cursor:
+                cursor.execute(sql, (recipients, subject, body, to_utc(sent_date), user_id))
+                email_id = cursor.lastrowid
             logger.success("Email_sent Successfuly added")
             return email_id
 
@@ -272,12 +341,55 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_sent_email(self, email_id: int) -> tuple:
+    def add_sent_emails_bulk(self, emails: list[tuple], user_id: int, keys: list[str] | None = None) -> list[int]:
+        """ Add many sent emails in one transaction.
+
+        :param emails: (recipients, subject, body, sent_date) tuples, sent_date aware, LOCAL_TZ wall time or None
+        :type emails: list[tuple]
+        :param user_id: owner of the rows
+        :type user_id: int
+        :param keys: one submission key per email; a row whose key exists already is not added
+            again and its existing Email_id is returned
+        :type keys: list[str] | None
+        :return: Email_ids in the same order as ``emails``, empty list on failure
+        :rtype: list[int]
+        """
+        if not emails:
+            return []
+        try:
+            if keys is not None:
+                sql = """INSERT IGNORE INTO Sent_Emails(Recipients, Subject, Body, Sent_date, User_id, Submission_key)
+                        VALUES (?, ?, ?, ?, ?, ?)"""
+                with self._cursor() as cursor:
+                    cursor.executemany(sql, [(recipients, subject, body, to_utc(sent_date), user_id, key)
+                                             for (recipients, subject, body, sent_date), key in zip(emails, keys)])
+                    cursor.execute(f"""SELECT Submission_key, Email_id FROM Sent_Emails
+                            WHERE Submission_key IN ({_placeholders(keys)})""", tuple(keys))
+                    by_key = dict(cursor.fetchall())
+                return [by_key[key] for key in keys]
+            #! RETURNING gives back the ids of the batched rows in insertion order (MariaDB >= 10.5)
+            sql = """INSERT INTO Sent_Emails(Recipients, Subject, Body, Sent_date, User_id)
+                    VALUES (?, ?, ?, ?, ?) RETURNING Email_id"""
+            with self._cursor() as cursor:
+                cursor.executemany(sql, [(recipients, subject, body, to_utc(sent_date), user_id)
+                                         for recipients, subject, body, sent_date in emails])
+                email_ids = [row[0] for row in cursor.fetchall()]
+            logger.success(f"{len(email_ids)} Sent emails added successfuly")
+            return email_ids
+
+        except Exception as e:
+            logger.error(f"Failed to add_sent_emails_bulk {e}")
+            return []
+
+    def get_sent_email(self, email_id: int, fields: tuple | None = None) -> SentEmail | None:
         """ Retrieve a sent email by ID
         """
-        sql = " SELECT * FROM Sent_Emails Where Email_id = ?"
-        self.cursor.execute(sql, (email_id,))
-        return self.cursor.fetchone()
+        fields, columns = select_columns(SentEmail, fields)
+        sql = f" SELECT {columns} FROM Sent_Emails Where Email_id = ?"
+        with self._cursor() as cursor:
+            cursor.execute(sql, (email_id,))
+            row = cursor.fetchone()
+        return _sent_rows(fields, [row])[0] if row else None
 
     # def update_sent_email_date(self, email_id: int, sent_date):
     #     sql = "UPDATE Sent_Emails SET Sent_date=%s WHERE Email_id=%s"
@@ -286,34 +398,111 @@ class DataBaseManagement:
 
     def mark_email_as_notified(self, email_id: int):
         sql = "UPDATE Sent_Emails SET notified=1 WHERE Email_id=%s"
-        self.cursor.execute(sql, (email_id,))
-        self.conn.commit()
+        with self._cursor() as cursor:
+            cursor.execute(sql, (email_id,))
+
+    def get_all_sent_emails(self, user_id: int, fields: tuple | None = None) -> list[SentEmail]:
+        """ Retrieve all sent_emails, without Body unless asked for in ``fields``
+        """
+        fields, columns = select_columns(SentEmail, fields or LIST_FIELDS[SentEmail])
+        sql = queries.SENT_EMAILS_OF_USER.format(columns=columns)
+        with self._cursor() as cursor:
+            cursor.execute(sql,(user_id,))
+            return _sent_rows(fields, cursor.fetchall())
+
+    def get_sent_emails_since(self, user_id: int, after_id: int, limit: int = 256,
+                              fields: tuple | None = ("email_id", "body")) -> list[SentEmail]:
+        """ Retrieve a user's sent emails with Email_id above ``after_id``, oldest first.
+
+        A range scan on idx_sent_user_id, so feeding the user's search index from a
+        high-water mark costs one indexed query per batch no matter how large the history is.
+
+        :param user_id: owner of the emails
+        :type user_id: int
+        :param after_id: high-water mark, 0 for the beginning
+        :type after_id: int
+        :param limit: batch size
+        :type limit: int
+        :return: SentEmail rows ordered by Email_id
+        :rtype: list[SentEmail]
+        """
+        try:
+            fields, columns = select_columns(SentEmail, fields)
+            sql = queries.SENT_EMAILS_SINCE.format(columns=columns)
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id, after_id, limit))
+                return _sent_rows(fields, cursor.fetchall())
+
+        except Exception as e:
+            logger.error(f"Failed to get_sent_emails_since {after_id} \n {e}")
+            return []
+
+    def get_sent_emails_by_ids(self, user_id: int, email_ids: list[int],
+                               fields: tuple | None = ("email_id", "body")) -> list[SentEmail]:
+        """ Retrieve a user's sent emails by id, in no particular order; missing and foreign ids are skipped
+        """
+        if not email_ids:
+            return []
+        try:
+            fields, columns = select_columns(SentEmail, fields)
+            sql = f"SELECT {columns} FROM Sent_Emails WHERE User_id = ? AND Email_id IN ({_placeholders(email_ids)})"
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id, *email_ids))
+                return _sent_rows(fields, cursor.fetchall())
+
+        except Exception as e:
+            logger.error(f"Failed to get_sent_emails_by_ids {e}")
+            return []
+
+    def get_sent_emails_page(self, user_id: int, limit: int = 10, after: tuple | None = None) -> tuple[list[SentEmail], tuple | None]:
+        """ Retrieve one page of a user's sent email history, newest first.
 
-    def get_all_sent_emails(self, user_id: int):
-        sql = "SELECT * FROM Sent_Emails WHERE user_id=%s ORDER BY Sent_date DESC"
-        self.cursor.execute(sql, (user_id,))
-        return self.cursor.fetchall()
+        Uses keyset pagination on (Sent_date, Email_id) over idx_sent_user_date, so every
+        page costs the same no matter how deep into the history it is. Body is not selected.
 
-    def get_all_sent_emails(self, user_id: int):
-        """ Retrieve all sent_emails
+        :param user_id: owner of the emails
+        :type user_id: int
+        :param limit: page size
+        :type limit: int
+        :param after: cursor returned with the previous page, None for the first page
+        :type after: tuple | None
+        :return: (SentEmail rows without body, sent_date as aware UTC, cursor for the next page or None)
+        :rtype: tuple[list[SentEmail], tuple | None]
         """
-        sql = "SELECT * FROM Sent_Emails WHERE User_id = %s ORDER BY Sent_date DESC"
-        self.cursor.execute(sql,(user_id,))
-        return self.cursor.fetchall()
+        try:
+            filters, params = "", [user_id]
+            if after is not None:
+                filters = queries.SENT_EMAILS_PAGE_AFTER
+                params += [to_utc(after[0]), to_utc(after[0]), after[1]]
+            sql = queries.SENT_EMAILS_PAGE.format(filters=filters)
+            params.append(limit)
+
+            with self._cursor() as cursor:
+                cursor.execute(sql, tuple(params))
+                rows = cursor.fetchall()
+
+            rows = _sent_rows(("email_id", "recipients", "subject", "sent_date", "notified"), rows)
+            next_cursor = (rows[-1].sent_date, rows[-1].email_id) if len(rows) == limit else None
+            return rows, next_cursor
+
+        except Exception as e:
+            logger.error(f"Failed to get sent emails page for {user_id} \n {e}")
+            return [], None
 
     def get_user_id_by_email(self, email: str) -> int | None:
         sql = "SELECT User_id FROM User_profile WHERE Email = %s"
-        self.cursor.execute(sql, (email,))
-        row = self.cursor.fetchone()
+        with self._cursor() as cursor:
+            cursor.execute(sql, (email,))
+            row = cursor.fetchone()
         return row[0] if row else None
 
-    def add_reminder(self, email_id: int, reminder_date: str) -> bool :
+    def add_reminder(self, email_id: int, reminder_date: datetime, note: str | None = None) -> bool :
         """ Add a reminder to Reminders table in db
         """
         try:
-            sql = "INSERT INTO Reminders(Email_id ,Remind_date) VAlUES (?, ? )"
-            self.cursor.execute(sql, (email_id,reminder_date))
-            self.conn.commit()
+            sql = "INSERT INTO Reminders(Email_id ,Remind_date, Note) VAlUES (?, ?, ? )"
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email_id, to_utc(reminder_date), note))
             logger.success("Reminder Created Successfuly")
         except Exception as e :
             logger.error(f"Failed to create reminder! Becauese of : {e}")
@@ -322,14 +511,17 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_all_reminders(self) -> tuple:
+    def get_all_reminders(self) -> list[Reminder]:
         """ Retrieve all reminders from Reminders table
         """
         try:
-            sql = "SELECT * FROM Reminders"
-            self.cursor.execute(sql)
-            logger.success("Here is all your reminders ")
-            return self.cursor.fetchall()
+            fields, columns = select_columns(Reminder)
+            sql = f"SELECT {columns} FROM Reminders"
+            with self._cursor() as cursor:
+                cursor.execute(sql)
+                logger.success("Here is all your reminders ")
+                rows = cursor.fetchall()
+            return _utc_rows(Reminder, fields, rows, ("remind_date", "fired_at"))
 
         except Exception as e:
             logger.error(f"OOPS! Something went wrong! {e}")
@@ -338,13 +530,16 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_reminder(self, email_id: int) -> tuple :
+    def get_reminder(self, email_id: int) -> Reminder | None :
         """ Retrieve a reminder by ID
         """
         try:
-            sql = "SELECT * FROM Reminders WHERE Email_id = ?"
-            self.cursor.execute(sql, (email_id,))
-            return self.cursor.fetchone()
+            fields, columns = select_columns(Reminder)
+            sql = queries.REMINDER_BY_EMAIL.format(columns=columns)
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email_id,))
+                row = cursor.fetchone()
+            return _utc_rows(Reminder, fields, [row], ("remind_date", "fired_at"))[0] if row else None
 
         except Exception as e:
             logger.error(f"OOPS! Something went wrong! {e}")
@@ -358,8 +553,8 @@ class DataBaseManagement:
         """
         try:
             sql = """ DELETE FROM Reminders WHERE Email_id = ?"""
-            self.cursor.execute(sql, (email_id,))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email_id,))
             logger.success(f"{email_id} DELETED Successfuly ! ")
 
         except Exception as e :
@@ -369,19 +564,19 @@ class DataBaseManagement:
         else:
             return True
 
-    def update_reminder(self, email_id : int, remind_date: str) -> bool :
-        """ Update a reminder by ID
+    def update_reminder(self, email_id : int, remind_date: datetime) -> bool :
+        """ Move a reminder to ``remind_date``; a reminder that already fired fires again then
         """
         try:
             sql = """UPDATE Reminders
-                    SET Remind_date = ?
-                    WHERE id = ?"""
-            self.cursor.execute(sql, (email_id, remind_date))
-            self.conn.commit()
+                    SET Remind_date = ?, Fired_at = NULL, Lease_until = NULL
+                    WHERE Email_id = ?"""
+            with self._cursor() as cursor:
+                cursor.execute(sql, (to_utc(remind_date), email_id))
 
-            if self.cursor.rowcount > 0 :
-                logger.success(f"{email_id}'s Reminder updated successfuly")
-                return True
+                if cursor.rowcount > 0 :
+                    logger.success(f"{email_id}'s Reminder updated successfuly")
+                    return True
 
             logger.error(f"{email_id} Not found!")
             return False
@@ -390,16 +585,110 @@ class DataBaseManagement:
             logger.error(f"Failed to update {email_id} reminder! {e}")
             return False
 
-        else:
+    def snooze_reminder(self, email_id: int, minutes: float) -> bool:
+        """ Fire the reminder again ``minutes`` from now
+        """
+        return self.update_reminder(email_id, datetime.now(pytz.utc) + timedelta(minutes=minutes))
+
+    def get_reminders_view(self, user_id: int) -> list[ReminderView]:
+        """ Retrieve a user's reminders joined with their email in one round trip.
+
+        :param user_id: owner of the reminded emails
+        :type user_id: int
+        :return: ReminderView rows ordered by remind date, dates as aware UTC
+        :rtype: list[ReminderView]
+        """
+        try:
+            sql = """SELECT r.Email_id, e.Recipients, e.Subject, r.Remind_date, r.Note, r.Fired_at
+                    FROM Reminders r
+                    JOIN Sent_Emails e ON e.Email_id = r.Email_id
+                    WHERE e.User_id = ?
+                    ORDER BY r.Remind_date"""
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id,))
+                rows = cursor.fetchall()
+            return [ReminderView(email_id, recipients, subject, from_utc(remind_date), note, from_utc(fired_at))
+                    for email_id, recipients, subject, remind_date, note, fired_at in rows]
+
+        except Exception as e:
+            logger.error(f"Failed to get reminders view for {user_id} \n {e}")
+            return []
+
+    def get_next_reminder_time(self) -> datetime | None:
+        """ Remind date of the earliest pending reminder, as aware UTC; one probe of idx_reminders_due
+        """
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(queries.NEXT_REMINDER_TIME)
+                row = cursor.fetchone()
+            return from_utc(row[0]) if row else None
+
+        except Exception as e:
+            logger.error(f"Failed to get_next_reminder_time {e}")
+            return None
+
+    def claim_due_reminders(self, limit: int, lease_seconds: float) -> list[DueReminder]:
+        """ Claim up to ``limit`` due reminders for firing.
+
+        Pending reminders have Fired_at NULL, so the scan is a single range over
+        idx_reminders_due (Fired_at, Remind_date) and touches only due rows, however many
+        reminders lie in the future or have fired already. Claims work like
+        ``claim_due_schedules``: SKIP LOCKED plus a lease in Lease_until.
+
+        :param limit: maximum number of reminders to claim
+        :type limit: int
+        :param lease_seconds: how long the claim is held
+        :type lease_seconds: float
+        :return: the claimed reminders with their email and owner's address
+        :rtype: list[DueReminder]
+        """
+        now = _utc_now()
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(queries.CLAIM_DUE_REMINDERS, (now, now, limit))
+                email_ids = [row[0] for row in cursor.fetchall()]
+                if not email_ids:
+                    return []
+                cursor.execute(f"UPDATE Reminders SET Lease_until = ? WHERE Email_id IN ({_placeholders(email_ids)})",
+                               (now + timedelta(seconds=lease_seconds), *email_ids))
+                cursor.execute(f"""SELECT r.Email_id, e.User_id, u.Email, e.Recipients, e.Subject, r.Remind_date, r.Note
+                        FROM Reminders r
+                        JOIN Sent_Emails e ON e.Email_id = r.Email_id
+                        JOIN User_profile u ON u.User_id = e.User_id
+                        WHERE r.Email_id IN ({_placeholders(email_ids)})""", tuple(email_ids))
+                rows = cursor.fetchall()
+            return [DueReminder(*row[:5], from_utc(row[5]), row[6]) for row in rows]
+
+        except Exception as e:
+            logger.error(f"Failed to claim_due_reminders {e}")
+            return []
+
+    def mark_reminders_fired(self, email_ids: list[int]) -> bool:
+        """ Record that the claimed reminders in ``email_ids`` were handed to the outbox
+        """
+        if not email_ids:
+            return True
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(f"""UPDATE Reminders SET Fired_at = ?, Lease_until = NULL
+                        WHERE Email_id IN ({_placeholders(email_ids)})""", (_utc_now(), *email_ids))
             return True
 
-    def add_schedule(self, email_id: int, scheduled_date: datetime, user_id: int) -> bool :
-        """ Add a schedule to Schedules table in db
+        except Exception as e:
+            logger.error(f"Failed to mark_reminders_fired {e}")
+            return False
+
+    def add_schedule(self, email_id: int, scheduled_date: datetime, user_id: int,
+                     recurrence: str | None = None, until: datetime | None = None) -> bool :
+        """ Add a schedule to Schedules table in db.
+        For a recurring schedule ``scheduled_date`` is the first occurrence and ``recurrence``
+        a rule understood by utils.recurrence.
         """
         try:
-            sql = "INSERT INTO Schedules(Email_id, Scheduled_date, User_id) VALUES (? , ?, ?) "
-            self.cursor.execute(sql, (email_id, scheduled_date, user_id))
-            self.conn.commit()
+            sql = """INSERT INTO Schedules(Email_id, Scheduled_date, User_id, Recurrence, Recurrence_until)
+                    VALUES (? , ?, ?, ?, ?) """
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email_id, to_utc(scheduled_date), user_id, recurrence, to_utc(until)))
             logger.success(f"Schedulde date {scheduled_date} setted up successfuly")
 
         except Exception as e:
@@ -409,14 +698,51 @@ class DataBaseManagement:
         else:
             return True
 
+    def add_schedules_bulk(self, schedules: list[tuple], user_id: int,
+                           recurrence: str | None = None, until: datetime | None = None) -> bool:
+        """ Add many schedules in one transaction; emails that already have a schedule are skipped.
+
+        :param schedules: (email_id, scheduled_date) tuples
+        :type schedules: list[tuple]
+        :param user_id: owner of the rows
+        :type user_id: int
+        :param recurrence: rule shared by every schedule, None for one-off sends
+        :type recurrence: str | None
+        :param until: last allowed occurrence of a recurring schedule
+        :type until: datetime | None
+        :return: True or False
+        :rtype: bool
+        """
+        if not schedules:
+            return True
+        try:
+            #! a resubmitted campaign gets its drafts back (see add_sent_emails_bulk); they keep their first schedule
+            sql = """INSERT INTO Schedules(Email_id, Scheduled_date, User_id, Recurrence, Recurrence_until)
+                    SELECT ?, ?, ?, ?, ? FROM DUAL
+                    WHERE NOT EXISTS (SELECT 1 FROM Schedules WHERE Email_id = ?)"""
+            with self._cursor() as cursor:
+                cursor.executemany(sql, [(email_id, to_utc(scheduled_date), user_id, recurrence, to_utc(until), email_id)
+                                         for email_id, scheduled_date in schedules])
+            logger.success(f"{len(schedules)} Schedules setted up successfuly")
+
+        except Exception as e:
+            logger.error(f"Failed to add_schedules_bulk {e}")
+            return False
+
+        else:
+            return True
+
 
-    def get_schedule(self, email_id: int) -> tuple:
+    def get_schedule(self, email_id: int) -> Schedule | None:
         """ Retrieve a schedule by ID.
         """
         try:
-            sql = "SELECT * FROM Schedules WHERE Email_id = ? "
-            self.cursor.execute(sql, (email_id,))
-            return self.cursor.fetchone()
+            fields, columns = select_columns(Schedule)
+            sql = queries.SCHEDULE_BY_EMAIL.format(columns=columns)
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email_id,))
+                row = cursor.fetchone()
+            return _utc_rows(Schedule, fields, [row], ("scheduled_date",))[0] if row else None
 
         except Exception as e :
             logger.error(f"OOOPPS! Something went wrong ! \n {e}")
@@ -430,8 +756,8 @@ class DataBaseManagement:
         """
         try:
             sql = "DELETE FROM Schedules WHERE Email_id = ?"
-            self.cursor.execute(sql, (email_id,))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email_id,))
             logger.success(f"{email_id} Schedule deleted successfuly ! ")
 
         except Exception as e:
@@ -441,16 +767,17 @@ class DataBaseManagement:
         else:
             return True
 
-    def update_schedule(self, email_id: int, scheduled_date: str) -> bool :
+    def update_schedule(self, email_id: int, scheduled_date: datetime) -> bool :
         """ Update a schedule by ID
         """
         try:
+            #! a moved schedule starts over, whoever held a lease on it, even after a failed delivery
             sql = """UPDATE Schedules
-                SET Scheduled_date = ?
+                SET Scheduled_date = ?, Lease_until = NULL, Claimed_by = NULL, Failed_at = NULL
                 WHERE Email_id = ?
                 """
-            self.cursor.execute(sql, (email_id, scheduled_date))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (to_utc(scheduled_date), email_id))
             logger.success(f"{email_id} Scheduled_date Updated Successfuly!")
 
         except Exception as e:
@@ -460,19 +787,20 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_all_schedules(self) -> list:
+    def get_all_schedules(self) -> list[Schedule]:
         """ Retrieve all schedules with correct datetime parsing """
         try:
-            sql = "SELECT * FROM Schedules"
-            self.cursor.execute(sql)
-            rows = self.cursor.fetchall()
+            sql = "SELECT Email_id, Scheduled_date, User_id FROM Schedules"
+            with self._cursor() as cursor:
+                cursor.execute(sql)
+                rows = cursor.fetchall()
             schedules = []
             for row in rows:
                 email_id = row[0]
                 sched_date = row[1]
                 if isinstance(sched_date, str) and sched_date.startswith("datetime.datetime"):
                     sched_date = parse_datetime_repr(sched_date)
-                schedules.append((email_id, sched_date))
+                schedules.append(Schedule(email_id, from_utc(sched_date), row[2]))
             return schedules
         except Exception as e:
             logger.error(f"OOPS! Something went wrong! {e}")
@@ -480,6 +808,164 @@ class DataBaseManagement:
         else:
             return True
 
+    def get_pending_schedules(self, changed_after: datetime | None = None) -> list[Schedule]:
+        """ Retrieve schedules whose email has not been delivered yet.
+
+        :param changed_after: only schedules added or edited after this Changed_at stamp,
+            None for all of them
+        :type changed_after: datetime | None
+        :return: Schedule rows with UTC-aware dates, ordered by Changed_at
+        :rtype: list[Schedule]
+        """
+        try:
+            filters, params = "", ()
+            if changed_after is not None:
+                filters, params = queries.PENDING_SCHEDULES_AFTER, (changed_after,)
+            sql = queries.PENDING_SCHEDULES.format(filters=filters)
+            with self._cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            return [Schedule(row[0], from_utc(row[1]), row[2], row[3]) for row in rows]
+
+        except Exception as e:
+            logger.error(f"Failed to get_pending_schedules {e}")
+            return []
+
+    def claim_due_schedules(self, limit: int, lease_seconds: float, owner: str | None = None) -> list[DueSchedule]:
+        """ Claim up to ``limit`` due, undelivered schedules for dispatch.
+
+        Rows locked by a concurrent claim are skipped (SKIP LOCKED) instead of waited for, so
+        any number of dispatchers on any number of nodes split the due work without sending
+        a row twice and without a global lock. A claim is a lease: until Lease_until passes
+        nobody else claims the row; after that (the dispatcher died, or the email is still
+        not delivered) it is claimable again. Schedules whose delivery the outbox gave up
+        on (Failed_at, see ``mark_outbox_failed``) are never claimed.
+
+        :param limit: maximum number of schedules to claim
+        :type limit: int
+        :param lease_seconds: how long the claim is held
+        :type lease_seconds: float
+        :param owner: recorded in Claimed_by for diagnosis, defaults to host:pid
+        :type owner: str | None
+        :return: the claimed schedules with their email and owner's address
+        :rtype: list[DueSchedule]
+        """
+        now = _utc_now()
+        owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(queries.CLAIM_DUE_SCHEDULES, (now, now, limit))
+                email_ids = [row[0] for row in cursor.fetchall()]
+                if not email_ids:
+                    return []
+                #! assigning Changed_at to itself keeps the claim from looking like an edit to the dispatcher
+                cursor.execute(f"""UPDATE Schedules SET Lease_until = ?, Claimed_by = ?, Changed_at = Changed_at
+                        WHERE Email_id IN ({_placeholders(email_ids)})""",
+                               (now + timedelta(seconds=lease_seconds), owner, *email_ids))
+                cursor.execute(f"""SELECT s.Email_id, s.User_id, u.Email, se.Recipients, se.Subject, se.Body,
+                            s.Scheduled_date, s.Recurrence, s.Recurrence_until
+                        FROM Schedules s
+                        JOIN Sent_Emails se ON se.Email_id = s.Email_id
+                        JOIN User_profile u ON u.User_id = s.User_id
+                        WHERE s.Email_id IN ({_placeholders(email_ids)})""", tuple(email_ids))
+                rows = cursor.fetchall()
+            return [DueSchedule(*row[:6], from_utc(row[6]), row[7], from_utc(row[8])) for row in rows]
+
+        except Exception as e:
+            logger.error(f"Failed to claim_due_schedules {e}")
+            return []
+
+    def advance_schedules(self, advances: list[tuple]) -> bool:
+        """ Move recurring schedules to their next occurrence and release their claim.
+
+        :param advances: (email_id, next occurrence) tuples; a None occurrence ends the
+            recurrence by marking the draft as done
+        :type advances: list[tuple]
+        :return: True or False
+        :rtype: bool
+        """
+        if not advances:
+            return True
+        moved = [(to_utc(next_date), email_id) for email_id, next_date in advances if next_date is not None]
+        finished = [(email_id,) for email_id, next_date in advances if next_date is None]
+        try:
+            with self._cursor() as cursor:
+                if moved:
+                    #! Changed_at is bumped on purpose so dispatchers push the next occurrence
+                    cursor.executemany("""UPDATE Schedules SET Scheduled_date = ?, Lease_until = NULL, Claimed_by = NULL
+                            WHERE Email_id = ?""", moved)
+                if finished:
+                    cursor.executemany("UPDATE Sent_Emails SET notified = TRUE WHERE Email_id = ?", finished)
+                    cursor.executemany("""UPDATE Schedules SET Lease_until = NULL, Claimed_by = NULL
+                            WHERE Email_id = ?""", finished)
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to advance_schedules {e}")
+            return False
+
+    def release_schedule_claims(self, email_ids: list[int]) -> bool:
+        """ Drop the lease on ``email_ids`` so they can be claimed again right away
+        """
+        if not email_ids:
+            return True
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(f"""UPDATE Schedules SET Lease_until = NULL, Claimed_by = NULL, Changed_at = Changed_at
+                        WHERE Email_id IN ({_placeholders(email_ids)})""", tuple(email_ids))
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to release_schedule_claims {e}")
+            return False
+
+    def get_schedules_view(self, user_id: int, start: datetime | None = None, end: datetime | None = None,
+                           pending: bool = False, failed: bool = False) -> list[ScheduleView]:
+        """ Retrieve a user's schedules joined with their email in one round trip.
+
+        Filters on owner and on ``start <= Scheduled_date < end`` in SQL (either bound may be
+        None) using idx_schedules_user_date, ordered by due time. ``pending`` and ``failed``
+        narrow the rows in SQL as well, so a window without a start bound does not drag the
+        whole delivered history along.
+
+        :param user_id: owner of the schedules
+        :type user_id: int
+        :param start: inclusive lower bound, aware or LOCAL_TZ wall time
+        :type start: datetime | None
+        :param end: exclusive upper bound, aware or LOCAL_TZ wall time
+        :type end: datetime | None
+        :param pending: only schedules still to be delivered (not notified, not failed)
+        :type pending: bool
+        :param failed: only schedules the outbox gave up on
+        :type failed: bool
+        :return: ScheduleView rows, scheduled_date and failed_at as aware UTC
+        :rtype: list[ScheduleView]
+        """
+        try:
+            filters, params = "", [user_id]
+            if start is not None:
+                filters += queries.SCHEDULES_VIEW_FROM
+                params.append(to_utc(start))
+            if end is not None:
+                filters += queries.SCHEDULES_VIEW_UNTIL
+                params.append(to_utc(end))
+            if pending:
+                filters += queries.SCHEDULES_VIEW_PENDING
+            if failed:
+                filters += queries.SCHEDULES_VIEW_FAILED
+            sql = queries.SCHEDULES_VIEW.format(filters=filters)
+
+            with self._cursor() as cursor:
+                cursor.execute(sql, tuple(params))
+                rows = cursor.fetchall()
+            return [ScheduleView(email_id, recipient, subject, from_utc(scheduled_date), notified, recurrence,
+                                 from_utc(failed_at))
+                    for email_id, recipient, subject, scheduled_date, notified, recurrence, failed_at in rows]
+
+        except Exception as e:
+            logger.error(f"Failed to get schedules view for {user_id} \n {e}")
+            return []
+
     def set_user_profile(self, name: str, title: str, proffesion: str,
                         signiture: str, email: str,encrypted_password: str,
                         ) -> bool:
@@ -490,8 +976,8 @@ class DataBaseManagement:
             User_profile(Name, Title, Proffesion, Signiture, Email, Encrypted_password)
             VALUES(?, ?, ?, ?, ?, ?)
             """
-            self.cursor.execute(sql, (name, title, proffesion, signiture, email, encrypted_password))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (name, title, proffesion, signiture, email, encrypted_password))
             logger.success(f"User : {name} Added Successfuly")
 
         except Exception as e:
@@ -501,12 +987,15 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_user_profile(self, user_id: int, email: str) -> tuple:
+    def get_user_profile(self, user_id: int, email: str, fields: tuple | None = None) -> UserProfile | None:
         """Retrieve a user profile by ID and Email"""
         try:
-            sql = "SELECT * FROM User_profile WHERE User_id = %s AND Email = %s"
-            self.cursor.execute(sql, (user_id, email))
-            return self.cursor.fetchone()
+            fields, columns = select_columns(UserProfile, fields)
+            sql = f"SELECT {columns} FROM User_profile WHERE User_id = %s AND Email = %s"
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id, email))
+                row = cursor.fetchone()
+            return to_rows(UserProfile, fields, [row])[0] if row else None
 
         except Exception as e:
                 logger.error(f"Failed to retrieve user profile for {email} (ID: {user_id})\n{e}")
@@ -515,13 +1004,15 @@ class DataBaseManagement:
         else:
                 return True
 
-    def get_all_user_profile(self) -> tuple:
-        """ Retrieve all user profiles
+    def get_all_user_profile(self, fields: tuple | None = None) -> list[UserProfile]:
+        """ Retrieve all user profiles, without Encrypted_password unless asked for in ``fields``
         """
         try:
-            sql = "SELECT * FROM User_profile"
-            self.cursor.execute(sql)
-            return self.cursor.fetchall()
+            fields, columns = select_columns(UserProfile, fields or LIST_FIELDS[UserProfile])
+            sql = f"SELECT {columns} FROM User_profile"
+            with self._cursor() as cursor:
+                cursor.execute(sql)
+                return to_rows(UserProfile, fields, cursor.fetchall())
 
         except Exception as e:
             logger.error(f"OOPPS! Something went wrong sir/miss ! {e}")
@@ -535,8 +1026,10 @@ class DataBaseManagement:
         """
         try:
             sql = "DELETE FROM User_profile WHERE User_id = ?"
-            self.cursor.execute(sql, (user_id,))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id,))
+            get_credential_service().invalidate(user_id)
+            revoke_user(user_id)
             logger.success(f"{user_id} Deleted successfuly!")
 
 
@@ -558,8 +1051,10 @@ class DataBaseManagement:
             Signiture = ? , Email = ?, Encrypted_password = ?
             WHERE User_id = ?
             """
-            self.cursor.execute(sql, (name , title, proffesion, signiture, email, encrypted_password, user_id))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (name , title, proffesion, signiture, email, encrypted_password, user_id))
+            get_credential_service().invalidate(user_id)
+            revoke_user(user_id)
             logger.success(f"{user_id} {name} Information Updated Successfuly!")
 
         except Exception as e:
@@ -574,8 +1069,8 @@ class DataBaseManagement:
         """
         try:
             sql= "INSERT INTO Social_media(LinkedIn, X, Telegram, Github) VALUES(?, ? , ?, ?) WHERE User_id = ?"
-            self.cursor.execute(sql, (user_id, linkedin, x, telegram, github))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id, linkedin, x, telegram, github))
             logger.success(f"{user_id} social media inserted successfuly !")
 
         except Exception as e:
@@ -590,8 +1085,8 @@ class DataBaseManagement:
         """
         try:
             sql= "DELETE FROM Social_media WHERE User_id = ?"
-            self.cursor.execute(sql)
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql)
             logger.success(f"{user_id} Social Media Deleted successfuly ! ")
 
         except Exception as e:
@@ -601,13 +1096,16 @@ class DataBaseManagement:
         else:
             return True
 
-    def get_user_social_media(self, user_id: int) -> tuple:
+    def get_user_social_media(self, user_id: int) -> SocialMedia | None:
         """ Retrieve user social media accounts by ID
         """
         try:
-            sql = "SELECT * FROM Social_media Where User_id = ?"
-            self.cursor.execute(sql, (user_id))
-            return self.cursor.fetchone()
+            fields, columns = select_columns(SocialMedia)
+            sql = f"SELECT {columns} FROM Social_media Where User_id = ?"
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_id,))
+                row = cursor.fetchone()
+            return to_rows(SocialMedia, fields, [row])[0] if row else None
 
         except Exception as e:
             logger.error(f"OOPPS! Something went wrong ! {e}")
@@ -632,14 +1130,14 @@ class DataBaseManagement:
         """"""
         try:
             sql = "SELECT Encrypted_password FROM User_profile WHERE Email = ?"
-            self.cursor.execute(sql, (email,))
-            result = self.cursor.fetchone()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (email,))
+                result = cursor.fetchone()
 
             if result:
                 encrypted_password = result[0]
-                key = generate_key("securepassword")
-                decrypted_password = decrypt(encrypted_password, key)
-                if decrypted_password == entered_password:
+                decrypted_password = decrypt(encrypted_password, app_key())
+                if hmac.compare_digest(decrypted_password.encode(), entered_password.encode()):
                     return True
                 return False
             return False
@@ -651,15 +1149,9 @@ class DataBaseManagement:
         """count newly email sents
         """
         try:
-            sql= """
-                SELECT COUNT(*)
-                FROM Sent_Emails
-                WHERE Recipients = %s
-                AND sent_date >= NOW() - INTERVAL 1 DAY
-                AND notified = FALSE
-            """
-            self.cursor.execute(sql, (user_email,))
-            result = self.cursor.fetchone()
+            with self._cursor() as cursor:
+                cursor.execute(queries.NEWLY_SENT_COUNT, (user_email, _utc_now() - timedelta(days=1)))
+                result = cursor.fetchone()
             return result[0] if result else 0
 
         except Exception as e:
@@ -673,11 +1165,11 @@ class DataBaseManagement:
                 UPDATE Sent_Emails
                 SET notified = TRUE
                 WHERE Recipients = %s
-                AND sent_date >= NOW() - INTERVAL 1 DAY
+                AND sent_date >= UTC_TIMESTAMP() - INTERVAL 1 DAY
                 AND notified = FALSE
             """
-            self.cursor.execute(sql, (user_email,))
-            self.connection.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (user_email,))
         except Exception as e:
             logger.error(f"Something went wrong! {e}")
 
@@ -686,9 +1178,9 @@ class DataBaseManagement:
         """reset sent emails
         """
         try:
-            self.cursor.execute("DELETE FROM Sent_Emails")
-            self.cursor.execute("ALTER TABLE Sent_Emails AUTO_INCREMENT = 1")
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute("DELETE FROM Sent_Emails")
+                cursor.execute("ALTER TABLE Sent_Emails AUTO_INCREMENT = 1")
             logger.success("SentEmails tables have been truncated and reset.")
         except Exception as e:
             logger.error(f"Error resetting tables: {e}")
@@ -697,9 +1189,9 @@ class DataBaseManagement:
         """resets schedules
         """
         try:
-            self.cursor.execute("DELETE FROM Schedules")
-            self.cursor.execute("ALTER TABLE Schedules AUTO_INCREMENT = 1")
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute("DELETE FROM Schedules")
+                cursor.execute("ALTER TABLE Schedules AUTO_INCREMENT = 1")
             logger.success("Schedules table have been truncated and reset.")
         except Exception as e:
             logger.error(f"Error resetting tables: {e}")
@@ -709,21 +1201,314 @@ class DataBaseManagement:
 
         :param email_id: email id of sent email
         :type email_id: int
-        :param sent_date: date that email sents
+        :param sent_date: date that email sents, aware or LOCAL_TZ wall time
         :type sent_date: datetime
         :return: True or Flase
         :rtype: bool
         """
         try:
             sql = "UPDATE Sent_Emails SET Sent_date = ? WHERE Email_id = ?"
-            self.cursor.execute(sql, (sent_date, email_id))
-            self.conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(sql, (to_utc(sent_date), email_id))
             return True
         except Exception as e:
             logger.error(f"Failed to update Sent_date: {e}")
             return False
 
 
+    # ---------------- Outbox ----------------
+
+    def enqueue_outbox(self, entries: list[OutboxEntry]) -> list[int]:
+        """ Queue emails for delivery. An entry whose idempotency key is already in the
+        outbox is not queued again, so reruns and double submits are harmless.
+
+        :param entries: rows with idempotency_key, user_id, sender, recipient, subject and body set;
+            attachment_name, attachment, email_id (scheduled draft), max_attempts,
+            next_attempt_at and batch_key are optional
+        :type entries: list[OutboxEntry]
+        :return: Outbox ids in the order of ``entries`` (the existing id for duplicates), empty list on failure
+        :rtype: list[int]
+        """
+        if not entries:
+            return []
+        now = _utc_now()
+        keys = [entry.idempotency_key for entry in entries]
+        try:
+            sql = """INSERT INTO Outbox (Idempotency_key, User_id, Sender, Recipient, Subject, Body,
+                        Attachment_name, Attachment, Email_id, Max_attempts, Next_attempt_at, Created_at, Batch_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, DEFAULT(Max_attempts)), ?, ?, ?)
+                    ON DUPLICATE KEY UPDATE id = id"""
+            with self._cursor() as cursor:
+                cursor.executemany(sql, [
+                    (e.idempotency_key, e.user_id, e.sender, e.recipient, e.subject, e.body, e.attachment_name,
+                     e.attachment, e.email_id, e.max_attempts, to_utc(e.next_attempt_at) or now, now, e.batch_key)
+                    for e in entries
+                ])
+                cursor.execute(f"SELECT Idempotency_key, id FROM Outbox WHERE Idempotency_key IN ({_placeholders(keys)})",
+                               tuple(keys))
+                ids = dict(cursor.fetchall())
+            logger.success(f"{len(entries)} emails queued in outbox")
+            return [ids[key] for key in keys]
+
+        except Exception as e:
+            logger.error(f"Failed to enqueue_outbox {e}")
+            return []
+
+    def claim_outbox(self, limit: int, lease_seconds: float) -> list[OutboxEntry]:
+        """ Claim up to ``limit`` due outbox entries for sending.
+
+        Rows locked by another worker are skipped (SKIP LOCKED), so several workers can drain
+        the table concurrently. A claimed row is moved to 'sending' with its Next_attempt_at
+        pushed ``lease_seconds`` ahead; if the worker dies the row becomes due again then.
+
+        :param limit: maximum number of entries to claim
+        :type limit: int
+        :param lease_seconds: how long the claim is held
+        :type lease_seconds: float
+        :return: the claimed entries, Attempts already counting this attempt
+        :rtype: list[OutboxEntry]
+        """
+        now = _utc_now()
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(queries.CLAIM_OUTBOX, (now, limit))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return []
+                cursor.execute(f"""UPDATE Outbox SET State = 'sending', Attempts = Attempts + 1, Next_attempt_at = ?
+                        WHERE id IN ({_placeholders(ids)})""", (now + timedelta(seconds=lease_seconds), *ids))
+                fields, columns = select_columns(OutboxEntry)
+                cursor.execute(f"SELECT {columns} FROM Outbox WHERE id IN ({_placeholders(ids)})", tuple(ids))
+                return to_rows(OutboxEntry, fields, cursor.fetchall())
+
+        except Exception as e:
+            logger.error(f"Failed to claim_outbox {e}")
+            return []
+
+    def claim_outbox_batch(self, batch_key: str, limit: int, lease_seconds: float,
+                           held: list[int] | None = None) -> list[OutboxEntry]:
+        """ Claim the remaining due entries of a coalesced batch.
+
+        Works like ``claim_outbox`` but only on rows with ``batch_key``, through
+        idx_outbox_batch. The lease of the rows in ``held``, claimed earlier by the same
+        worker, is extended to the new lease so the whole batch expires together.
+
+        :param batch_key: Batch_key shared by the batch
+        :type batch_key: str
+        :param limit: maximum number of entries to claim
+        :type limit: int
+        :param lease_seconds: how long the claim is held
+        :type lease_seconds: float
+        :param held: ids of entries of the batch the caller already holds
+        :type held: list[int] | None
+        :return: the newly claimed entries, Attempts already counting this attempt
+        :rtype: list[OutboxEntry]
+        """
+        now = _utc_now()
+        lease_until = now + timedelta(seconds=lease_seconds)
+        try:
+            with self._cursor() as cursor:
+                if held:
+                    cursor.execute(f"UPDATE Outbox SET Next_attempt_at = ? WHERE id IN ({_placeholders(held)})",
+                                   (lease_until, *held))
+                cursor.execute(queries.CLAIM_OUTBOX_BATCH, (batch_key, now, limit))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return []
+                cursor.execute(f"""UPDATE Outbox SET State = 'sending', Attempts = Attempts + 1, Next_attempt_at = ?
+                        WHERE id IN ({_placeholders(ids)})""", (lease_until, *ids))
+                fields, columns = select_columns(OutboxEntry)
+                cursor.execute(f"SELECT {columns} FROM Outbox WHERE id IN ({_placeholders(ids)})", tuple(ids))
+                return to_rows(OutboxEntry, fields, cursor.fetchall())
+
+        except Exception as e:
+            logger.error(f"Failed to claim_outbox_batch {e}")
+            return []
+
+    def mark_outbox_sent(self, entries: list[OutboxEntry]) -> bool:
+        """ Record delivered outbox entries and add them to the sent history in one transaction.
+        Entries queued for a scheduled draft update that Sent_Emails row instead of adding one.
+        """
+        if not entries:
+            return True
+        now = _utc_now()
+        fresh = [entry for entry in entries if entry.email_id is None]
+        drafts = [entry for entry in entries if entry.email_id is not None]
+        try:
+            with self._cursor() as cursor:
+                email_ids = {}
+                if fresh:
+                    cursor.executemany("""INSERT INTO Sent_Emails(Recipients, Subject, Body, Sent_date, User_id)
+                            VALUES (?, ?, ?, ?, ?) RETURNING Email_id""",
+                                       [(e.recipient, e.subject, e.body, now, e.user_id) for e in fresh])
+                    email_ids = {entry.id: row[0] for entry, row in zip(fresh, cursor.fetchall())}
+                if drafts:
+                    cursor.executemany("UPDATE Sent_Emails SET Sent_date = ?, notified = TRUE WHERE Email_id = ?",
+                                       [(now, e.email_id) for e in drafts])
+                cursor.executemany("""UPDATE Outbox SET State = 'sent', Sent_at = ?, Email_id = ?,
+                        Last_error = NULL, Attachment = NULL WHERE id = ?""",
+                                   [(now, email_ids.get(e.id, e.email_id), e.id) for e in entries])
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to mark_outbox_sent {e}")
+            return False
+
+    def mark_outbox_failed(self, failures: list[tuple]) -> bool:
+        """ Record failed delivery attempts.
+        A 'dead' entry queued for a scheduled draft marks that schedule failed in the same
+        transaction, so dispatchers stop claiming it.
+
+        :param failures: (outbox id, 'failed' or 'dead', next attempt time or None, error) tuples
+        :type failures: list[tuple]
+        :return: True on success
+        :rtype: bool
+        """
+        if not failures:
+            return True
+        dead = [outbox_id for outbox_id, state, _, _ in failures if state == "dead"]
+        try:
+            sql = """UPDATE Outbox SET State = ?, Next_attempt_at = COALESCE(?, Next_attempt_at), Last_error = ?
+                    WHERE id = ?"""
+            with self._cursor() as cursor:
+                cursor.executemany(sql, [(state, to_utc(next_attempt_at), (error or "")[:500], outbox_id)
+                                         for outbox_id, state, next_attempt_at, error in failures])
+                if dead:
+                    #! recurring occurrences are queued without Email_id and already advanced, so only drafts match
+                    cursor.execute(f"""UPDATE Schedules s JOIN Outbox o ON o.Email_id = s.Email_id
+                            SET s.Failed_at = ?, s.Lease_until = NULL, s.Claimed_by = NULL, s.Changed_at = s.Changed_at
+                            WHERE o.id IN ({_placeholders(dead)})""", (_utc_now(), *dead))
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to mark_outbox_failed {e}")
+            return False
+
+    def defer_outbox(self, deferrals: list[tuple]) -> bool:
+        """ Put claimed entries back in the queue without using up an attempt.
+
+        For sends refused by quota or throttling: the refusal says nothing about the message,
+        so the attempt counted by the claim is given back. The entries keep their lease as
+        next attempt time until the planner moves them to a slot.
+
+        :param deferrals: (outbox id, reason) tuples
+        :type deferrals: list[tuple]
+        :return: True on success
+        :rtype: bool
+        """
+        if not deferrals:
+            return True
+        try:
+            sql = """UPDATE Outbox SET State = 'queued', Attempts = GREATEST(Attempts - 1, 0), Last_error = ?
+                    WHERE id = ? AND State = 'sending'"""
+            with self._cursor() as cursor:
+                cursor.executemany(sql, [((reason or "")[:500], outbox_id) for outbox_id, reason in deferrals])
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to defer_outbox {e}")
+            return False
+
+    def get_outbox_entries(self, ids: list[int], fields: tuple | None = None) -> list[OutboxEntry]:
+        """ Retrieve outbox entries by id, without body and attachment unless asked for in ``fields``
+        """
+        if not ids:
+            return []
+        fields, columns = select_columns(OutboxEntry, fields or LIST_FIELDS[OutboxEntry])
+        with self._cursor() as cursor:
+            cursor.execute(f"SELECT {columns} FROM Outbox WHERE id IN ({_placeholders(ids)})", tuple(ids))
+            return to_rows(OutboxEntry, fields, cursor.fetchall())
+
+    def get_outbox_stats(self, user_id: int) -> dict[str, int]:
+        """ Count a user's outbox entries per state
+
+        :return: {state: count} for every state, zero when absent
+        :rtype: dict[str, int]
+        """
+        stats = dict.fromkeys(("queued", "sending", "sent", "failed", "dead"), 0)
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(queries.OUTBOX_STATS, (user_id,))
+                stats.update(dict(cursor.fetchall()))
+        except Exception as e:
+            logger.error(f"Failed to get_outbox_stats {e}")
+        return stats
+
+    def get_send_load(self, sender: str, start: datetime, end: datetime) -> dict[datetime, int]:
+        """ Messages of ``sender`` sent or planned per minute in ``[start, end)``.
+
+        Counts queued, retrying and in-flight outbox rows at their Next_attempt_at, delivered
+        rows at their Sent_at, and unclaimed pending schedules of the sender's account at
+        their Scheduled_date (only the next occurrence of a recurring one).
+
+        :param sender: sender account
+        :type sender: str
+        :param start: window start, aware or LOCAL_TZ wall time
+        :type start: datetime
+        :param end: window end (exclusive)
+        :type end: datetime
+        :return: {aware UTC minute: messages}
+        :rtype: dict[datetime, int]
+        """
+        start, end, now = to_utc(start), to_utc(end), _utc_now()
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(queries.SEND_LOAD, (sender, start, end, sender, start, end, sender, now, start, end))
+                rows = cursor.fetchall()
+            return {from_utc(datetime.strptime(minute, "%Y-%m-%d %H:%M")): int(count) for minute, count in rows}
+
+        except Exception as e:
+            logger.error(f"Failed to get_send_load {e}")
+            return {}
+
+    def count_sent_since(self, sender: str, since: datetime) -> int:
+        """ Messages of ``sender`` delivered through the outbox at or after ``since`` (aware or LOCAL_TZ wall time)
+        """
+        try:
+            sql = "SELECT COUNT(*) FROM Outbox WHERE Sender = ? AND State = 'sent' AND Sent_at >= ?"
+            with self._cursor() as cursor:
+                cursor.execute(sql, (sender, to_utc(since)))
+                return int(cursor.fetchone()[0])
+
+        except Exception as e:
+            logger.error(f"Failed to count_sent_since {e}")
+            return 0
+
+    def get_pending_outbox(self, sender: str) -> list[OutboxEntry]:
+        """ Queued and retrying outbox entries of ``sender`` in slot order, with id, Next_attempt_at and Batch_key only
+        """
+        try:
+            fields, columns = select_columns(OutboxEntry, ("id", "next_attempt_at", "batch_key"))
+            with self._cursor() as cursor:
+                cursor.execute(queries.PENDING_OUTBOX.format(columns=columns), (sender,))
+                rows = cursor.fetchall()
+            return _utc_rows(OutboxEntry, fields, rows, ("next_attempt_at",))
+
+        except Exception as e:
+            logger.error(f"Failed to get_pending_outbox {e}")
+            return []
+
+    def reschedule_outbox(self, moves: list[tuple]) -> bool:
+        """ Move queued or retrying outbox entries to new slots.
+
+        :param moves: (outbox id, next attempt time) tuples; rows claimed in the meantime are left alone
+        :type moves: list[tuple]
+        :return: True on success
+        :rtype: bool
+        """
+        if not moves:
+            return True
+        try:
+            with self._cursor() as cursor:
+                cursor.executemany("""UPDATE Outbox SET Next_attempt_at = ?
+                        WHERE id = ? AND State IN ('queued', 'failed')""",
+                                   [(to_utc(next_attempt_at), outbox_id) for outbox_id, next_attempt_at in moves])
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to reschedule_outbox {e}")
+            return False
+
 
 if __name__ == "__main__":
     #! create a object to use database
@@ -67,7 +67,3 @@ def decrypt(encrypted_password: str, key: bytes) -> str:
 
     #! remove space
     return decrypted_password.decode().rstrip()
-
-#  function tests
-password = "mysecretpassword"
-key = generate_key("securepassword")  #! create a key from function
@@ -0,0 +1,304 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import types
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+from loguru import logger
+
+""" Background embedding for the EMS RAG engine.
+
+    Encoding runs in a separate process, so it neither holds the GIL of the Streamlit
+    server nor competes with page renders, and the model can use every core.
+
+    ``EmbeddingProcess`` starts the process on first use and talks to it over two queues.
+    The process gathers requests for up to ``max_wait`` seconds or ``batch_size`` texts,
+    encodes them in one model call and writes the vectors to a shared-memory block; only
+    the block name and the row span of every request travel back through the queue. The
+    caller copies its rows out and releases the block. If the process dies, the pending
+    requests fail and the next request starts a new one. Streamlit runs every page as
+    ``__main__``, and a spawned child re-runs its parent's ``__main__`` before the target;
+    the child is therefore started with ``__main__`` hidden, so it only imports this module
+    and never a page with its dispatcher and outbox worker.
+
+    ``IndexQueue`` is the indexing side: pages put (user id, new Email_ids) on it and
+    return immediately, and a daemon thread coalesces the queue per user and runs one
+    incremental sync for each, which embeds through the embedding process. Because the
+    sync reads every row above the partition's high-water mark, ids queued out of order
+    or lost on a restart are still indexed.
+
+    Classes:
+        EmbedWorkerSettings: Batch size, threads and timeouts, read from the environment.
+        EmbeddingProcess: Batched encoding in a child process, results in shared memory.
+        IndexQueue: Non-blocking queue of emails to index, drained by a daemon thread.
+
+    Functions:
+        get_embedding_process(model): The process-wide embedding process of a model.
+
+    Environment variables:
+        EMS_EMBED_WORKER (0 encodes in-process instead, default 1),
+        EMS_EMBED_BATCH_SIZE (texts per model call, default 64),
+        EMS_EMBED_THREADS (encoder threads, default 0 = all cores),
+        EMS_EMBED_MAX_WAIT (seconds to gather a batch, default 0.05),
+        EMS_EMBED_TIMEOUT (seconds a caller waits for its vectors, default 120)
+"""
+
+
+@dataclass(frozen=True)
+class EmbedWorkerSettings:
+    enabled: bool = True
+    batch_size: int = 64
+    threads: int = 0
+    max_wait: float = 0.05
+    timeout: float = 120.0
+
+    @classmethod
+    def from_env(cls) -> "EmbedWorkerSettings":
+        """ Build settings from EMS_EMBED_* environment variables, falling back to defaults """
+        return cls(
+            enabled=os.getenv("EMS_EMBED_WORKER", "1") != "0",
+            batch_size=int(os.getenv("EMS_EMBED_BATCH_SIZE", cls.batch_size)),
+            threads=int(os.getenv("EMS_EMBED_THREADS", cls.threads)),
+            max_wait=float(os.getenv("EMS_EMBED_MAX_WAIT", cls.max_wait)),
+            timeout=float(os.getenv("EMS_EMBED_TIMEOUT", cls.timeout)),
+        )
+
+
+def _gather(jobs, first: tuple, settings: EmbedWorkerSettings) -> tuple[list[tuple], bool]:
+    """ Collect requests after ``first`` until the batch is full or ``max_wait`` passed; True once told to stop """
+    batch, count = [first], len(first[1])
+    deadline = time.monotonic() + settings.max_wait
+    while count < settings.batch_size:
+        try:
+            job = jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if job is None:
+            return batch, True
+        batch.append(job)
+        count += len(job[1])
+    return batch, False
+
+
+def _encode_loop(model: str, settings: EmbedWorkerSettings, jobs, results):
+    """ Body of the embedding process: encode batches of (job id, texts) and publish them in shared memory """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(settings.threads or os.cpu_count() or 1)
+    encoder = SentenceTransformer(model)
+    stop = False
+    while not stop:
+        job = jobs.get()
+        if job is None:
+            break
+        batch, stop = _gather(jobs, job, settings)
+        spans, offset = [], 0
+        for job_id, texts in batch:
+            spans.append((job_id, offset, len(texts)))
+            offset += len(texts)
+        try:
+            vectors = encoder.encode([text for _, texts in batch for text in texts],
+                                     batch_size=settings.batch_size, convert_to_numpy=True)
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            block = shared_memory.SharedMemory(create=True, size=max(vectors.nbytes, 1))
+            view = np.ndarray(vectors.shape, dtype=np.float32, buffer=block.buf)
+            view[:] = vectors
+            #! the view must go before the block can be closed; the reader unlinks it
+            del view
+            block.close()
+            results.put((block.name, vectors.shape, spans, None))
+        except Exception as e:
+            results.put((None, None, spans, f"{type(e).__name__}: {e}"))
+
+
+@contextmanager
+def _bare_main():
+    """ Swap ``__main__`` for an empty module while a spawned child is started """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class EmbeddingProcess:
+    def __init__(self, model: str, settings: EmbedWorkerSettings | None = None):
+        """Sentence encoder running in a child process
+
+        :param model: sentence-transformers model name, loaded by the child
+        :type model: str
+        :param settings: batch and thread settings, defaults to ``EmbedWorkerSettings.from_env()``
+        :type settings: EmbedWorkerSettings | None
+        """
+        self.model = model
+        self.settings = settings or EmbedWorkerSettings.from_env()
+        self._ids = itertools.count()
+        self._pending: dict[int, Future] = {}
+        self._process = None
+        self._jobs = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        #! spawn, not fork: the parent runs threads and may hold torch state
+        context = mp.get_context("spawn")
+        self._jobs, results = context.Queue(), context.Queue()
+        #! every process generation has its own pending map, failed together if it dies
+        self._pending = {}
+        self._process = context.Process(target=_encode_loop, args=(self.model, self.settings, self._jobs, results),
+                                        name="ems-embedder", daemon=True)
+        #! otherwise the child re-runs the page script that is __main__ right now
+        with _bare_main():
+            self._process.start()
+        threading.Thread(target=self._read, args=(self._process, results, self._pending),
+                         name="ems-embedder-results", daemon=True).start()
+        logger.info(f"Started embedding process {self._process.pid} for {self.model}")
+
+    def _read(self, process, results, pending: dict[int, Future]):
+        """ Hand the vectors of every finished batch to their callers until the process exits """
+        while True:
+            try:
+                name, shape, spans, error = results.get(timeout=1.0)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                with self._lock:
+                    futures = list(pending.values())
+                    pending.clear()
+                for future in futures:
+                    future.set_exception(RuntimeError(f"embedding process exited with code {process.exitcode}"))
+                return
+            with self._lock:
+                futures = [(pending.pop(job_id, None), offset, count) for job_id, offset, count in spans]
+            if error is not None:
+                for future, _, _ in futures:
+                    if future is not None:
+                        future.set_exception(RuntimeError(error))
+                continue
+            block = shared_memory.SharedMemory(name=name)
+            try:
+                view = np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+                for future, offset, count in futures:
+                    if future is not None:
+                        future.set_result(view[offset:offset + count].copy())
+                del view
+            finally:
+                block.close()
+                block.unlink()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """ Embeddings of ``texts``, computed by the child process; blocks the calling thread only.
+
+        :param texts: texts to embed
+        :type texts: list[str]
+        :return: float32 array with one row per text
+        :rtype: np.ndarray
+        """
+        texts = list(texts)
+        future: Future = Future()
+        with self._lock:
+            self._ensure_started()
+            job_id = next(self._ids)
+            self._pending[job_id] = future
+            self._jobs.put((job_id, texts))
+        return future.result(timeout=self.settings.timeout)
+
+    def stop(self):
+        """ Let the child finish its current batch and exit """
+        with self._lock:
+            process, self._process = self._process, None
+            if process is not None and process.is_alive():
+                self._jobs.put(None)
+        if process is not None:
+            process.join(self.settings.timeout)
+
+
+class IndexQueue:
+    def __init__(self, sync: Callable[[int], int]):
+        """Indexes new emails off the request thread
+
+        :param sync: incremental sync of one user's partition, returning the number of emails indexed
+        :type sync: Callable[[int], int]
+        """
+        self.sync = sync
+        self._queue: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def put(self, user_id: int, email_ids: Iterable[int] = ()):
+        """ Queue new emails of ``user_id`` for indexing and return at once; without ids the user is just synced """
+        self._queue.put((user_id, list(email_ids)))
+
+    def run_once(self, timeout: float = 1.0) -> int:
+        """ Wait up to ``timeout`` for queued emails, then sync every user queued meanwhile.
+
+        :return: number of emails indexed
+        :rtype: int
+        """
+        try:
+            user_id, email_ids = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+        queued: dict[int, set[int]] = {user_id: set(email_ids)}
+        while True:
+            try:
+                user_id, email_ids = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            queued.setdefault(user_id, set()).update(email_ids)
+        indexed = 0
+        for user_id, email_ids in queued.items():
+            try:
+                count = self.sync(user_id)
+            except Exception as e:
+                logger.error(f"Indexing emails of user {user_id} failed: {e!s}")
+                continue
+            indexed += count
+            if count:
+                logger.info(f"Indexed {count} emails of user {user_id} ({len(email_ids)} queued)")
+        return indexed
+
+    def run_forever(self):
+        """ Drain the queue until ``stop`` is called """
+        while not self._stop.is_set():
+            self.run_once()
+
+    def start(self):
+        """ Run the queue on a daemon thread """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="ems-indexer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_processes: dict[str, EmbeddingProcess] = {}
+_processes_lock = threading.Lock()
+
+
+def get_embedding_process(model: str) -> EmbeddingProcess:
+    """ Return the process-wide embedding process of ``model``; the child starts on the first request """
+    process = _processes.get(model)
+    if process is None:
+        with _processes_lock:
+            process = _processes.get(model)
+            if process is None:
+                process = EmbeddingProcess(model)
+                _processes[model] = process
+    return process
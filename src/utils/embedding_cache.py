@@ -0,0 +1,158 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Callable
+
+import numpy as np
+
+""" Content-addressed embedding cache for the RAG engine.
+
+    A templated campaign stores hundreds of nearly identical bodies, and users repeat the
+    same drafts as search queries. ``EmbeddingCache`` keys every embedding by a SHA-256 of
+    the model name and the normalized text (Unicode NFC, whitespace collapsed), so any
+    text the model has already seen is never encoded again:
+
+    - identical texts within one batch are encoded once,
+    - a bounded in-memory LRU serves recent texts without touching disk,
+    - an SQLite file next to the vector indexes keeps every embedding across restarts.
+
+    ``stats()`` reports memory hits, disk hits and misses together with the hit rate.
+
+    Classes:
+        EmbeddingCache: Two-tier (memory LRU, SQLite) embedding cache with hit counters.
+
+    Functions:
+        normalize(text): Canonical form of a text for keying.
+        get_embedding_cache(model, dimension): The process-wide cache of a model.
+
+    Environment variables:
+        EMS_VECTOR_DIR (directory of the SQLite file, default "data/vectors"),
+        EMS_EMBED_CACHE_ENTRIES (memory tier size, default 10000)
+"""
+
+
+def normalize(text: str) -> str:
+    """ Canonical form of ``text``: NFC, runs of whitespace collapsed to one space, stripped """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    def __init__(self, model: str, dimension: int, path: str | None = None, max_entries: int = 10000):
+        """Embedding cache keyed by model and normalized text
+
+        :param model: embedding model name, part of every key
+        :type model: str
+        :param dimension: embedding dimension
+        :type dimension: int
+        :param path: SQLite file, None for a memory-only cache
+        :type path: str | None
+        :param max_entries: memory tier size; least recently used entries beyond it are dropped
+        :type max_entries: int
+        """
+        self.model = model
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model}\0{normalize(text)}".encode()).digest()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        #! SQLite caps bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' * len(chunk))})",
+                                    chunk).fetchall()
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+
+    def encode(self, texts: list[str], encoder: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """ Embeddings of ``texts``, calling ``encoder`` only for texts seen by no tier.
+
+        :param texts: texts to embed
+        :type texts: list[str]
+        :param encoder: the model's batch encode function
+        :type encoder: Callable[[list[str]], np.ndarray]
+        :return: float32 array of shape (len(texts), dimension), in the order of ``texts``
+        :rtype: np.ndarray
+        """
+        keys = [self.key(text) for text in texts]
+        vectors: dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            #! repeats within the batch are served by their first occurrence
+            self.memory_hits += len(keys) - len(unique)
+            for key in unique:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[key] = vector
+                    self.memory_hits += 1
+            on_disk = self._load([key for key in unique if key not in vectors])
+            for key, vector in on_disk.items():
+                self._remember(key, vector)
+                self.disk_hits += 1
+            vectors.update(on_disk)
+
+        #! one model call for the distinct missing texts, encoded in their normalized form
+        missing = {key: normalize(text) for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            encoded = np.asarray(encoder(list(missing.values())), dtype=np.float32).reshape(len(missing), -1)
+            with self._lock:
+                self.misses += len(missing)
+                for key, vector in zip(missing, encoded):
+                    vectors[key] = vector
+                    self._remember(key, vector)
+                if self._db is not None:
+                    self._db.executemany("INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                                         [(key, vectors[key].tobytes()) for key in missing])
+        if not keys:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self) -> dict:
+        """ Hit / miss counters per tier and current memory size """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "entries": len(self._entries), "hit_rate": hits / total if total else 0.0}
+
+
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str, dimension: int) -> EmbeddingCache:
+    """ Return the process-wide embedding cache of ``model`` """
+    cache = _caches.get(model)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(model)
+            if cache is None:
+                path = os.path.join(os.getenv("EMS_VECTOR_DIR", "data/vectors"), "embeddings.sqlite")
+                cache = EmbeddingCache(model, dimension, path, int(os.getenv("EMS_EMBED_CACHE_ENTRIES", 10000)))
+                _caches[model] = cache
+    return cache
@@ -0,0 +1,108 @@
+import argparse
+import time
+from dataclasses import replace
+
+import faiss
+import numpy as np
+
+from utils.vector_store import INDEX_TYPES, VectorStoreSettings, build_index
+
+""" Recall / latency / memory benchmark of the vector index types.
+
+    Every index type of utils.vector_store is built with ``build_index``, exactly as a
+    compaction would build it, on synthetic corpora shaped like a sent-email history:
+    emails are variations of campaign templates, so the corpus is made of tight clusters
+    of near-duplicates, normalized like sentence-transformers embeddings. Queries are
+    perturbed corpus vectors, searched one at a time as the RAG engine does. Against the
+    exact flat index the benchmark reports per type
+
+    - recall@k: share of the exact k nearest ids found,
+    - p50 / p99 single-query latency in milliseconds,
+    - memory: size of the serialized index, which is what the process maps,
+    - build: training and insertion time in seconds.
+
+        cd src && python -m utils.index_benchmark
+        cd src && python -m utils.index_benchmark --sizes 10000 1000000 --types flat hnsw --k 5
+
+    Search and training parameters come from the EMS_VECTOR_* variables, so a setting can
+    be tried here before it is deployed.
+
+    Functions:
+        synthetic_corpus(size, dimension, seed): Template-clustered unit vectors.
+        benchmark(size, index_types, ...): One result row per index type for one corpus size.
+"""
+
+
+def synthetic_corpus(size: int, dimension: int = 384, seed: int = 0) -> np.ndarray:
+    """ ``size`` unit vectors clustered around size / 50 templates """
+    rng = np.random.default_rng(seed)
+    templates = rng.standard_normal((max(1, size // 50), dimension), dtype=np.float32)
+    #! personalisation moves an email a little away from its template
+    vectors = templates[rng.integers(0, len(templates), size)] + 0.3 * rng.standard_normal((size, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark(size: int, index_types=INDEX_TYPES, k: int = 10, queries: int = 200, dimension: int = 384,
+              settings: VectorStoreSettings | None = None, seed: int = 0) -> list[dict]:
+    """ Build every index type on one synthetic corpus and measure it against the exact search.
+
+    :param size: corpus size
+    :type size: int
+    :param index_types: types to measure
+    :param k: neighbours per query
+    :type k: int
+    :param queries: number of queries
+    :type queries: int
+    :param dimension: vector dimension
+    :type dimension: int
+    :param settings: index parameters, defaults to ``VectorStoreSettings.from_env()``
+    :type settings: VectorStoreSettings | None
+    :return: {"type", "size", "recall", "p50_ms", "p99_ms", "memory_mb", "build_s"} per type
+    :rtype: list[dict]
+    """
+    settings = settings or VectorStoreSettings.from_env()
+    rng = np.random.default_rng(seed + 1)
+    corpus = synthetic_corpus(size, dimension, seed)
+    ids = np.arange(1, size + 1, dtype=np.int64)
+    probes = corpus[rng.integers(0, size, queries)] + 0.1 * rng.standard_normal((queries, dimension), dtype=np.float32)
+    probes = np.ascontiguousarray(probes, dtype=np.float32)
+    _, truth = build_index(corpus, ids, "flat", settings).search(probes, k)
+
+    results = []
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = build_index(corpus, ids, index_type, replace(settings, index_type=index_type))
+        build_seconds = time.perf_counter() - started
+        latencies = []
+        found = np.empty((queries, k), dtype=np.int64)
+        for i in range(queries):
+            started = time.perf_counter()
+            _, found[i:i + 1] = index.search(probes[i:i + 1], k)
+            latencies.append((time.perf_counter() - started) * 1000)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(queries)])
+        results.append({
+            "type": index_type, "size": size, "recall": float(recall),
+            "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+            "memory_mb": faiss.serialize_index(index).nbytes / 2 ** 20, "build_s": build_seconds,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EMS vector index benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="corpus sizes")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES), help="index types")
+    parser.add_argument("--k", type=int, default=10, help="neighbours per query")
+    parser.add_argument("--queries", type=int, default=200, help="queries per corpus")
+    parser.add_argument("--dimension", type=int, default=384, help="vector dimension")
+    args = parser.parse_args()
+
+    print(f"{'size':>9} {'type':<9} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8} {'memory MB':>10} {'build s':>8}")
+    for size in args.sizes:
+        for row in benchmark(size, args.types, args.k, args.queries, args.dimension):
+            print(f"{row['size']:>9} {row['type']:<9} {row['recall']:>9.3f} {row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} "
+                  f"{row['memory_mb']:>10.1f} {row['build_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from utils import queries
+from utils.pool import ConnectionPoolManager, get_pool
+from utils.rows import LIST_FIELDS, OutboxEntry, Profile, Reminder, Schedule, SentEmail, Template, select_columns
+
+""" EXPLAIN-based index report for EMS.
+
+    Each entry below takes its SQL from utils.queries, the same constant the named
+    DataBaseManagement method executes, binds sample parameters of the types the method
+    binds, and names the index (see utils.migrations) the query is expected to use. The
+    report runs EXPLAIN for every entry and flags any query the optimizer plans as a full
+    table scan or against a different key. For joined queries ``table`` is the alias the
+    plan row is reported under.
+
+        cd src && python -m utils.indexes
+
+    Note that on nearly empty tables the optimizer may legitimately prefer a scan; run the
+    report against a database with realistic row counts.
+
+    Classes:
+        IndexCheck: One method's query and the index it should hit.
+
+    Functions:
+        explain(check, pool): EXPLAIN one IndexCheck and return the plan row for its table.
+        index_report(pool): EXPLAIN every IndexCheck and return the results.
+"""
+
+
+@dataclass(frozen=True)
+class IndexCheck:
+    method: str
+    sql: str
+    params: tuple
+    table: str
+    expected_index: str
+
+
+def _columns(row_type: type, fields: tuple | None = None) -> str:
+    return select_columns(row_type, fields)[1]
+
+
+#! bound the way the methods bind them: naive UTC, like _utc_now() in utils.db
+_NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+_SENDER = "someone@example.com"
+
+INDEX_CHECKS: list[IndexCheck] = [
+    IndexCheck("get_profile",
+               queries.PROFILE_BY_EMAIL.format(columns=_columns(Profile)),
+               (_SENDER, 1), "Profiles", "uq_profiles_user_email"),
+    IndexCheck("get_all_profiles",
+               queries.PROFILES_OF_USER.format(columns=_columns(Profile, LIST_FIELDS[Profile])),
+               (1,), "Profiles", "uq_profiles_user_email"),
+    IndexCheck("get_all_templates",
+               queries.TEMPLATES_OF_USER.format(columns=_columns(Template, LIST_FIELDS[Template])),
+               (1,), "Templates", "idx_templates_user"),
+    IndexCheck("get_all_sent_emails",
+               queries.SENT_EMAILS_OF_USER.format(columns=_columns(SentEmail, LIST_FIELDS[SentEmail])),
+               (1,), "Sent_Emails", "idx_sent_user_date"),
+    IndexCheck("get_sent_emails_since",
+               queries.SENT_EMAILS_SINCE.format(columns=_columns(SentEmail, ("email_id", "body"))),
+               (1, 0, 256), "Sent_Emails", "idx_sent_user_id"),
+    IndexCheck("get_sent_emails_page",
+               queries.SENT_EMAILS_PAGE.format(filters=queries.SENT_EMAILS_PAGE_AFTER),
+               (1, _NOW, _NOW, 1000, 10), "Sent_Emails", "idx_sent_user_date"),
+    IndexCheck("get_newly_sent_emails_count",
+               queries.NEWLY_SENT_COUNT,
+               (_SENDER, _NOW - timedelta(days=1)), "Sent_Emails", "idx_sent_recipient_notified"),
+    IndexCheck("get_schedule",
+               queries.SCHEDULE_BY_EMAIL.format(columns=_columns(Schedule)),
+               (1,), "Schedules", "idx_schedules_email"),
+    IndexCheck("get_pending_schedules",
+               queries.PENDING_SCHEDULES.format(filters=queries.PENDING_SCHEDULES_AFTER),
+               (_NOW - timedelta(minutes=1),), "s", "idx_schedules_changed"),
+    IndexCheck("claim_due_schedules",
+               queries.CLAIM_DUE_SCHEDULES,
+               (_NOW, _NOW, 50), "s", "idx_schedules_date"),
+    IndexCheck("get_schedules_view",
+               queries.SCHEDULES_VIEW.format(filters=queries.SCHEDULES_VIEW_UNTIL + queries.SCHEDULES_VIEW_PENDING),
+               (1, _NOW), "s", "idx_schedules_user_date"),
+    IndexCheck("get_reminder",
+               queries.REMINDER_BY_EMAIL.format(columns=_columns(Reminder)),
+               (1,), "Reminders", "idx_reminders_email"),
+    IndexCheck("claim_due_reminders",
+               queries.CLAIM_DUE_REMINDERS,
+               (_NOW, _NOW, 100), "Reminders", "idx_reminders_due"),
+    IndexCheck("get_next_reminder_time",
+               queries.NEXT_REMINDER_TIME,
+               (), "Reminders", "idx_reminders_due"),
+    IndexCheck("claim_outbox_batch",
+               queries.CLAIM_OUTBOX_BATCH,
+               ("0" * 64, _NOW, 500), "Outbox", "idx_outbox_batch"),
+    IndexCheck("get_send_load",
+               queries.SEND_LOAD,
+               (_SENDER, _NOW, _NOW + timedelta(days=1), _SENDER, _NOW - timedelta(days=1), _NOW,
+                _SENDER, _NOW, _NOW, _NOW + timedelta(days=1)), "Outbox", "idx_outbox_sender"),
+    IndexCheck("get_pending_outbox",
+               queries.PENDING_OUTBOX.format(columns=_columns(OutboxEntry, ("id", "next_attempt_at", "batch_key"))),
+               (_SENDER,), "Outbox", "idx_outbox_sender"),
+    IndexCheck("claim_outbox",
+               queries.CLAIM_OUTBOX,
+               (_NOW, 50), "Outbox", "idx_outbox_due"),
+    IndexCheck("get_outbox_stats",
+               queries.OUTBOX_STATS,
+               (1,), "Outbox", "idx_outbox_user_state"),
+]
+
+
+def explain(check: IndexCheck, pool: ConnectionPoolManager | None = None) -> dict:
+    """ EXPLAIN ``check.sql`` and return the plan row for ``check.table`` """
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(f"EXPLAIN {check.sql}", check.params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    return next((row for row in rows if row["table"] == check.table), rows[0] if rows else {})
+
+
+def index_report(pool: ConnectionPoolManager | None = None) -> list[tuple[IndexCheck, dict, bool]]:
+    """ EXPLAIN every entry of INDEX_CHECKS.
+
+    :return: (check, plan row, uses expected index) for every entry
+    :rtype: list[tuple[IndexCheck, dict, bool]]
+    """
+    results = []
+    for check in INDEX_CHECKS:
+        plan = explain(check, pool)
+        results.append((check, plan, plan.get("key") == check.expected_index))
+    return results
+
+
+def main():
+    results = index_report()
+    print(f"{'method':<30} {'table':<12} {'type':<8} {'key':<30} {'rows':>8}  status")
+    for check, plan, ok in results:
+        status = "ok" if ok else f"expected {check.expected_index}"
+        print(f"{check.method:<30} {check.table:<12} {plan.get('type') or '':<8} "
+              f"{plan.get('key') or '-':<30} {plan.get('rows') or 0:>8}  {status}")
+
+
+if __name__ == "__main__":
+    main()
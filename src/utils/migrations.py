@@ -0,0 +1,351 @@
+import argparse
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from loguru import logger
+
+from utils.pool import ConnectionPoolManager, get_pool
+
+""" Versioned schema migrations for EMS.
+
+    The schema is described as an ordered list of migration steps. Applied steps are
+    recorded in the ``schema_version`` table, so each step runs exactly once per database
+    and a fully migrated database costs a single SELECT to verify. DDL statements are
+    written to be idempotent (``IF NOT EXISTS``) so a step interrupted half-way can simply
+    be re-run. Data statements are not idempotent, so they come after every DDL statement
+    of their step: DDL commits implicitly, and only a data change that commits together
+    with the step's schema_version row is never applied twice. A step may
+    also be a function of the cursor, for checks that have to look at the data first;
+    such checks never repair data themselves, they stop the migration with a
+    ``MigrationError`` naming the offending rows.
+
+    Migrations run once per process, the first time a DataBaseManagement is built, or
+    ahead of time from the command line:
+
+        cd src && python -m utils.migrations           # apply pending steps
+        cd src && python -m utils.migrations --status  # show current / latest version
+
+    Classes:
+        Migration: One numbered schema step.
+        MigrationError: A step found data it will not change on its own.
+
+    Functions:
+        current_version(cursor): Highest applied migration version.
+        migrate(pool, target): Apply pending migrations up to ``target``.
+        ensure_schema(pool): Run ``migrate`` at most once per process.
+"""
+
+#! name used with GET_LOCK so concurrent processes don't migrate at the same time
+MIGRATION_LOCK = "ems_schema_migrations"
+MIGRATION_LOCK_TIMEOUT = 60
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: tuple[str | Callable, ...]     # SQL, or a function called with the cursor
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def _check_profile_duplicates(cursor):
+    """ Stop before uq_profiles_user_email if a user has the same email in several profiles """
+    #! NULLs never collide in a unique index, so only complete pairs can block it
+    cursor.execute("""
+        SELECT User_id, Email, GROUP_CONCAT(id ORDER BY id) FROM Profiles
+        WHERE User_id IS NOT NULL AND Email IS NOT NULL
+        GROUP BY User_id, Email HAVING COUNT(*) > 1
+    """)
+    duplicates = cursor.fetchall()
+    if not duplicates:
+        return
+    for user_id, email, ids in duplicates:
+        logger.error(f"Duplicate profiles of user {user_id} for {email}: ids {ids}")
+    raise MigrationError(f"{len(duplicates)} (User_id, Email) pairs have several Profiles rows "
+                         f"(ids: {'; '.join(ids for _, _, ids in duplicates)}); merge or delete them and migrate again")
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline tables", (
+        """
+        CREATE TABLE IF NOT EXISTS Profiles (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            Name VARCHAR(100),
+            Email VARCHAR(100),
+            Title VARCHAR(200),
+            Profession VARCHAR(100)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Templates (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            Name VARCHAR(100),
+            Body VARCHAR(500)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Sent_Emails(
+            Email_id INT AUTO_INCREMENT PRIMARY KEY,
+            Recipients VARCHAR(200),
+            Subject VARCHAR(100),
+            Body VARCHAR(500),
+            Sent_date DATETIME
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Reminders (
+            Email_id INT,
+            Remind_date DATETIME,
+            FOREIGN KEY (Email_id) REFERENCES Sent_Emails(Email_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Schedules (
+            Email_id INT,
+            Scheduled_date DATETIME,
+            FOREIGN KEY (Email_id) REFERENCES Sent_Emails(Email_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS User_profile (
+            User_id INT AUTO_INCREMENT PRIMARY KEY,
+            Name VARCHAR(100),
+            Title VARCHAR(200),
+            Proffesion VARCHAR(100),
+            Signiture VARCHAR(100),
+            Email VARCHAR(100) UNIQUE,
+            Encrypted_password VARCHAR(200) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Social_media(
+            User_id int,
+            LinkedIn VARCHAR(200),
+            X VARCHAR(200),
+            Telegram VARCHAR(200),
+            Github VARCHAR(200),
+            FOREIGN KEY (User_id) REFERENCES User_profile(User_id)
+        )
+        """,
+    )),
+    Migration(2, "owner column on Profiles and Templates", (
+        "ALTER TABLE Profiles ADD COLUMN IF NOT EXISTS User_id INT",
+        "ALTER TABLE Templates ADD COLUMN IF NOT EXISTS User_id INT",
+    )),
+    #! column order matters: Home.py reads Sent_Emails rows as (..., Sent_date, notified, User_id)
+    Migration(3, "notified flag and owner column on Sent_Emails", (
+        "ALTER TABLE Sent_Emails ADD COLUMN IF NOT EXISTS notified BOOLEAN NOT NULL DEFAULT FALSE AFTER Sent_date",
+        "ALTER TABLE Sent_Emails ADD COLUMN IF NOT EXISTS User_id INT AFTER notified",
+    )),
+    Migration(4, "owner column on Schedules", (
+        "ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS User_id INT",
+    )),
+    #! secondary indexes for the DataBaseManagement access paths, see utils.indexes for the EXPLAIN report
+    Migration(5, "secondary indexes for EMS query patterns", (
+        #! duplicates would make the unique key fail; they are reported, never deleted here
+        _check_profile_duplicates,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_profiles_user_email ON Profiles (User_id, Email)",
+        "CREATE INDEX IF NOT EXISTS idx_templates_user ON Templates (User_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_user_date ON Sent_Emails (User_id, Sent_date)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_recipient_notified ON Sent_Emails (Recipients, notified, Sent_date)",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_email ON Schedules (Email_id)",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_date ON Schedules (Scheduled_date)",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_user_date ON Schedules (User_id, Scheduled_date)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_email ON Reminders (Email_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_date ON Reminders (Remind_date)",
+    )),
+    #! schedules used to be stored as Asia/Tehran wall time (UTC+03:30, no DST since 2022)
+    Migration(6, "store Schedules.Scheduled_date in UTC", (
+        "UPDATE Schedules SET Scheduled_date = CONVERT_TZ(Scheduled_date, '+03:30', '+00:00')",
+    )),
+    #! delivery queue drained by utils.outbox; times are UTC, Next_attempt_at doubles as the claim lease
+    Migration(7, "durable outbox", (
+        """
+        CREATE TABLE IF NOT EXISTS Outbox (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            Idempotency_key CHAR(64) NOT NULL,
+            User_id INT NOT NULL,
+            Sender VARCHAR(100) NOT NULL,
+            Recipient VARCHAR(200) NOT NULL,
+            Subject VARCHAR(100),
+            Body TEXT,
+            Attachment_name VARCHAR(255),
+            Attachment LONGBLOB,
+            Email_id INT,
+            State ENUM('queued', 'sending', 'sent', 'failed', 'dead') NOT NULL DEFAULT 'queued',
+            Attempts INT NOT NULL DEFAULT 0,
+            Max_attempts INT NOT NULL DEFAULT 5,
+            Next_attempt_at DATETIME NOT NULL,
+            Last_error VARCHAR(500),
+            Created_at DATETIME NOT NULL,
+            Sent_at DATETIME,
+            UNIQUE KEY uq_outbox_idempotency (Idempotency_key),
+            KEY idx_outbox_due (State, Next_attempt_at),
+            KEY idx_outbox_user_state (User_id, State)
+        )
+        """,
+        #! rendered template bodies easily exceed 500 characters; the outbox hands them over as-is
+        "ALTER TABLE Sent_Emails MODIFY Body TEXT",
+    )),
+    #! lets utils.scheduler pick up new and edited schedules without rescanning the table
+    Migration(8, "change stamp on Schedules", (
+        """
+        ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS Changed_at DATETIME(6) NOT NULL
+            DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_schedules_changed ON Schedules (Changed_at)",
+    )),
+    #! claim columns for DataBaseManagement.claim_due_schedules; Lease_until is UTC
+    Migration(9, "claim lease on Schedules", (
+        "ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS Lease_until DATETIME",
+        "ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS Claimed_by VARCHAR(100)",
+    )),
+    #! rule text is parsed by utils.recurrence; Scheduled_date keeps only the next occurrence
+    Migration(10, "recurring schedules", (
+        "ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS Recurrence VARCHAR(100)",
+        "ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS Recurrence_until DATETIME",
+    )),
+    Migration(11, "reminder engine columns", (
+        "ALTER TABLE Reminders ADD COLUMN IF NOT EXISTS Note VARCHAR(500)",
+        "ALTER TABLE Reminders ADD COLUMN IF NOT EXISTS Fired_at DATETIME",
+        "ALTER TABLE Reminders ADD COLUMN IF NOT EXISTS Lease_until DATETIME",
+        #! pending reminders are Fired_at IS NULL, so the due scan is one range on this index
+        "CREATE INDEX IF NOT EXISTS idx_reminders_due ON Reminders (Fired_at, Remind_date)",
+        #! reminders were stored as Asia/Tehran wall time like schedules; from now on UTC.
+        #! Last on purpose: a re-run after a crash in the DDL above must not shift them twice
+        "UPDATE Reminders SET Remind_date = CONVERT_TZ(Remind_date, '+03:30', '+00:00')",
+    )),
+    Migration(12, "outbox batch key", (
+        "ALTER TABLE Outbox ADD COLUMN IF NOT EXISTS Batch_key VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_batch ON Outbox (Batch_key, Next_attempt_at)",
+    )),
+    #! per-sender load lookups of utils.planner
+    Migration(13, "outbox sender index", (
+        "CREATE INDEX IF NOT EXISTS idx_outbox_sender ON Outbox (Sender, State, Next_attempt_at)",
+    )),
+    #! per-user high-water scans of the search index partitions
+    Migration(14, "sent emails by user and id", (
+        "CREATE INDEX IF NOT EXISTS idx_sent_user_id ON Sent_Emails (User_id, Email_id)",
+    )),
+    #! set when the outbox gives up on a scheduled draft, so it is no longer claimed; UTC
+    Migration(15, "failed schedules", (
+        "ALTER TABLE Schedules ADD COLUMN IF NOT EXISTS Failed_at DATETIME",
+    )),
+    #! sent history was stored as Asia/Tehran wall time; from now on UTC like every other column
+    Migration(16, "store Sent_Emails.Sent_date in UTC", (
+        "UPDATE Sent_Emails SET Sent_date = CONVERT_TZ(Sent_date, '+03:30', '+00:00') WHERE Sent_date IS NOT NULL",
+        #! Changed_at was stamped in the server's zone; restamp it so later UTC stamps sort after it
+        "UPDATE Schedules SET Changed_at = UTC_TIMESTAMP(6)",
+    )),
+    #! drafts of a scheduled campaign are keyed by submission, so a rerun of the Send page reuses them
+    Migration(17, "submission key on Sent_Emails", (
+        "ALTER TABLE Sent_Emails ADD COLUMN IF NOT EXISTS Submission_key VARCHAR(64)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_sent_submission ON Sent_Emails (Submission_key)",
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _create_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(200),
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(cursor) -> int:
+    """ Return the highest applied migration version, 0 for an empty database """
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(pool: ConnectionPoolManager | None = None, target: int | None = None) -> int:
+    """ Apply every pending migration up to ``target`` (default: latest).
+
+    :param pool: connection pool to use, defaults to the process-wide pool
+    :type pool: ConnectionPoolManager | None
+    :param target: highest version to apply, defaults to LATEST_VERSION
+    :type target: int | None
+    :return: schema version after migrating
+    :rtype: int
+    """
+    pool = pool or get_pool()
+    target = LATEST_VERSION if target is None else target
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK(?, ?)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+            if not cursor.fetchone()[0]:
+                raise TimeoutError(f"Could not acquire '{MIGRATION_LOCK}' within {MIGRATION_LOCK_TIMEOUT}s")
+            try:
+                _create_version_table(cursor)
+                version = current_version(cursor)
+
+                for migration in MIGRATIONS:
+                    if migration.version <= version or migration.version > target:
+                        continue
+                    logger.info(f"Applying migration {migration.version}: {migration.description}")
+                    for statement in migration.statements:
+                        if callable(statement):
+                            statement(cursor)
+                        else:
+                            cursor.execute(statement)
+                    cursor.execute(
+                        "INSERT INTO schema_version(version, description) VALUES (?, ?)",
+                        (migration.version, migration.description),
+                    )
+                    conn.commit()
+                    version = migration.version
+
+                logger.success(f"Database schema at version {version}")
+                return version
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(?)", (MIGRATION_LOCK,))
+                cursor.fetchone()
+        finally:
+            cursor.close()
+
+
+def ensure_schema(pool: ConnectionPoolManager | None = None):
+    """ Bring the database up to date once per process; later calls return immediately """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            migrate(pool)
+            _schema_ready = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EMS database schema migrations")
+    parser.add_argument("--status", action="store_true", help="show the current schema version and exit")
+    parser.add_argument("--target", type=int, default=None, help="migrate up to this version only")
+    args = parser.parse_args()
+
+    if args.status:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            _create_version_table(cursor)
+            version = current_version(cursor)
+            cursor.close()
+        print(f"current version: {version}, latest version: {LATEST_VERSION}")
+        return
+
+    migrate(target=args.target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import hashlib
+import io
+import os
+import random
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import pytz
+from loguru import logger
+
+from utils.credentials import get_credential_service
+from utils.db import DataBaseManagement
+from utils.planner import SendPlanner, get_planner
+from utils.rows import OutboxEntry
+from utils.send_executor import THROTTLE_CODES, OutgoingEmail, SendExecutor, SendResult, get_send_executor
+
+""" Durable outbox for EMS.
+
+    Pages no longer send mail inline: they queue one Outbox row per recipient and workers
+    drain the table. A row moves through
+
+        queued -> sending -> sent
+                          -> failed -> sending -> ...   (transient error, retried later)
+                          -> dead                       (5xx reply or attempts exhausted)
+
+    Retries back off exponentially with random jitter, so a provider outage does not turn
+    into a synchronized retry storm. Each row carries an idempotency key with a unique
+    index. The Send page derives it from a token kept per rendered form, so Streamlit
+    reruns and double clicks re-submit the same key and are ignored, while sending the
+    same email again later is a new submission.
+    Only delivered rows are written to Sent_Emails.
+
+    Scheduled emails of one sender due in the same minute share a batch key. When a
+    worker claims a row of such a batch it claims the rest of the batch with it (up to
+    ``group_size``), looks the sender's credentials up once and sends the whole batch over
+    one SMTP session, so a scheduled campaign costs about as much as a live one.
+
+    Next_attempt_at is also the send slot assigned by utils.planner. A throttling reply
+    (421 / 450 / 451 / 452) makes the worker hand the sender to ``SendPlanner.throttled``,
+    which slows the sender down and re-plans its queued rows; a send refused because the
+    sender's daily quota ran out re-plans the queue from the time quota is back. Either
+    way the refused rows go back to 'queued' without using up an attempt, so rate limits
+    can never turn a row 'dead'.
+
+    Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED, so the in-process worker
+    started by the pages and any number of headless workers can run side by side. A
+    worker that dies mid-batch loses its lease and the rows become due again.
+
+        cd src && python -m utils.outbox           # run a headless worker
+        cd src && python -m utils.outbox --once    # drain one batch and exit
+
+    Classes:
+        OutboxSettings: Batch, lease and retry options, read from the environment.
+        OutboxWorker: Claims due rows, sends them and records the outcome.
+
+    Functions:
+        idempotency_key(...): Key for an immediate send.
+        schedule_key(email_id, scheduled_date): Key for delivering a scheduled draft.
+        batch_key(user_id, sender, due): Key coalescing a sender's emails due in one minute.
+        reminder_key(email_id, remind_date): Key for firing a reminder.
+        new_entry(...): Build an OutboxEntry ready for ``enqueue_outbox``.
+        backoff_delay(attempts, settings): Jittered delay before the next attempt.
+        delivery_status(db, ids): Rows whose current attempt is over, and the ids still on their way.
+        get_outbox_worker(): The in-process worker, started on first use.
+
+    Environment variables:
+        EMS_OUTBOX_BATCH_SIZE (default 50), EMS_OUTBOX_LEASE (seconds, default 120),
+        EMS_OUTBOX_POLL_INTERVAL (default 2), EMS_OUTBOX_BASE_DELAY (default 30),
+        EMS_OUTBOX_MAX_DELAY (default 3600), EMS_OUTBOX_MAX_ATTEMPTS (default 5),
+        EMS_OUTBOX_GROUP_SIZE (default 500)
+"""
+
+STATES = ("queued", "sending", "sent", "failed", "dead")
+#! states in which the current attempt is over
+SETTLED_STATES = frozenset({"sent", "failed", "dead"})
+
+
+@dataclass(frozen=True)
+class OutboxSettings:
+    batch_size: int = 50
+    lease: float = 120.0        # seconds a claimed row stays reserved for its worker
+    poll_interval: float = 2.0
+    base_delay: float = 30.0    # first retry delay in seconds
+    max_delay: float = 3600.0
+    max_attempts: int = 5
+    group_size: int = 500       # most rows of one coalesced batch sent in one go
+
+    @classmethod
+    def from_env(cls) -> "OutboxSettings":
+        """ Build settings from EMS_OUTBOX_* environment variables, falling back to defaults """
+        return cls(
+            batch_size=int(os.getenv("EMS_OUTBOX_BATCH_SIZE", cls.batch_size)),
+            lease=float(os.getenv("EMS_OUTBOX_LEASE", cls.lease)),
+            poll_interval=float(os.getenv("EMS_OUTBOX_POLL_INTERVAL", cls.poll_interval)),
+            base_delay=float(os.getenv("EMS_OUTBOX_BASE_DELAY", cls.base_delay)),
+            max_delay=float(os.getenv("EMS_OUTBOX_MAX_DELAY", cls.max_delay)),
+            max_attempts=int(os.getenv("EMS_OUTBOX_MAX_ATTEMPTS", cls.max_attempts)),
+            group_size=int(os.getenv("EMS_OUTBOX_GROUP_SIZE", cls.group_size)),
+        )
+
+
+def idempotency_key(user_id: int, recipient: str, subject: str, body: str, submission: str,
+                    attachment: bytes | None = None) -> str:
+    """ Key identifying one message of one user's submission.
+
+    :param submission: token of the submit the message belongs to, e.g. one uuid per
+        rendered form: a rerun or double click of that submit repeats the token and is
+        ignored, while sending the same email again is a new submission and goes out
+    :type submission: str
+    :return: hex SHA-256
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for part in (str(user_id), recipient.strip().lower(), subject or "", body or "", submission):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    if attachment:
+        digest.update(hashlib.sha256(attachment).digest())
+    return digest.hexdigest()
+
+
+def schedule_key(email_id: int, scheduled_date: datetime) -> str:
+    """ Key for delivering the scheduled draft ``email_id`` at ``scheduled_date`` """
+    return hashlib.sha256(f"schedule:{email_id}:{scheduled_date.isoformat()}".encode()).hexdigest()
+
+
+def reminder_key(email_id: int, remind_date: datetime) -> str:
+    """ Key for firing the reminder on ``email_id`` due at ``remind_date``; a snoozed reminder gets a new key """
+    return hashlib.sha256(f"reminder:{email_id}:{remind_date.isoformat()}".encode()).hexdigest()
+
+
+def batch_key(user_id: int, sender: str, due: datetime) -> str:
+    """ Key shared by every email of ``sender`` due in the same minute as ``due`` """
+    minute = due.astimezone(pytz.utc).replace(second=0, microsecond=0)
+    return hashlib.sha256(f"batch:{user_id}:{sender.strip().lower()}:{minute.isoformat()}".encode()).hexdigest()
+
+
+def new_entry(user_id: int, sender: str, recipient: str, subject: str, body: str,
+              attachment: bytes | None = None, attachment_name: str | None = None,
+              email_id: int | None = None, key: str | None = None, batch: str | None = None,
+              send_at: datetime | None = None, settings: OutboxSettings | None = None,
+              submission: str | None = None) -> OutboxEntry:
+    """ Build an OutboxEntry for ``DataBaseManagement.enqueue_outbox``; ``key`` defaults to ``idempotency_key``
+    of ``submission`` (a fresh token when neither is given, so the entry is never deduplicated)
+    and ``send_at`` (a slot from utils.planner) to now """
+    settings = settings or OutboxSettings.from_env()
+    if key is None:
+        key = idempotency_key(user_id, recipient, subject, body, submission or uuid.uuid4().hex, attachment)
+    return OutboxEntry(
+        idempotency_key=key,
+        user_id=user_id,
+        sender=sender,
+        recipient=recipient,
+        subject=subject,
+        body=body,
+        attachment_name=attachment_name,
+        attachment=attachment,
+        email_id=email_id,
+        max_attempts=settings.max_attempts,
+        next_attempt_at=send_at,
+        batch_key=batch,
+    )
+
+
+def backoff_delay(attempts: int, settings: OutboxSettings) -> float:
+    """ Seconds to wait after the ``attempts``-th failure: exponential, capped, with random jitter """
+    ceiling = min(settings.max_delay, settings.base_delay * 2 ** (attempts - 1))
+    return random.uniform(settings.base_delay, max(settings.base_delay, ceiling))
+
+
+def _is_permanent(code: int | None) -> bool:
+    return code is not None and 500 <= code < 600
+
+
+def _attachment(entry: OutboxEntry):
+    if entry.attachment is None:
+        return None
+    buffer = io.BytesIO(entry.attachment)
+    buffer.name = entry.attachment_name or "attachment"
+    return buffer
+
+
+class OutboxWorker:
+    def __init__(self, db: DataBaseManagement | None = None, executor: SendExecutor | None = None,
+                 settings: OutboxSettings | None = None, planner: SendPlanner | None = None):
+        """Drains the outbox through the rate-limited send executor
+
+        :param db: database access, defaults to a new DataBaseManagement
+        :type db: DataBaseManagement | None
+        :param executor: send executor, defaults to the process-wide one
+        :type executor: SendExecutor | None
+        :param settings: batch and retry settings, defaults to ``OutboxSettings.from_env()``
+        :type settings: OutboxSettings | None
+        :param planner: re-plans a sender's queue after throttling, defaults to the process-wide one
+        :type planner: SendPlanner | None
+        """
+        self.db = db or DataBaseManagement()
+        self.executor = executor or get_send_executor()
+        self.settings = settings or OutboxSettings.from_env()
+        self.planner = planner
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        """ Claim one batch of due rows, send it and record the outcome.
+
+        :return: number of rows claimed
+        :rtype: int
+        """
+        entries = self.db.claim_outbox(self.settings.batch_size, self.settings.lease)
+        if not entries:
+            return 0
+        entries += self._complete_batches(entries)
+
+        groups: dict[tuple, list[OutboxEntry]] = {}
+        for entry in entries:
+            groups.setdefault((entry.user_id, entry.sender, entry.batch_key), []).append(entry)
+
+        sent, failures, deferred = [], [], []
+        passwords: dict[tuple, str | None] = {}
+        #! sender -> throttling code, None when only its quota ran out
+        replan: dict[str, int | None] = {}
+        for (user_id, sender, batch), group in groups.items():
+            #! a row reclaimed after its worker died may already have used up its attempts
+            failures += [(e.id, "dead", None, e.last_error or "attempts exhausted")
+                         for e in group if e.attempts > e.max_attempts]
+            group = [e for e in group if e.attempts <= e.max_attempts]
+            if not group:
+                continue
+
+            if (user_id, sender) not in passwords:
+                passwords[(user_id, sender)] = get_credential_service().sender_password(self.db, user_id, sender)
+            password = passwords[(user_id, sender)]
+            if not password:
+                failures += [(e.id, "dead", None, "sender credentials unavailable") for e in group]
+                continue
+
+            #! a coalesced batch goes out over one SMTP session, live sends fan out in parallel
+            send = self.executor.send_batch if batch else self.executor.send_campaign
+            results = send(sender, password, [OutgoingEmail(e.recipient, e.subject, e.body, _attachment(e)) for e in group])
+            for entry, result in zip(group, results):
+                if result.ok:
+                    sent.append(entry)
+                elif result.deferred:
+                    #! a quota or throttling refusal waits for the sender's next slot without using an attempt
+                    deferred.append((entry.id, result.error))
+                    if result.code in THROTTLE_CODES or sender not in replan:
+                        replan[sender] = result.code
+                else:
+                    failures.append(self._failure(entry, result))
+
+        self.db.mark_outbox_sent(sent)
+        self.db.mark_outbox_failed(failures)
+        self.db.defer_outbox(deferred)
+        #! after the outcomes are recorded, so the re-plan moves the deferred rows and the retries as well
+        planner = self.planner or get_planner()
+        for sender, code in replan.items():
+            if code in THROTTLE_CODES:
+                planner.throttled(sender, code)
+            else:
+                planner.replan(sender, datetime.now(pytz.utc) + timedelta(seconds=self.executor.quota_wait(sender)))
+        logger.info(f"Outbox batch: {len(sent)} sent, {len(failures)} failed, {len(deferred)} deferred")
+        return len(entries)
+
+    def _complete_batches(self, entries: list[OutboxEntry]) -> list[OutboxEntry]:
+        """ Claim the due rest of every coalesced batch that has rows in ``entries`` """
+        extra = []
+        for key in {entry.batch_key for entry in entries if entry.batch_key}:
+            held = [entry for entry in entries if entry.batch_key == key]
+            #! the batch is sent sequentially, so the lease has to cover the rate limit as well
+            per_minute = self.executor.limits_for(held[0].sender).per_minute
+            lease = self.settings.lease + 60 * self.settings.group_size / per_minute
+            extra += self.db.claim_outbox_batch(key, max(0, self.settings.group_size - len(held)), lease,
+                                                [entry.id for entry in held])
+        return extra
+
+    def _failure(self, entry: OutboxEntry, result: SendResult) -> tuple:
+        if _is_permanent(result.code) or entry.attempts >= entry.max_attempts:
+            return (entry.id, "dead", None, result.error)
+        retry_at = datetime.now(pytz.utc) + timedelta(seconds=backoff_delay(entry.attempts, self.settings))
+        return (entry.id, "failed", retry_at, result.error)
+
+    def run_forever(self):
+        """ Drain the outbox until ``stop`` is called, sleeping between polls when it is empty """
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e!s}")
+                claimed = 0
+            if claimed < self.settings.batch_size:
+                self._wake.wait(self.settings.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        """ Run the worker on a daemon thread """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="ems-outbox", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """ Poll now instead of at the next interval, e.g. right after queueing """
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def delivery_status(db: DataBaseManagement, ids: list[int]) -> tuple[list[OutboxEntry], list[int]]:
+    """ One look at the rows in ``ids``, without waiting for them.
+
+    :return: (rows whose current attempt is over, in the order of ``ids``; ids still queued or sending).
+        Ids no longer in the outbox are in neither list.
+    :rtype: tuple[list[OutboxEntry], list[int]]
+    """
+    entries = {entry.id: entry for entry in db.get_outbox_entries(ids)}
+    settled, waiting = [], []
+    for outbox_id in ids:
+        entry = entries.get(outbox_id)
+        if entry is None:
+            continue
+        #! a row deferred by quota or throttling is back to 'queued' with the reason in Last_error
+        if entry.state in SETTLED_STATES or (entry.state == "queued" and entry.last_error):
+            settled.append(entry)
+        else:
+            waiting.append(outbox_id)
+    return settled, waiting
+
+
+_worker: OutboxWorker | None = None
+_worker_lock = threading.Lock()
+
+
+def get_outbox_worker() -> OutboxWorker:
+    """ Return the in-process outbox worker, starting it on first use """
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = OutboxWorker()
+                _worker.start()
+    return _worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EMS outbox worker")
+    parser.add_argument("--once", action="store_true", help="drain one batch and exit")
+    args = parser.parse_args()
+
+    worker = OutboxWorker()
+    if args.once:
+        logger.info(f"{worker.run_once()} outbox rows processed")
+        return
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Outbox worker stopped")
+
+
+if __name__ == "__main__":
+    main()
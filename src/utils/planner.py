@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+import pytz
+from loguru import logger
+
+from utils.db import DataBaseManagement
+from utils.send_executor import SendExecutor, get_send_executor
+
+""" Quota-aware send planning for EMS.
+
+    Providers cap how many messages an account may send per minute and per day, and the
+    in-process buckets of utils.send_executor only see what one process sends right now.
+    ``SendPlanner`` looks further ahead: given a campaign size it assigns every message a
+    send slot, filling each minute up to the per-minute quota and each UTC day up to the
+    per-day quota, after subtracting the load already on the books for that sender (queued
+    and retrying outbox rows, messages delivered today, pending schedules). The quotas are
+    the sender's ``SenderLimits`` from the send executor, the same limits its buckets
+    enforce, so slots are never planned faster than the executor will send. Slots are
+    written to Outbox.Next_attempt_at (or Schedules.Scheduled_date), so the outbox worker
+    and the dispatcher simply follow the plan, and the last slot is the projected
+    completion time shown to the user.
+
+    When the provider pushes back with a 4xx throttling reply, the outbox worker calls
+    ``SendPlanner.throttled``: the sender's per-minute quota is scaled down for a cooldown
+    period and every queued row of that sender is re-planned, starting after a pause.
+
+    Classes:
+        QuotaSettings: Throttle handling, read from the environment.
+        CampaignPlan: Slots of one planned campaign.
+        SendPlanner: Plans campaigns and re-plans after throttling.
+
+    Functions:
+        assign_slots(...): Pure slot assignment against an existing load.
+        get_planner(): The process-wide SendPlanner.
+
+    Environment variables:
+        EMS_SEND_PER_MINUTE / EMS_SEND_PER_DAY (the quotas, see utils.send_executor),
+        EMS_QUOTA_THROTTLE_FACTOR (per-minute quota multiplier after throttling, default 0.5),
+        EMS_QUOTA_COOLDOWN (seconds the reduced quota holds, default 3600),
+        EMS_QUOTA_PAUSE (seconds before re-planned sends resume, default 300)
+"""
+
+@dataclass(frozen=True)
+class QuotaSettings:
+    throttle_factor: float = 0.5
+    cooldown: float = 3600.0
+    pause: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "QuotaSettings":
+        """ Build settings from EMS_QUOTA_* environment variables, falling back to defaults """
+        return cls(
+            throttle_factor=float(os.getenv("EMS_QUOTA_THROTTLE_FACTOR", cls.throttle_factor)),
+            cooldown=float(os.getenv("EMS_QUOTA_COOLDOWN", cls.cooldown)),
+            pause=float(os.getenv("EMS_QUOTA_PAUSE", cls.pause)),
+        )
+
+
+@dataclass(frozen=True)
+class CampaignPlan:
+    slots: list[datetime]
+
+    @property
+    def completes_at(self) -> datetime | None:
+        """ Projected time of the last send, aware UTC """
+        return self.slots[-1] if self.slots else None
+
+    def deferred(self, now: datetime | None = None) -> int:
+        """ Number of messages planned later than the current minute """
+        cutoff = (now or datetime.now(pytz.utc)) + timedelta(minutes=1)
+        return sum(slot > cutoff for slot in self.slots)
+
+
+def _minute(dt: datetime) -> datetime:
+    return dt.astimezone(pytz.utc).replace(second=0, microsecond=0)
+
+
+def assign_slots(count: int, start: datetime, per_minute: int, per_day: int,
+                 load: dict[datetime, int] | None = None) -> list[datetime]:
+    """ Assign ``count`` send slots from ``start`` on without exceeding the quotas.
+
+    Every minute takes at most ``per_minute`` messages and every UTC day at most
+    ``per_day``, both counting ``load``. Within a minute the slots are spread evenly
+    so the executor's per-minute bucket is not hit with a burst; the minute of ``start``
+    only takes its share of what is left of it, spread from ``start`` to its end.
+
+    :param count: messages to place
+    :type count: int
+    :param start: earliest slot, aware
+    :type start: datetime
+    :param per_minute: messages allowed per minute
+    :type per_minute: int
+    :param per_day: messages allowed per UTC day
+    :type per_day: int
+    :param load: {aware UTC minute: messages already planned or sent}, covering at least
+        the days from ``start`` on
+    :type load: dict[datetime, int] | None
+    :return: aware UTC slots in send order
+    :rtype: list[datetime]
+    """
+    if per_minute < 1 or per_day < 1:
+        raise ValueError("quotas must allow at least one message")
+    load = load or {}
+    start = start.astimezone(pytz.utc)
+    day_load: dict[date, int] = {}
+    for minute, planned in load.items():
+        day_load[minute.date()] = day_load.get(minute.date(), 0) + planned
+
+    slots: list[datetime] = []
+    minute = _minute(start)
+    while len(slots) < count:
+        day = minute.date()
+        day_left = per_day - day_load.get(day, 0)
+        if day_left <= 0:
+            minute = pytz.utc.localize(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+            continue
+        begin = max(start, minute)
+        span = 60 - (begin - minute).total_seconds()
+        room = min(per_minute - load.get(minute, 0), int(per_minute * span / 60))
+        placed = min(room, day_left, count - len(slots))
+        if placed > 0:
+            slots += [begin + timedelta(seconds=span * i / placed) for i in range(placed)]
+            day_load[day] = day_load.get(day, 0) + placed
+        minute += timedelta(minutes=1)
+    return slots
+
+
+class SendPlanner:
+    def __init__(self, db: DataBaseManagement | None = None, settings: QuotaSettings | None = None,
+                 executor: SendExecutor | None = None):
+        """Plans campaigns against the sender's quotas and existing load
+
+        :param db: database access, defaults to a new DataBaseManagement
+        :type db: DataBaseManagement | None
+        :param settings: throttle handling, defaults to ``QuotaSettings.from_env()``
+        :type settings: QuotaSettings | None
+        :param executor: executor whose sender limits are the quotas, defaults to the process-wide one
+        :type executor: SendExecutor | None
+        """
+        self.db = db or DataBaseManagement()
+        self.settings = settings or QuotaSettings.from_env()
+        self.executor = executor or get_send_executor()
+        #! sender -> monotonic time until which its per-minute quota is reduced
+        self._throttled_until: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def per_minute(self, sender: str) -> int:
+        """ Per-minute quota in force for ``sender``, reduced while it is cooling down from throttling """
+        with self._lock:
+            until = self._throttled_until.get(sender)
+            if until is not None and until <= time.monotonic():
+                del self._throttled_until[sender]
+                until = None
+        per_minute = self.executor.limits_for(sender).per_minute
+        if until is None:
+            return per_minute
+        return max(1, int(per_minute * self.settings.throttle_factor))
+
+    def _assign(self, sender: str, start: datetime, count: int, exclude: list[datetime] = ()) -> list[datetime]:
+        """ Slots for ``count`` messages against the sender's load, minus the slots in ``exclude`` """
+        #! the window covers whole days: today's earlier sends count against today's quota
+        first_day = pytz.utc.localize(datetime.combine(start.astimezone(pytz.utc).date(), datetime.min.time()))
+        per_day = self.executor.limits_for(sender).per_day
+        days = count // per_day + 2
+        while True:
+            window_end = first_day + timedelta(days=days)
+            load = self.db.get_send_load(sender, first_day, window_end)
+            for slot in exclude:
+                minute = _minute(slot)
+                if load.get(minute, 0) > 0:
+                    load[minute] -= 1
+            slots = assign_slots(count, start, self.per_minute(sender), per_day, load)
+            #! load beyond the window was not seen; widen it until the plan fits inside
+            if slots[-1] < window_end:
+                return slots
+            days *= 2
+
+    def plan(self, sender: str, count: int, start: datetime | None = None) -> CampaignPlan:
+        """ Assign send slots to a campaign of ``count`` messages.
+
+        :param sender: sender account
+        :type sender: str
+        :param count: number of messages
+        :type count: int
+        :param start: earliest send time, aware; defaults to now
+        :type start: datetime | None
+        :return: the plan; its slots are in send order
+        :rtype: CampaignPlan
+        """
+        start = start or datetime.now(pytz.utc)
+        if count <= 0:
+            return CampaignPlan([])
+        return CampaignPlan(self._assign(sender, start, count))
+
+    def replan(self, sender: str, start: datetime | None = None) -> int:
+        """ Re-plan every queued or retrying outbox row of ``sender`` from ``start`` on, keeping their order.
+
+        :return: number of rows moved
+        :rtype: int
+        """
+        start = start or datetime.now(pytz.utc)
+        pending = self.db.get_pending_outbox(sender)
+        if not pending:
+            return 0
+        #! the rows being moved must not count against their own new slots
+        slots = self._assign(sender, start, len(pending), [entry.next_attempt_at for entry in pending])
+        moves = [(entry.id, slot) for entry, slot in zip(pending, slots)]
+        self.db.reschedule_outbox(moves)
+        return len(moves)
+
+    def throttled(self, sender: str, code: int | None = None) -> int:
+        """ React to a throttling reply: reduce the sender's quota and re-plan its queued rows.
+
+        :param sender: sender account that was throttled
+        :type sender: str
+        :param code: the SMTP reply code, for logging
+        :type code: int | None
+        :return: number of rows re-planned
+        :rtype: int
+        """
+        with self._lock:
+            self._throttled_until[sender] = time.monotonic() + self.settings.cooldown
+        resume = datetime.now(pytz.utc) + timedelta(seconds=self.settings.pause)
+        moved = self.replan(sender, resume)
+        logger.warning(f"{sender} throttled ({code}); quota reduced to {self.per_minute(sender)}/min, "
+                       f"{moved} queued emails re-planned from {resume:%H:%M}")
+        return moved
+
+
+_planner: SendPlanner | None = None
+_planner_lock = threading.Lock()
+
+
+def get_planner() -> SendPlanner:
+    """ Return the process-wide send planner """
+    global _planner
+    if _planner is None:
+        with _planner_lock:
+            if _planner is None:
+                _planner = SendPlanner()
+    return _planner
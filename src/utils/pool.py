@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import mariadb
+from loguru import logger
+
+""" Process-wide MariaDB connection pool for EMS.
+
+    Streamlit re-executes page scripts on every rerun but keeps imported modules in
+    ``sys.modules``, so a pool held at module level is shared by every session and
+    every rerun of the process. ``DataBaseManagement`` borrows a connection from it for
+    each operation instead of opening its own.
+
+    Classes:
+        PoolSettings: Connection and pool tuning options, read from the environment.
+        ConnectionPoolManager: Thin manager around ``mariadb.ConnectionPool`` with checkout
+            timeout, idle eviction and health checks.
+
+    Functions:
+        get_pool(): Return the process-wide ConnectionPoolManager, creating it on first use.
+        close_pool(): Close the process-wide pool (tests / shutdown).
+
+    Environment variables:
+        EMS_DB_USER, EMS_DB_PASSWORD, EMS_DB_HOST, EMS_DB_PORT, EMS_DB_NAME
+        EMS_DB_POOL_SIZE, EMS_DB_POOL_TIMEOUT, EMS_DB_POOL_MAX_IDLE, EMS_DB_POOL_PING_INTERVAL
+"""
+
+
+class PoolTimeoutError(mariadb.PoolError):
+    """ Raised when no pooled connection becomes free within the checkout timeout """
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    user: str = "root"
+    password: str = ""
+    host: str = "localhost"
+    port: int = 3306
+    database: str = "EMSdb"
+    pool_name: str = "ems_pool"
+    pool_size: int = 8
+    checkout_timeout: float = 5.0   # seconds to wait for a free connection
+    max_idle: float = 300.0         # seconds before an idle connection is re-established
+    ping_interval: float = 30.0     # seconds of idleness before a connection is pinged
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        """ Build settings from EMS_DB_* environment variables, falling back to defaults """
+        return cls(
+            user=os.getenv("EMS_DB_USER", cls.user),
+            password=os.getenv("EMS_DB_PASSWORD", cls.password),
+            host=os.getenv("EMS_DB_HOST", cls.host),
+            port=int(os.getenv("EMS_DB_PORT", cls.port)),
+            database=os.getenv("EMS_DB_NAME", cls.database),
+            pool_size=int(os.getenv("EMS_DB_POOL_SIZE", cls.pool_size)),
+            checkout_timeout=float(os.getenv("EMS_DB_POOL_TIMEOUT", cls.checkout_timeout)),
+            max_idle=float(os.getenv("EMS_DB_POOL_MAX_IDLE", cls.max_idle)),
+            ping_interval=float(os.getenv("EMS_DB_POOL_PING_INTERVAL", cls.ping_interval)),
+        )
+
+
+class ConnectionPoolManager:
+    def __init__(self, settings: PoolSettings | None = None):
+        """Connection pool manager for EMS
+
+        :param settings: pool and connection settings, defaults to ``PoolSettings.from_env()``
+        :type settings: PoolSettings | None
+        """
+        self.settings = settings or PoolSettings.from_env()
+        self._pool = mariadb.ConnectionPool(
+            pool_name=self.settings.pool_name,
+            pool_size=self.settings.pool_size,
+            pool_reset_connection=False,
+            user=self.settings.user,
+            password=self.settings.password,
+            host=self.settings.host,
+            port=self.settings.port,
+            database=self.settings.database,
+            autocommit=False,
+            #! every stored datetime is UTC; this makes NOW() and CURRENT_TIMESTAMP (Changed_at) agree
+            init_command="SET time_zone = '+00:00'",
+        )
+        #! last time each pooled connection was returned, keyed by connection id
+        self._last_used: dict[int, float] = {}
+        self._lock = threading.Lock()
+        logger.success(f"Connection pool '{self.settings.pool_name}' created with {self.settings.pool_size} connections")
+
+    def _checkout(self):
+        """ Take a connection from the pool, waiting up to checkout_timeout seconds """
+        deadline = time.monotonic() + self.settings.checkout_timeout
+        delay = 0.005
+        while True:
+            try:
+                conn = self._pool.get_connection()
+                break
+            except mariadb.PoolError:
+                if time.monotonic() >= deadline:
+                    raise PoolTimeoutError(
+                        f"No free connection in '{self.settings.pool_name}' after {self.settings.checkout_timeout}s",
+                    ) from None
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+
+        self._revalidate(conn)
+        return conn
+
+    def _revalidate(self, conn):
+        """ Evict stale server sessions and health-check connections that sat idle """
+        with self._lock:
+            last_used = self._last_used.get(id(conn))
+        if last_used is None:
+            return
+        idle = time.monotonic() - last_used
+
+        if idle >= self.settings.max_idle:
+            logger.debug(f"Re-establishing connection idle for {idle:.0f}s")
+            conn.reconnect()
+        elif idle >= self.settings.ping_interval:
+            try:
+                conn.ping()
+            except mariadb.Error:
+                logger.warning("Pooled connection failed health check, reconnecting")
+                conn.reconnect()
+
+    def _checkin(self, conn, stale: bool = False):
+        with self._lock:
+            #! a stale connection is re-established on its next checkout
+            self._last_used[id(conn)] = float("-inf") if stale else time.monotonic()
+        conn.close()  # returns the connection to the pool
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection for one unit of work.
+
+        The transaction is committed when the block exits cleanly and rolled back
+        otherwise; either way the connection goes back to the pool.
+        """
+        conn = self._checkout()
+        stale = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except mariadb.Error as e:
+                logger.warning(f"Rollback failed, connection will be re-established: {e}")
+                stale = True
+            raise
+        finally:
+            self._checkin(conn, stale)
+
+    def close(self):
+        """ Close every connection held by the pool """
+        self._pool.close()
+        with self._lock:
+            self._last_used.clear()
+        logger.info(f"Connection pool '{self.settings.pool_name}' closed")
+
+
+_pool: ConnectionPoolManager | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPoolManager:
+    """ Return the process-wide pool, creating it on first use """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPoolManager()
+    return _pool
+
+
+def close_pool():
+    """ Close and forget the process-wide pool """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,118 @@
+""" SQL of the EMS hot-path queries.
+
+    Each constant is the exact statement a DataBaseManagement method executes, and
+    utils.indexes EXPLAINs the same constant, so the index report always plans what
+    actually runs. ``{columns}`` is filled from ``select_columns`` and ``{filters}`` with
+    the optional conditions the method appends (the ``*_AFTER`` / ``*_FROM`` fragments);
+    everything else is bound with ``?`` placeholders. Timestamps are bound as naive UTC.
+
+    Constants:
+        PROFILE_BY_EMAIL, PROFILES_OF_USER, TEMPLATES_OF_USER: Profiles and Templates reads.
+        SENT_EMAILS_OF_USER, SENT_EMAILS_SINCE, SENT_EMAILS_PAGE, NEWLY_SENT_COUNT: Sent_Emails reads.
+        SCHEDULE_BY_EMAIL, PENDING_SCHEDULES, CLAIM_DUE_SCHEDULES, SCHEDULES_VIEW: Schedules reads.
+        REMINDER_BY_EMAIL, CLAIM_DUE_REMINDERS, NEXT_REMINDER_TIME: Reminders reads.
+        CLAIM_OUTBOX, CLAIM_OUTBOX_BATCH, PENDING_OUTBOX, OUTBOX_STATS, SEND_LOAD: Outbox reads.
+"""
+
+PROFILE_BY_EMAIL = "SELECT {columns} FROM Profiles WHERE Email = ? AND User_id = ?"
+
+PROFILES_OF_USER = "SELECT {columns} FROM Profiles WHERE User_id = ?"
+
+TEMPLATES_OF_USER = "SELECT {columns} FROM Templates WHERE User_id = ?"
+
+SENT_EMAILS_OF_USER = "SELECT {columns} FROM Sent_Emails WHERE User_id = ? ORDER BY Sent_date DESC"
+
+SENT_EMAILS_SINCE = "SELECT {columns} FROM Sent_Emails WHERE User_id = ? AND Email_id > ? ORDER BY Email_id LIMIT ?"
+
+SENT_EMAILS_PAGE = """SELECT Email_id, Recipients, Subject, Sent_date, notified
+        FROM Sent_Emails
+        WHERE User_id = ? AND Sent_date IS NOT NULL{filters}
+        ORDER BY Sent_date DESC, Email_id DESC LIMIT ?"""
+
+#! expanded form of (Sent_date, Email_id) < (?, ?) so the range is resolved on the index
+SENT_EMAILS_PAGE_AFTER = " AND (Sent_date < ? OR (Sent_date = ? AND Email_id < ?))"
+
+NEWLY_SENT_COUNT = """SELECT COUNT(*)
+        FROM Sent_Emails
+        WHERE Recipients = ?
+        AND Sent_date >= ?
+        AND notified = FALSE"""
+
+SCHEDULE_BY_EMAIL = "SELECT {columns} FROM Schedules WHERE Email_id = ?"
+
+PENDING_SCHEDULES = """SELECT s.Email_id, s.Scheduled_date, s.User_id, s.Changed_at
+        FROM Schedules s
+        JOIN Sent_Emails se ON se.Email_id = s.Email_id
+        WHERE se.notified = FALSE AND s.Failed_at IS NULL{filters}
+        ORDER BY s.Changed_at"""
+
+PENDING_SCHEDULES_AFTER = " AND s.Changed_at > ?"
+
+CLAIM_DUE_SCHEDULES = """SELECT s.Email_id FROM Schedules s
+        JOIN Sent_Emails se ON se.Email_id = s.Email_id
+        WHERE s.Scheduled_date <= ? AND (s.Lease_until IS NULL OR s.Lease_until <= ?)
+        AND se.notified = FALSE AND s.Failed_at IS NULL
+        ORDER BY s.Scheduled_date LIMIT ?
+        FOR UPDATE SKIP LOCKED"""
+
+SCHEDULES_VIEW = """SELECT s.Email_id, e.Recipients, e.Subject, s.Scheduled_date, e.notified, s.Recurrence,
+            s.Failed_at
+        FROM Schedules s
+        JOIN Sent_Emails e ON e.Email_id = s.Email_id
+        WHERE s.User_id = ?{filters}
+        ORDER BY s.Scheduled_date"""
+
+SCHEDULES_VIEW_FROM = " AND s.Scheduled_date >= ?"
+
+SCHEDULES_VIEW_UNTIL = " AND s.Scheduled_date < ?"
+
+SCHEDULES_VIEW_PENDING = " AND e.notified = FALSE AND s.Failed_at IS NULL"
+
+SCHEDULES_VIEW_FAILED = " AND s.Failed_at IS NOT NULL"
+
+REMINDER_BY_EMAIL = "SELECT {columns} FROM Reminders WHERE Email_id = ?"
+
+CLAIM_DUE_REMINDERS = """SELECT Email_id FROM Reminders
+        WHERE Fired_at IS NULL AND Remind_date <= ? AND (Lease_until IS NULL OR Lease_until <= ?)
+        ORDER BY Remind_date LIMIT ?
+        FOR UPDATE SKIP LOCKED"""
+
+NEXT_REMINDER_TIME = "SELECT MIN(Remind_date) FROM Reminders WHERE Fired_at IS NULL"
+
+CLAIM_OUTBOX = """SELECT id FROM Outbox
+        WHERE State IN ('queued', 'failed', 'sending') AND Next_attempt_at <= ?
+        ORDER BY Next_attempt_at LIMIT ?
+        FOR UPDATE SKIP LOCKED"""
+
+CLAIM_OUTBOX_BATCH = """SELECT id FROM Outbox
+        WHERE Batch_key = ? AND State IN ('queued', 'failed', 'sending') AND Next_attempt_at <= ?
+        ORDER BY Next_attempt_at LIMIT ?
+        FOR UPDATE SKIP LOCKED"""
+
+PENDING_OUTBOX = """SELECT {columns} FROM Outbox
+        WHERE Sender = ? AND State IN ('queued', 'failed')
+        ORDER BY Next_attempt_at"""
+
+OUTBOX_STATS = "SELECT State, COUNT(*) FROM Outbox WHERE User_id = ? GROUP BY State"
+
+SEND_LOAD = """SELECT minute, SUM(n) FROM (
+            SELECT DATE_FORMAT(Next_attempt_at, '%Y-%m-%d %H:%i') AS minute, COUNT(*) AS n
+            FROM Outbox
+            WHERE Sender = ? AND State IN ('queued', 'failed', 'sending')
+            AND Next_attempt_at >= ? AND Next_attempt_at < ?
+            GROUP BY minute
+            UNION ALL
+            SELECT DATE_FORMAT(Sent_at, '%Y-%m-%d %H:%i'), COUNT(*)
+            FROM Outbox
+            WHERE Sender = ? AND State = 'sent' AND Sent_at >= ? AND Sent_at < ?
+            GROUP BY 1
+            UNION ALL
+            SELECT DATE_FORMAT(s.Scheduled_date, '%Y-%m-%d %H:%i'), COUNT(*)
+            FROM Schedules s
+            JOIN Sent_Emails se ON se.Email_id = s.Email_id
+            JOIN User_profile u ON u.User_id = s.User_id
+            WHERE u.Email = ? AND se.notified = FALSE AND (s.Lease_until IS NULL OR s.Lease_until <= ?)
+            AND s.Scheduled_date >= ? AND s.Scheduled_date < ?
+            GROUP BY 1
+        ) AS planned
+        GROUP BY minute"""
@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+import pytz
+
+from utils.db import LOCAL_TZ
+
+""" Recurrence rules for scheduled emails.
+
+    A recurring schedule stores its rule once, in Schedules.Recurrence, and keeps only the
+    next occurrence in Scheduled_date. The dispatcher computes the following occurrence
+    after each send, so occurrences are expanded lazily, one at a time, and the existing
+    Scheduled_date index doubles as the next-occurrence index: only rules that are due
+    are ever evaluated.
+
+    Supported rules, evaluated in LOCAL_TZ wall time:
+        "daily"          every day at the time of the first occurrence
+        "weekly"         every week on the weekday and time of the first occurrence
+        "m h dom mon dow" (optionally "cron: ..."): five-field cron expression with
+                         numbers, "*", ranges "a-b", steps "*/n" / "a-b/n" and lists "a,b";
+                         weekday 0 or 7 is Sunday
+
+    Occurrences missed while no dispatcher was running are not replayed: the next
+    occurrence is always computed from the later of the last occurrence and now.
+
+    Classes:
+        IntervalRule: Fixed wall-clock interval anchored at the first occurrence.
+        CronRule: Five-field cron expression.
+
+    Functions:
+        parse_rule(text): Parse and validate a rule, raising ValueError.
+        first_occurrence(rule, start): First fire time at or after a start time.
+        next_occurrence(rule, occurrence, now, until): Next fire time, or None when finished.
+"""
+
+
+@dataclass(frozen=True)
+class IntervalRule:
+    step: timedelta
+
+    def next_after(self, after: datetime, anchor: datetime) -> datetime:
+        """ First occurrence strictly after ``after``, counting in steps from ``anchor`` """
+        anchor_local = anchor.astimezone(LOCAL_TZ).replace(tzinfo=None)
+        after_local = after.astimezone(LOCAL_TZ).replace(tzinfo=None)
+        if after_local < anchor_local:
+            return anchor.astimezone(pytz.utc)
+        steps = (after_local - anchor_local) // self.step + 1
+        return LOCAL_TZ.localize(anchor_local + steps * self.step).astimezone(pytz.utc)
+
+
+#! (lowest, highest) value of each cron field
+_CRON_BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(text: str, lowest: int, highest: int) -> tuple[int, ...]:
+    values = set()
+    for part in text.split(","):
+        span, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if span == "*":
+            start, end = lowest, highest
+        elif "-" in span:
+            start, end = (int(v) for v in span.split("-", 1))
+        else:
+            start = end = int(span)
+        if step < 1 or start < lowest or end > highest or start > end:
+            raise ValueError(f"cron field '{text}' is outside {lowest}-{highest}")
+        values.update(range(start, end + 1, step))
+    return tuple(sorted(values))
+
+
+@dataclass(frozen=True)
+class CronRule:
+    minutes: tuple[int, ...]
+    hours: tuple[int, ...]
+    days: tuple[int, ...]
+    months: tuple[int, ...]
+    weekdays: tuple[int, ...]
+    #! cron semantics: when both day fields are restricted, a day matching either fires
+    either_day: bool
+
+    @classmethod
+    def parse(cls, expression: str) -> "CronRule":
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression '{expression}' needs 5 fields")
+        minutes, hours, days, months, weekdays = (
+            _parse_field(field, *bounds) for field, bounds in zip(fields, _CRON_BOUNDS))
+        weekdays = tuple(sorted({0 if day == 7 else day for day in weekdays}))
+        return cls(minutes, hours, days, months, weekdays, fields[2] != "*" and fields[4] != "*")
+
+    def _day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        return (in_days or in_weekdays) if self.either_day else (in_days and in_weekdays)
+
+    def next_after(self, after: datetime, anchor: datetime | None = None) -> datetime:
+        """ First matching minute strictly after ``after``.
+
+        ``anchor`` is ignored: it is accepted so both rule types share ``next_after``, but
+        cron times are absolute rather than counted from the first occurrence.
+        """
+        start = after.astimezone(LOCAL_TZ).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        #! five years covers every satisfiable combination, including Feb 29
+        for _ in range(5 * 366):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.combine(day, time(hour, minute))
+                        if candidate >= start:
+                            return LOCAL_TZ.localize(candidate).astimezone(pytz.utc)
+            day += timedelta(days=1)
+        raise ValueError("cron expression never fires")
+
+
+_NAMED_RULES = {
+    "daily": IntervalRule(timedelta(days=1)),
+    "weekly": IntervalRule(timedelta(weeks=1)),
+}
+
+
+@lru_cache(maxsize=256)
+def parse_rule(text: str) -> IntervalRule | CronRule:
+    """ Parse a recurrence rule.
+
+    :param text: "daily", "weekly" or a cron expression
+    :type text: str
+    :raises ValueError: if the rule is not understood
+    :return: the parsed rule
+    :rtype: IntervalRule | CronRule
+    """
+    rule = text.strip().lower()
+    if rule in _NAMED_RULES:
+        return _NAMED_RULES[rule]
+    if rule.startswith("cron:"):
+        rule = rule[len("cron:"):]
+    try:
+        return CronRule.parse(rule)
+    except ValueError as e:
+        raise ValueError(f"Unknown recurrence '{text}': {e}") from None
+
+
+def first_occurrence(rule: str, start: datetime) -> datetime:
+    """ First fire time of ``rule`` at or after ``start``; an occurrence exactly at ``start`` counts.
+
+    :param rule: recurrence rule text
+    :type rule: str
+    :param start: earliest allowed occurrence, aware; also the anchor of interval rules
+    :type start: datetime
+    :raises ValueError: if the rule is not understood or never fires
+    :return: the first occurrence as aware UTC
+    :rtype: datetime
+    """
+    #! next_after is strictly after; datetimes resolve to microseconds
+    return parse_rule(rule).next_after(start - timedelta(microseconds=1), start)
+
+
+def next_occurrence(rule: str, occurrence: datetime, now: datetime,
+                    until: datetime | None = None) -> datetime | None:
+    """ Next fire time of ``rule`` after the occurrence that just fired.
+
+    :param rule: recurrence rule text
+    :type rule: str
+    :param occurrence: the occurrence that was just sent, aware
+    :type occurrence: datetime
+    :param now: current time, aware; missed occurrences before it are skipped
+    :type now: datetime
+    :param until: last allowed occurrence, aware, None for no end
+    :type until: datetime | None
+    :return: the next occurrence as aware UTC, None when the rule has finished
+    :rtype: datetime | None
+    """
+    following = parse_rule(rule).next_after(max(occurrence, now), occurrence)
+    if until is not None and following > until:
+        return None
+    return following
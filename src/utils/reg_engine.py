@@ -1,45 +1,159 @@
 import os
+import threading
+from functools import lru_cache
 
-import faiss
 import numpy as np
 import requests
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 
 from utils.db import DataBaseManagement
+from utils.embed_worker import EmbedWorkerSettings, IndexQueue, get_embedding_process
+from utils.embedding_cache import get_embedding_cache
+from utils.vector_store import PartitionedIndex, PersistentIndex
 
 load_dotenv()
 
 PROXY_URL = os.getenv("CF_WORKER_URL")
 
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
 dimension = 384
-index = faiss.IndexFlatL2(dimension)
-documents = []
+#! rows pulled from Sent_Emails and embedded per round of load_and_index_emails
+SYNC_BATCH = 256
+#! ids below the high-water mark re-checked on every sync, for rows that committed after a higher id
+SYNC_LAG = 10000
 
+_partitions: PartitionedIndex | None = None
+_partitions_lock = threading.Lock()
+_index_queue: IndexQueue | None = None
+_index_queue_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def embedder():
+    """ The in-process sentence embedding model, only used with EMS_EMBED_WORKER=0 """
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(MODEL_NAME)
+
+
+@lru_cache(maxsize=1)
+def _encoder():
+    if EmbedWorkerSettings.from_env().enabled:
+        return get_embedding_process(MODEL_NAME).encode
+    return lambda texts: embedder().encode(texts)
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """ Embeddings of ``texts`` through the embedding cache; the model is called only for unseen texts """
+    return get_embedding_cache(MODEL_NAME, dimension).encode(list(texts), _encoder())
+
+
+def embedding_cache_stats() -> dict:
+    """ Hit / miss counters of the embedding cache """
+    return get_embedding_cache(MODEL_NAME, dimension).stats()
+
+
+def get_partitions() -> PartitionedIndex:
+    """ The per-user on-disk email indexes """
+    global _partitions
+    if _partitions is None:
+        with _partitions_lock:
+            if _partitions is None:
+                _partitions = PartitionedIndex(dimension, MODEL_NAME)
+    return _partitions
 
-def load_and_index_emails():
-    """Load all email bodies from MariaDB and index them in FAISS."""
-    db = DataBaseManagement()
-    all_emails = db.get_all_sent_emails()
-    email_bodies = [email[3] for email in all_emails]
-    if email_bodies:
-        add_documents(email_bodies)
 
+def get_index_queue() -> IndexQueue:
+    """ The background indexer, started on first use """
+    global _index_queue
+    if _index_queue is None:
+        with _index_queue_lock:
+            if _index_queue is None:
+                _index_queue = IndexQueue(load_and_index_emails)
+                _index_queue.start()
+    return _index_queue
 
-def add_documents(texts):
-    global documents
-    embeddings = embedder.encode(texts)
-    index.add(np.array(embeddings, dtype=np.float32))
-    documents.extend(texts)
 
+def index_async(user_id: int, email_ids=()):
+    """ Queue new sent emails of ``user_id`` for indexing without waiting for it """
+    if user_id is not None:
+        get_index_queue().put(user_id, email_ids)
 
-def search(query, k=3):
-    if len(documents) == 0 or index.ntotal == 0:
+
+def _add_late(db: DataBaseManagement, user_id: int, index: PersistentIndex) -> int:
+    """ Index rows within SYNC_LAG ids below the mark that are not in the index yet """
+    mark = index.high_water
+    if mark == 0:
+        return 0
+    recent = db.get_sent_emails_since(user_id, max(0, mark - SYNC_LAG), SYNC_LAG, fields=("email_id",))
+    late = index.missing([email.email_id for email in recent if email.email_id <= mark])
+    indexed = 0
+    for start in range(0, len(late), SYNC_BATCH):
+        emails = [email for email in db.get_sent_emails_by_ids(user_id, late[start:start + SYNC_BATCH]) if email.body]
+        if emails:
+            add_documents(index, [email.body for email in emails], [email.email_id for email in emails])
+        indexed += len(emails)
+    return indexed
+
+
+def _sync(db: DataBaseManagement, user_id: int, index: PersistentIndex) -> int:
+    #! emails without a body are never indexed, so they are looked up again while inside the window
+    indexed = _add_late(db, user_id, index)
+    while True:
+        emails = db.get_sent_emails_since(user_id, index.high_water, SYNC_BATCH)
+        if not emails:
+            break
+        with_body = [email for email in emails if email.body]
+        if with_body:
+            add_documents(index, [email.body for email in with_body], [email.email_id for email in with_body])
+        #! emails without a body still move the mark, so they are not read again
+        index.high_water = max(index.high_water, emails[-1].email_id)
+        indexed += len(with_body)
+        if len(emails) < SYNC_BATCH:
+            break
+    #! persist bulk loads right away; a few new emails wait in the delta for the next compaction
+    if indexed > SYNC_BATCH:
+        index.flush()
+    return indexed
+
+
+def load_and_index_emails(user_id: int, db: DataBaseManagement | None = None) -> int:
+    """Index the user's sent emails added since their partition's high-water mark.
+
+    Rows are read by Email_id above the mark in batches, so after a restart only emails
+    sent in the meantime are embedded. Email ids come from AUTO_INCREMENT and are
+    allocated at INSERT time, not at commit, so a transaction that commits late makes a
+    lower id visible after higher ones were indexed. Every sync therefore also reads the
+    ids of the user's rows within SYNC_LAG ids below the mark and indexes those the
+    partition does not hold; with nothing new both are cheap range scans on
+    idx_sent_user_id.
+
+    :return: number of emails indexed
+    :rtype: int
+    """
+    with get_partitions().use(user_id) as index:
+        return _sync(db or DataBaseManagement(), user_id, index)
+
+
+def add_documents(index: PersistentIndex, texts, ids):
+    index.add(list(ids), embed(texts))
+
+
+def search(query, user_id, k=3):
+    """ Bodies of the user's own past emails closest to ``query``; only that user's partition is scanned.
+    Emails not indexed yet are queued for the background indexer instead of being embedded here.
+    """
+    if user_id is None:
         return []
-    q_emb = embedder.encode([query])
-    D, I = index.search(np.array(q_emb, dtype=np.float32), min(k, index.ntotal))
-    return [documents[i] for i in I[0] if i < len(documents)]
+    index_async(user_id)
+    db = DataBaseManagement()
+    with get_partitions().use(user_id) as index:
+        if index.ntotal == 0:
+            return []
+        hits = [email_id for email_id, _ in index.search(embed([query]), k)]
+    bodies = {email.email_id: email.body for email in db.get_sent_emails_by_ids(user_id, hits)}
+    #! emails deleted since they were indexed are skipped
+    return [bodies[email_id] for email_id in hits if bodies.get(email_id)]
 
 def call_gemini(prompt, context=""):
     payload = {
@@ -67,8 +181,8 @@ def call_gemini(prompt, context=""):
         return f"❌ Request Failed: {e}"
 
 
-def generate_email_with_rag(user_prompt, title, tone="formal"):
-    context_docs = search(user_prompt)
+def generate_email_with_rag(user_prompt, title, tone="formal", user_id=None):
+    context_docs = search(user_prompt, user_id)
     context = "\n".join(context_docs) if context_docs else "No relevant past data."
     tone_instruction = "- Use a formal and professional tone." if tone == "formal" else "- Use a casual and friendly tone."
     enhanced_prompt = (
@@ -0,0 +1,202 @@
+from datetime import datetime
+from typing import NamedTuple
+
+""" Typed row objects for EMS tables.
+
+    Each table has a NamedTuple whose fields follow the table's column order, so rows are
+    as compact as plain tuples (no per-instance ``__dict__``) but are read by name instead
+    of by magic index. Queries can select only some columns; fields that were not
+    selected are left as None, so a projection never shifts the position of the others.
+
+    Classes:
+        Profile, Template, SentEmail, Schedule, ScheduleView, DueSchedule, Reminder, ReminderView,
+        DueReminder, UserProfile, SocialMedia, OutboxEntry
+
+    Functions:
+        select_columns(row_type, fields): Validate a projection and build its SQL column list.
+        to_rows(row_type, fields, rows): Wrap fetched tuples in ``row_type``.
+
+    Constants:
+        LIST_FIELDS: Default projection for list views, without body and credential columns.
+"""
+
+
+class Profile(NamedTuple):
+    id: int | None = None
+    name: str | None = None
+    email: str | None = None
+    title: str | None = None
+    profession: str | None = None
+    user_id: int | None = None
+
+
+class Template(NamedTuple):
+    id: int | None = None
+    name: str | None = None
+    body: str | None = None
+    user_id: int | None = None
+
+
+class SentEmail(NamedTuple):
+    email_id: int | None = None
+    recipients: str | None = None
+    subject: str | None = None
+    body: str | None = None
+    sent_date: datetime | None = None
+    notified: bool | None = None
+    user_id: int | None = None
+
+
+class Schedule(NamedTuple):
+    email_id: int | None = None
+    scheduled_date: datetime | None = None
+    user_id: int | None = None
+    changed_at: datetime | None = None
+
+
+class DueSchedule(NamedTuple):
+    """ A schedule with everything needed to send it, see DataBaseManagement.claim_due_schedules """
+    email_id: int
+    user_id: int
+    sender: str
+    recipients: str
+    subject: str
+    body: str
+    scheduled_date: datetime
+    recurrence: str | None = None
+    recurrence_until: datetime | None = None
+
+
+class ScheduleView(NamedTuple):
+    """ Schedules joined with Sent_Emails, see DataBaseManagement.get_schedules_view """
+    email_id: int
+    recipients: str
+    subject: str
+    scheduled_date: datetime
+    notified: bool
+    recurrence: str | None = None
+    failed_at: datetime | None = None
+
+
+class Reminder(NamedTuple):
+    email_id: int | None = None
+    remind_date: datetime | None = None
+    note: str | None = None
+    fired_at: datetime | None = None
+
+
+class ReminderView(NamedTuple):
+    """ Reminders joined with Sent_Emails, see DataBaseManagement.get_reminders_view """
+    email_id: int
+    recipients: str
+    subject: str
+    remind_date: datetime
+    note: str | None
+    fired_at: datetime | None
+
+
+class DueReminder(NamedTuple):
+    """ A reminder with everything needed to fire it, see DataBaseManagement.claim_due_reminders """
+    email_id: int
+    user_id: int
+    owner_email: str
+    recipients: str
+    subject: str
+    remind_date: datetime
+    note: str | None
+
+
+class UserProfile(NamedTuple):
+    user_id: int | None = None
+    name: str | None = None
+    title: str | None = None
+    profession: str | None = None
+    signature: str | None = None
+    email: str | None = None
+    encrypted_password: str | None = None
+
+
+class SocialMedia(NamedTuple):
+    user_id: int | None = None
+    linkedin: str | None = None
+    x: str | None = None
+    telegram: str | None = None
+    github: str | None = None
+
+
+class OutboxEntry(NamedTuple):
+    id: int | None = None
+    idempotency_key: str | None = None
+    user_id: int | None = None
+    sender: str | None = None
+    recipient: str | None = None
+    subject: str | None = None
+    body: str | None = None
+    attachment_name: str | None = None
+    attachment: bytes | None = None
+    email_id: int | None = None
+    state: str | None = None
+    attempts: int | None = None
+    max_attempts: int | None = None
+    next_attempt_at: datetime | None = None
+    last_error: str | None = None
+    created_at: datetime | None = None
+    sent_at: datetime | None = None
+    batch_key: str | None = None
+
+
+#! python field -> SQL column, for the columns whose names differ only in spelling/case
+SQL_COLUMNS: dict[type, dict[str, str]] = {
+    Profile: {"id": "id", "name": "Name", "email": "Email", "title": "Title",
+              "profession": "Profession", "user_id": "User_id"},
+    Template: {"id": "id", "name": "Name", "body": "Body", "user_id": "User_id"},
+    SentEmail: {"email_id": "Email_id", "recipients": "Recipients", "subject": "Subject", "body": "Body",
+                "sent_date": "Sent_date", "notified": "notified", "user_id": "User_id"},
+    Schedule: {"email_id": "Email_id", "scheduled_date": "Scheduled_date", "user_id": "User_id",
+               "changed_at": "Changed_at"},
+    Reminder: {"email_id": "Email_id", "remind_date": "Remind_date", "note": "Note", "fired_at": "Fired_at"},
+    UserProfile: {"user_id": "User_id", "name": "Name", "title": "Title", "profession": "Proffesion",
+                  "signature": "Signiture", "email": "Email", "encrypted_password": "Encrypted_password"},
+    SocialMedia: {"user_id": "User_id", "linkedin": "LinkedIn", "x": "X", "telegram": "Telegram",
+                  "github": "Github"},
+    OutboxEntry: {"id": "id", "idempotency_key": "Idempotency_key", "user_id": "User_id", "sender": "Sender",
+                  "recipient": "Recipient", "subject": "Subject", "body": "Body",
+                  "attachment_name": "Attachment_name", "attachment": "Attachment", "email_id": "Email_id",
+                  "state": "State", "attempts": "Attempts", "max_attempts": "Max_attempts",
+                  "next_attempt_at": "Next_attempt_at", "last_error": "Last_error",
+                  "created_at": "Created_at", "sent_at": "Sent_at", "batch_key": "Batch_key"},
+}
+
+LIST_FIELDS: dict[type, tuple[str, ...]] = {
+    Profile: Profile._fields,
+    Template: ("id", "name", "user_id"),
+    SentEmail: ("email_id", "recipients", "subject", "sent_date", "notified", "user_id"),
+    UserProfile: ("user_id", "name", "title", "profession", "signature", "email"),
+    OutboxEntry: ("id", "recipient", "subject", "email_id", "state", "attempts", "next_attempt_at", "last_error"),
+}
+
+
+def select_columns(row_type: type, fields: tuple[str, ...] | None = None) -> tuple[tuple[str, ...], str]:
+    """ Validate ``fields`` for ``row_type`` and build the matching SQL column list.
+
+    :param row_type: one of the row classes in this module
+    :type row_type: type
+    :param fields: fields to select, defaults to every field
+    :type fields: tuple[str, ...] | None
+    :raises ValueError: if a field does not exist on ``row_type``
+    :return: (fields, comma separated SQL columns)
+    :rtype: tuple[tuple[str, ...], str]
+    """
+    fields = tuple(fields) if fields else row_type._fields
+    columns = SQL_COLUMNS[row_type]
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f"{row_type.__name__} has no field(s) {', '.join(unknown)}")
+    return fields, ", ".join(columns[field] for field in fields)
+
+
+def to_rows(row_type: type, fields: tuple[str, ...], rows: list) -> list:
+    """ Wrap fetched tuples, selected in ``fields`` order, in ``row_type`` """
+    if fields == row_type._fields:
+        return [row_type._make(row) for row in rows]
+    return [row_type(**dict(zip(fields, row))) for row in rows]
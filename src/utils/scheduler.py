@@ -0,0 +1,335 @@
+import argparse
+import heapq
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import pytz
+from loguru import logger
+
+from utils.db import LOCAL_TZ, DataBaseManagement
+from utils.outbox import OutboxWorker, batch_key, get_outbox_worker, new_entry, reminder_key, schedule_key
+from utils.recurrence import next_occurrence
+from utils.rows import DueReminder, DueSchedule
+
+""" Scheduled email dispatcher for EMS.
+
+    Scheduled emails used to go out only while somebody had Home.py open. The
+    ``ScheduleDispatcher`` keeps every pending schedule in a min-heap ordered by due time
+    and sleeps until the earliest one is due, so delivery no longer depends on page traffic.
+
+    New and edited schedules are picked up incrementally through the Schedules.Changed_at
+    stamp: each refresh only reads rows changed since the last one (minus a small overlap
+    for transactions that committed late). Heap entries are never updated in place; an
+    edited schedule is pushed again and the outdated entry is skipped when it surfaces.
+
+    The heap only decides when to look. Due rows are taken with
+    ``DataBaseManagement.claim_due_schedules`` (SELECT ... FOR UPDATE SKIP LOCKED plus a
+    lease), so dispatchers on several nodes split the work without duplicates, and rows
+    whose dispatcher died are reclaimed once the lease expires. Every refresh also claims
+    once to collect such rows even when the local heap has nothing due.
+
+    Claimed schedules are handed to the outbox as the owning user, so utils.outbox sends
+    them with that user's credentials. Schedules of one sender due in the same minute (a
+    campaign scheduled from the Send Email page) share a batch key, which the outbox
+    worker sends as one group over one SMTP session with one credential lookup. A recurring schedule (see utils.recurrence) is then
+    moved to its next occurrence, which the next refresh pushes onto the heap; future
+    occurrences are never materialized.
+
+    Reminders fire through the same loop. They need no heap: pending reminders are
+    Fired_at IS NULL, so the earliest remind date is one index probe
+    (``get_next_reminder_time``), read on every refresh. When it has passed,
+    ``dispatch_reminders`` claims due reminders in batches and queues a note to the owner
+    of each email. Snoozing moves Remind_date and clears Fired_at, so the reminder fires
+    again under a new outbox key.
+
+    The Streamlit app starts a dispatcher and an outbox worker on its first script run
+    (``start_background``), so nothing waits for a particular page. Deployments that run
+    the headless runner instead set EMS_SCHEDULER_EMBEDDED=0:
+
+        cd src && python -m utils.scheduler    # headless dispatcher plus outbox worker
+
+    Classes:
+        SchedulerSettings: Refresh interval and overlap, read from the environment.
+        ScheduleDispatcher: Due-time heap over pending schedules, plus due reminders.
+
+    Functions:
+        get_dispatcher(): The in-process dispatcher, started on first use.
+        start_background(): Start the in-process dispatcher and outbox worker.
+
+    Environment variables:
+        EMS_SCHEDULER_REFRESH (seconds between incremental refreshes, default 5),
+        EMS_SCHEDULER_OVERLAP (seconds re-read on every refresh, default 5),
+        EMS_SCHEDULER_CLAIM_BATCH (default 100), EMS_SCHEDULER_LEASE (seconds, default 300),
+        EMS_SCHEDULER_EMBEDDED (0 to leave dispatching to the headless runner, default 1)
+"""
+
+
+@dataclass(frozen=True)
+class SchedulerSettings:
+    refresh_interval: float = 5.0
+    overlap: float = 5.0
+    claim_batch: int = 100
+    lease: float = 300.0    # seconds a claimed schedule is reserved for its dispatcher
+    embedded: bool = True   # the app process runs its own dispatcher and outbox worker
+
+    @classmethod
+    def from_env(cls) -> "SchedulerSettings":
+        """ Build settings from EMS_SCHEDULER_* environment variables, falling back to defaults """
+        return cls(
+            refresh_interval=float(os.getenv("EMS_SCHEDULER_REFRESH", cls.refresh_interval)),
+            overlap=float(os.getenv("EMS_SCHEDULER_OVERLAP", cls.overlap)),
+            claim_batch=int(os.getenv("EMS_SCHEDULER_CLAIM_BATCH", cls.claim_batch)),
+            lease=float(os.getenv("EMS_SCHEDULER_LEASE", cls.lease)),
+            embedded=os.getenv("EMS_SCHEDULER_EMBEDDED", "1") != "0",
+        )
+
+
+class ScheduleDispatcher:
+    def __init__(self, db: DataBaseManagement | None = None, settings: SchedulerSettings | None = None,
+                 worker: OutboxWorker | None = None):
+        """Sends scheduled emails when they fall due
+
+        :param db: database access, defaults to a new DataBaseManagement
+        :type db: DataBaseManagement | None
+        :param settings: refresh settings, defaults to ``SchedulerSettings.from_env()``
+        :type settings: SchedulerSettings | None
+        :param worker: outbox worker to wake after queueing, defaults to the in-process one
+        :type worker: OutboxWorker | None
+        """
+        self.db = db or DataBaseManagement()
+        self.settings = settings or SchedulerSettings.from_env()
+        self.worker = worker
+        self._heap: list[tuple[datetime, int]] = []
+        #! latest known due time per schedule; heap entries that disagree are outdated
+        self._due: dict[int, datetime] = {}
+        self._high_water: datetime | None = None
+        self._next_reminder: datetime | None = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def refresh(self) -> int:
+        """ Push schedules added or edited since the last refresh onto the heap.
+
+        :return: number of heap entries pushed
+        :rtype: int
+        """
+        since = None
+        if self._high_water is not None:
+            since = self._high_water - timedelta(seconds=self.settings.overlap)
+        pushed = 0
+        for schedule in self.db.get_pending_schedules(changed_after=since):
+            if schedule.changed_at is not None and (self._high_water is None or schedule.changed_at > self._high_water):
+                self._high_water = schedule.changed_at
+            if schedule.scheduled_date is None or self._due.get(schedule.email_id) == schedule.scheduled_date:
+                continue
+            self._due[schedule.email_id] = schedule.scheduled_date
+            heapq.heappush(self._heap, (schedule.scheduled_date, schedule.email_id))
+            pushed += 1
+        self._next_reminder = self.db.get_next_reminder_time()
+        return pushed
+
+    def next_due(self) -> datetime | None:
+        """ Due time of the earliest live heap entry """
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def dispatch_due(self, now: datetime | None = None, force: bool = False) -> int:
+        """ Claim and queue due schedules in the outbox.
+
+        The heap only tells when to look; which rows are sent is decided by
+        ``claim_due_schedules``, so several dispatchers never queue the same row twice and
+        rows whose lease expired (their dispatcher died) are picked up as well.
+
+        :param now: current time, defaults to now
+        :type now: datetime | None
+        :param force: claim even if nothing in the heap is due, to collect expired leases
+        :type force: bool
+        :return: number of emails queued
+        :rtype: int
+        """
+        now = now or datetime.now(pytz.utc)
+        popped = False
+        while self._heap and self._heap[0][0] <= now:
+            scheduled_date, email_id = heapq.heappop(self._heap)
+            if self._due.get(email_id) == scheduled_date:
+                del self._due[email_id]
+                popped = True
+        if not (popped or force):
+            return 0
+
+        queued = 0
+        while True:
+            claimed = self.db.claim_due_schedules(self.settings.claim_batch, self.settings.lease)
+            if not claimed:
+                break
+            entries, advances = [], []
+            for schedule in claimed:
+                recurring = self._advance(schedule, now, advances)
+                #! a recurring draft stays a draft; every occurrence is delivered as a new sent email
+                entries.append(new_entry(
+                    schedule.user_id, schedule.sender, schedule.recipients, schedule.subject, schedule.body,
+                    email_id=None if recurring else schedule.email_id,
+                    key=schedule_key(schedule.email_id, schedule.scheduled_date),
+                    batch=batch_key(schedule.user_id, schedule.sender, schedule.scheduled_date),
+                ))
+            if not self.db.enqueue_outbox(entries):
+                self.db.release_schedule_claims([schedule.email_id for schedule in claimed])
+                break
+            #! if this fails the lease expires, the occurrence is re-queued under the same key and advanced then
+            self.db.advance_schedules(advances)
+            queued += len(entries)
+            if len(claimed) < self.settings.claim_batch:
+                break
+        if queued:
+            (self.worker or get_outbox_worker()).wake()
+            logger.info(f"{queued} scheduled emails queued")
+        return queued
+
+    def dispatch_reminders(self, now: datetime | None = None, force: bool = False) -> int:
+        """ Claim due reminders in batches and queue a reminder email to each owner.
+
+        :param now: current time, defaults to now
+        :type now: datetime | None
+        :param force: claim even if the earliest known reminder is not due, to collect expired leases
+        :type force: bool
+        :return: number of reminders fired
+        :rtype: int
+        """
+        now = now or datetime.now(pytz.utc)
+        if not force and (self._next_reminder is None or self._next_reminder > now):
+            return 0
+
+        fired = 0
+        while True:
+            claimed = self.db.claim_due_reminders(self.settings.claim_batch, self.settings.lease)
+            if not claimed:
+                break
+            entries = [new_entry(reminder.user_id, reminder.owner_email, reminder.owner_email,
+                                 f"🔔 Reminder: {reminder.subject}"[:100], _reminder_body(reminder),
+                                 key=reminder_key(reminder.email_id, reminder.remind_date))
+                       for reminder in claimed]
+            #! on failure the lease expires and the reminder is claimed again under the same key
+            if not self.db.enqueue_outbox(entries):
+                break
+            self.db.mark_reminders_fired([reminder.email_id for reminder in claimed])
+            fired += len(claimed)
+            if len(claimed) < self.settings.claim_batch:
+                break
+        following = self.db.get_next_reminder_time()
+        #! a reminder still due now is leased by another dispatcher; the forced claim on refresh collects it
+        self._next_reminder = following if following is not None and following > now else None
+        if fired:
+            (self.worker or get_outbox_worker()).wake()
+            logger.info(f"{fired} reminders fired")
+        return fired
+
+    @staticmethod
+    def _advance(schedule: DueSchedule, now: datetime, advances: list) -> bool:
+        """ Append the next occurrence of a recurring schedule to ``advances``; False for one-off schedules """
+        if not schedule.recurrence:
+            return False
+        try:
+            following = next_occurrence(schedule.recurrence, schedule.scheduled_date, now, schedule.recurrence_until)
+        except ValueError as e:
+            logger.error(f"Schedule {schedule.email_id}: {e}, sending it once")
+            following = None
+        advances.append((schedule.email_id, following))
+        return True
+
+    def run_forever(self):
+        """ Dispatch until ``stop`` is called, sleeping until the next due time or refresh """
+        next_refresh = datetime.now(pytz.utc)
+        while not self._stop.is_set():
+            now = datetime.now(pytz.utc)
+            try:
+                refreshing = now >= next_refresh
+                if refreshing:
+                    self.refresh()
+                    next_refresh = now + timedelta(seconds=self.settings.refresh_interval)
+                self.dispatch_due(now, force=refreshing)
+                self.dispatch_reminders(now, force=refreshing)
+            except Exception as e:
+                logger.error(f"Scheduler error: {e!s}")
+
+            wake_at = next_refresh
+            next_due = self.next_due()
+            if next_due is not None and next_due < wake_at:
+                wake_at = next_due
+            if self._next_reminder is not None and self._next_reminder < wake_at:
+                wake_at = self._next_reminder
+            if self._wake.wait(max(0.0, (wake_at - datetime.now(pytz.utc)).total_seconds())):
+                self._wake.clear()
+                next_refresh = datetime.now(pytz.utc)
+
+    def start(self):
+        """ Run the dispatcher on a daemon thread """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="ems-scheduler", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """ Refresh now, e.g. right after a schedule or reminder was added """
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _reminder_body(reminder: DueReminder) -> str:
+    remind_at = reminder.remind_date.astimezone(LOCAL_TZ).strftime("%Y-%m-%d %H:%M")
+    lines = [
+        f"This is the reminder you set for {remind_at} about your email",
+        "",
+        f"    To: {reminder.recipients}",
+        f"    Subject: {reminder.subject}",
+    ]
+    if reminder.note:
+        lines += ["", f"Note: {reminder.note}"]
+    lines += ["", "Snooze or dismiss it on the Reminders page of EMS."]
+    return "\n".join(lines)
+
+
+_dispatcher: ScheduleDispatcher | None = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> ScheduleDispatcher:
+    """ Return the in-process schedule dispatcher, starting it on first use unless EMS_SCHEDULER_EMBEDDED=0 """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = ScheduleDispatcher()
+                if _dispatcher.settings.embedded:
+                    _dispatcher.start()
+    return _dispatcher
+
+
+def start_background():
+    """ Start the in-process dispatcher and outbox worker; called at the top of the app scripts, a no-op after the first """
+    if get_dispatcher().settings.embedded:
+        get_outbox_worker()
+
+
+def main():
+    argparse.ArgumentParser(description="EMS scheduled email dispatcher").parse_args()
+    worker = OutboxWorker()
+    worker.start()
+    dispatcher = ScheduleDispatcher(db=worker.db, worker=worker)
+    try:
+        dispatcher.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Scheduler stopped")
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+import os
+import smtplib
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import pytz
+from loguru import logger
+
+from utils.db import DataBaseManagement
+from utils.send_mail import AsyncDeliveryEngine, SMTPSessionPool, build_message, get_delivery_engine, get_smtp_pool
+
+""" Parallel campaign sending for EMS.
+
+    ``SendExecutor`` fans the messages of a campaign out over a bounded thread pool that
+    shares the pooled SMTP sessions of utils.send_mail. Every sender account gets
+
+    - a concurrency cap (parallel SMTP conversations for that account),
+    - a per-minute token bucket, refilled continuously (burst = one second worth of
+      messages, at least one), and
+    - a per-day quota counted per UTC calendar day, starting from what the outbox already
+      delivered that day, so a restart does not hand out a fresh day's quota,
+
+    so large campaigns finish in a fraction of the time without exceeding provider limits.
+    The same ``SenderLimits`` are the quotas utils.planner plans send slots against, over
+    the same UTC days, so the planned pace and the enforced pace cannot drift apart.
+    A message beyond the day's quota is reported as deferred instead of blocking the
+    campaign until midnight; so is a message the
+    server refused with a throttling reply (``THROTTLE_CODES``). A deferred result means
+    "send it later", not that the message is bad.
+
+    ``send_batch`` is the sequential counterpart for coalesced batches (see utils.outbox):
+    same limits, but all messages go over one held SMTP session.
+
+    With EMS_SEND_ENGINE=asyncio, ``send_campaign`` hands the messages to the asyncio
+    ``AsyncDeliveryEngine`` of utils.send_mail instead of the thread pool: the buckets are
+    still drawn from up front, and each message starts on the event loop once its
+    reservation is due. Parallel conversations per sender are then bounded by the engine's
+    ``max_per_sender`` rather than ``SenderLimits.concurrency``.
+
+    Classes:
+        TokenBucket: Thread-safe token bucket.
+        DailyQuota: Thread-safe per-UTC-day message counter.
+        SenderLimits: Per-sender concurrency and rate limits.
+        OutgoingEmail: One message of a campaign.
+        SendResult: Outcome for one recipient.
+        SendExecutor: Bounded thread pool with per-sender throttling.
+
+    Functions:
+        get_send_executor(): The process-wide SendExecutor.
+
+    Environment variables:
+        EMS_SEND_WORKERS (default 16), EMS_SEND_CONCURRENCY (per sender, default 4),
+        EMS_SEND_PER_MINUTE (default 20), EMS_SEND_PER_DAY (default 2000),
+        EMS_SEND_ENGINE ("threads" or "asyncio", default "threads")
+"""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """Token bucket refilled continuously
+
+        :param rate: tokens added per second
+        :type rate: float
+        :param capacity: maximum tokens held (burst size)
+        :type capacity: float
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """ Take one token, possibly going into debt; return the seconds to wait before using it """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_reserve(self, max_wait: float) -> float | None:
+        """ Like ``reserve`` but leave the bucket untouched and return None if the wait exceeds ``max_wait`` """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class DailyQuota:
+    def __init__(self, per_day: int, used_since: Callable[[datetime], int] | None = None):
+        """Messages allowed per UTC calendar day
+
+        :param per_day: messages allowed per day
+        :type per_day: int
+        :param used_since: messages already sent since an aware UTC midnight, asked once per day;
+            None starts every day at 0
+        :type used_since: Callable[[datetime], int] | None
+        """
+        self.per_day = per_day
+        self.used_since = used_since
+        self._day: datetime | None = None
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _roll(self) -> datetime:
+        """ Start counting a new day when the UTC date changed; return the current time """
+        now = datetime.now(pytz.utc)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if midnight != self._day:
+            self._day = midnight
+            self._used = self.used_since(midnight) if self.used_since else 0
+        return now
+
+    def wait(self) -> float:
+        """ Seconds until one more message is allowed: 0 today, else until the next UTC midnight """
+        with self._lock:
+            now = self._roll()
+            if self._used < self.per_day:
+                return 0.0
+            return (self._day + timedelta(days=1) - now).total_seconds()
+
+    def try_reserve(self) -> bool:
+        """ Count one message against today's quota; False and nothing counted if it is used up """
+        with self._lock:
+            self._roll()
+            if self._used >= self.per_day:
+                return False
+            self._used += 1
+            return True
+
+
+@dataclass(frozen=True)
+class SenderLimits:
+    concurrency: int = 4
+    per_minute: int = 20
+    per_day: int = 2000
+
+    @classmethod
+    def from_env(cls) -> "SenderLimits":
+        return cls(
+            concurrency=int(os.getenv("EMS_SEND_CONCURRENCY", cls.concurrency)),
+            per_minute=int(os.getenv("EMS_SEND_PER_MINUTE", cls.per_minute)),
+            per_day=int(os.getenv("EMS_SEND_PER_DAY", cls.per_day)),
+        )
+
+
+@dataclass(frozen=True)
+class OutgoingEmail:
+    to: str
+    subject: str
+    contents: str
+    attachments: object = None
+
+
+@dataclass(frozen=True)
+class SendResult:
+    recipient: str
+    ok: bool
+    error: str | None = None
+    elapsed: float = 0.0
+    code: int | None = None     # SMTP reply code of the failure, None for local / network errors
+    deferred: bool = False      # refused for quota or throttling, says nothing about the message itself
+
+
+#! SMTP replies providers use for "slow down": too many connections / messages / recipients
+THROTTLE_CODES = frozenset({421, 450, 451, 452})
+
+
+def _smtp_code(error: Exception) -> int | None:
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return getattr(error, "smtp_code", None)
+
+
+class _SenderState:
+    __slots__ = ("semaphore", "per_minute", "per_day")
+
+    def __init__(self, limits: SenderLimits, used_since: Callable[[datetime], int] | None = None):
+        self.semaphore = threading.BoundedSemaphore(limits.concurrency)
+        self.per_minute = TokenBucket(limits.per_minute / 60, max(1.0, limits.per_minute / 60))
+        self.per_day = DailyQuota(limits.per_day, used_since)
+
+
+class SendExecutor:
+    def __init__(self, max_workers: int | None = None, limits: SenderLimits | None = None,
+                 smtp_pool: SMTPSessionPool | None = None, engine: AsyncDeliveryEngine | None = None,
+                 sent_since: Callable[[str, datetime], int] | None = None):
+        """Bounded thread pool sending campaigns with per-sender throttling
+
+        :param max_workers: threads shared by all senders, defaults to EMS_SEND_WORKERS or 16
+        :type max_workers: int | None
+        :param limits: default limits for senders without an explicit ``set_limits``
+        :type limits: SenderLimits | None
+        :param smtp_pool: SMTP session pool, defaults to the process-wide pool
+        :type smtp_pool: SMTPSessionPool | None
+        :param engine: asyncio engine delivering campaigns, defaults to the process-wide one
+            when EMS_SEND_ENGINE is "asyncio" and to the thread pool otherwise
+        :type engine: AsyncDeliveryEngine | None
+        :param sent_since: messages of a sender delivered since a UTC time, the start of each
+            day's count; None counts only this executor's sends
+        :type sent_since: Callable[[str, datetime], int] | None
+        """
+        self.max_workers = max_workers or int(os.getenv("EMS_SEND_WORKERS", 16))
+        self.limits = limits or SenderLimits.from_env()
+        self.smtp_pool = smtp_pool
+        self.sent_since = sent_since
+        if engine is None and os.getenv("EMS_SEND_ENGINE", "threads").lower() == "asyncio":
+            engine = get_delivery_engine()
+        self.engine = engine
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ems-send")
+        self._senders: dict[str, _SenderState] = {}
+        self._sender_limits: dict[str, SenderLimits] = {}
+        self._lock = threading.Lock()
+
+    def set_limits(self, sender_email: str, limits: SenderLimits):
+        """ Override the limits of one sender account """
+        with self._lock:
+            self._sender_limits[sender_email] = limits
+            self._senders.pop(sender_email, None)
+
+    def _state(self, sender_email: str) -> _SenderState:
+        with self._lock:
+            state = self._senders.get(sender_email)
+            if state is None:
+                used_since = None
+                if self.sent_since is not None:
+                    used_since = lambda midnight: self.sent_since(sender_email, midnight)
+                state = _SenderState(self._sender_limits.get(sender_email, self.limits), used_since)
+                self._senders[sender_email] = state
+            return state
+
+    def _send_one(self, sender_email: str, sender_password: str, email: OutgoingEmail) -> SendResult:
+        started = time.monotonic()
+        state = self._state(sender_email)
+
+        if not state.per_day.try_reserve():
+            return SendResult(email.to, False, "daily sending quota exhausted", 0.0, deferred=True)
+        time.sleep(state.per_minute.reserve())
+
+        with state.semaphore:
+            try:
+                message = build_message(sender_email, email.to, email.subject, email.contents, email.attachments)
+                (self.smtp_pool or get_smtp_pool()).send(sender_email, sender_password, message)
+            except Exception as e:
+                return self._failed(email, e, started)
+        return SendResult(email.to, True, None, time.monotonic() - started)
+
+    def _failed(self, email: OutgoingEmail, error: Exception, started: float) -> SendResult:
+        logger.error(f"Failed to send email to {email.to}: {error!s}")
+        code = _smtp_code(error)
+        return SendResult(email.to, False, str(error), time.monotonic() - started, code, deferred=code in THROTTLE_CODES)
+
+    def _send_async(self, sender_email: str, sender_password: str, emails: list[OutgoingEmail]) -> list[SendResult]:
+        """ ``send_campaign`` on the asyncio engine: reserve every message up front, deliver on the loop """
+        started = time.monotonic()
+        state = self._state(sender_email)
+        pending = []
+        for email in emails:
+            if not state.per_day.try_reserve():
+                pending.append(SendResult(email.to, False, "daily sending quota exhausted", 0.0, deferred=True))
+                continue
+            #! the per-minute reservation becomes the delay on the loop
+            delay = state.per_minute.reserve()
+            try:
+                message = build_message(sender_email, email.to, email.subject, email.contents, email.attachments)
+            except Exception as e:
+                pending.append(self._failed(email, e, started))
+                continue
+            pending.append(self.engine.submit(sender_email, sender_password, message, delay))
+
+        results = []
+        for email, outcome in zip(emails, pending):
+            if isinstance(outcome, SendResult):
+                results.append(outcome)
+                continue
+            try:
+                outcome.result()
+            except Exception as e:
+                results.append(self._failed(email, e, started))
+            else:
+                results.append(SendResult(email.to, True, None, time.monotonic() - started))
+        return results
+
+    def send_campaign(self, sender_email: str, sender_password: str, emails: list[OutgoingEmail]) -> list[SendResult]:
+        """ Send every message of a campaign and wait for all of them.
+
+        :param sender_email: sender account
+        :type sender_email: str
+        :param sender_password: sender account password
+        :type sender_password: str
+        :param emails: messages to send
+        :type emails: list[OutgoingEmail]
+        :return: one SendResult per message, in the order of ``emails``
+        :rtype: list[SendResult]
+        """
+        if self.engine is not None:
+            results = self._send_async(sender_email, sender_password, emails)
+        else:
+            futures = [self._executor.submit(self._send_one, sender_email, sender_password, email) for email in emails]
+            results = [future.result() for future in futures]
+        sent = sum(result.ok for result in results)
+        logger.info(f"Campaign of {sender_email}: {sent}/{len(results)} sent")
+        return results
+
+    def send_batch(self, sender_email: str, sender_password: str, emails: list[OutgoingEmail]) -> list[SendResult]:
+        """ Send a coalesced batch one after another over a single SMTP session.
+
+        The batch takes one of the sender's concurrency slots for its whole duration and
+        still draws every message from the per-minute bucket and the daily quota. A rejected
+        login or a throttling reply (``THROTTLE_CODES``) fails the rest of the batch
+        instead of hammering the server with every remaining message.
+
+        :param sender_email: sender account
+        :type sender_email: str
+        :param sender_password: sender account password
+        :type sender_password: str
+        :param emails: messages to send
+        :type emails: list[OutgoingEmail]
+        :return: one SendResult per message, in the order of ``emails``
+        :rtype: list[SendResult]
+        """
+        state = self._state(sender_email)
+        results = []
+        with state.semaphore, (self.smtp_pool or get_smtp_pool()).hold(sender_email, sender_password) as session:
+            for index, email in enumerate(emails):
+                started = time.monotonic()
+                if not state.per_day.try_reserve():
+                    results.append(SendResult(email.to, False, "daily sending quota exhausted", 0.0, deferred=True))
+                    continue
+                time.sleep(state.per_minute.reserve())
+                try:
+                    session.send(build_message(sender_email, email.to, email.subject, email.contents, email.attachments))
+                except smtplib.SMTPAuthenticationError as e:
+                    logger.error(f"Login of {sender_email} rejected, failing the batch: {e!s}")
+                    results += [SendResult(rest.to, False, str(e), 0.0, e.smtp_code) for rest in emails[index:]]
+                    break
+                except Exception as e:
+                    logger.error(f"Failed to send email to {email.to}: {e!s}")
+                    code = _smtp_code(e)
+                    throttled = code in THROTTLE_CODES
+                    results.append(SendResult(email.to, False, str(e), time.monotonic() - started, code, throttled))
+                    if throttled:
+                        #! pushing on after "slow down" only gets the account blocked
+                        results += [SendResult(rest.to, False, f"not sent, sender throttled: {e!s}", 0.0, code, True)
+                                    for rest in emails[index + 1:]]
+                        break
+                    continue
+                results.append(SendResult(email.to, True, None, time.monotonic() - started))
+        logger.info(f"Batch of {sender_email}: {sum(r.ok for r in results)}/{len(results)} sent on one session")
+        return results
+
+    def quota_wait(self, sender_email: str) -> float:
+        """ Seconds until ``sender_email`` has daily quota for one more message """
+        return self._state(sender_email).per_day.wait()
+
+    def limits_for(self, sender_email: str) -> SenderLimits:
+        """ Limits in force for ``sender_email`` """
+        with self._lock:
+            return self._sender_limits.get(sender_email, self.limits)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_executor: SendExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_send_executor() -> SendExecutor:
+    """ Return the process-wide send executor """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = SendExecutor(sent_since=DataBaseManagement().count_sent_since)
+    return _executor
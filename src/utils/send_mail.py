@@ -1,6 +1,356 @@
-import yagmail
+import asyncio
+import base64
+import concurrent.futures
+import copy
+import email.policy
+import hashlib
+import mimetypes
+import os
+import re
+import smtplib
+import socket
+import ssl
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.message import EmailMessage
+from email.utils import formatdate, getaddresses, make_msgid
+
 from loguru import logger
 
+""" Email delivery for EMS.
+
+    ``send_email`` keeps its original signature but no longer opens a new SMTP connection
+    per message. Authenticated sessions are kept in a process-wide ``SMTPSessionPool``
+    keyed by server and sender account, so a campaign (and every Streamlit session of the
+    same sender) reuses a handful of connections instead of paying TCP connect, TLS
+    handshake and AUTH for every recipient.
+
+    Idle sessions are probed with NOOP before reuse, dropped after ``max_idle`` seconds,
+    and a send that fails with 421 or a dropped connection is retried once on a fresh
+    session.
+
+    For dispatchers that keep thousands of messages in flight, ``AsyncDeliveryEngine``
+    speaks SMTP directly over asyncio streams on a few event-loop threads. Each message is
+    a coroutine rather than a thread, every sender gets up to ``max_per_sender`` concurrent
+    conversations, and MAIL / RCPT / DATA go out in one write when the server advertises
+    PIPELINING (RFC 2920). Errors are raised as the usual ``smtplib`` exceptions. The send
+    executor of utils.send_executor delivers campaigns through it when EMS_SEND_ENGINE is
+    "asyncio".
+
+    Classes:
+        SMTPSettings: Server and pool options, read from the environment.
+        SMTPSessionPool: Pool of authenticated smtplib sessions per sender.
+        AsyncSMTPConnection: One SMTP conversation over asyncio streams.
+        AsyncDeliveryEngine: Event-loop threads delivering messages concurrently.
+
+    Functions:
+        send_email(...): Send one email through the pool.
+        build_message(...): Build the MIME message for one email.
+        get_smtp_pool(): The process-wide SMTPSessionPool.
+        get_delivery_engine(): The process-wide AsyncDeliveryEngine.
+
+    Environment variables:
+        EMS_SMTP_HOST (default smtp.gmail.com), EMS_SMTP_PORT (default 465),
+        EMS_SMTP_SECURITY ("ssl", "starttls" or "none"; default "ssl"),
+        EMS_SMTP_MAX_PER_SENDER, EMS_SMTP_MAX_IDLE, EMS_SMTP_PROBE_AFTER, EMS_SMTP_TIMEOUT,
+        EMS_SMTP_LOOPS (event-loop threads, default 1),
+        EMS_SMTP_MAX_IN_FLIGHT (messages in flight per loop, default 1000)
+"""
+
+#! SMTP replies meaning "this connection is unusable, open a new one"
+_RECONNECT_CODES = {421}
+
+
+@dataclass(frozen=True)
+class SMTPSettings:
+    host: str = "smtp.gmail.com"
+    port: int = 465
+    security: str = "ssl"
+    max_per_sender: int = 4     # idle sessions kept per sender account
+    max_idle: float = 240.0     # seconds before an idle session is closed
+    probe_after: float = 15.0   # seconds of idleness before NOOP-probing a session
+    timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "SMTPSettings":
+        """ Build settings from EMS_SMTP_* environment variables, falling back to defaults """
+        return cls(
+            host=os.getenv("EMS_SMTP_HOST", cls.host),
+            port=int(os.getenv("EMS_SMTP_PORT", cls.port)),
+            security=os.getenv("EMS_SMTP_SECURITY", cls.security).lower(),
+            max_per_sender=int(os.getenv("EMS_SMTP_MAX_PER_SENDER", cls.max_per_sender)),
+            max_idle=float(os.getenv("EMS_SMTP_MAX_IDLE", cls.max_idle)),
+            probe_after=float(os.getenv("EMS_SMTP_PROBE_AFTER", cls.probe_after)),
+            timeout=float(os.getenv("EMS_SMTP_TIMEOUT", cls.timeout)),
+        )
+
+
+def _session_key(settings: SMTPSettings, sender_email: str, sender_password: str) -> tuple:
+    #! the password digest is part of the key so changed credentials never reuse an old login
+    digest = hashlib.sha256(sender_password.encode()).hexdigest()
+    return (settings.host, settings.port, sender_email, digest)
+
+
+class _Session:
+    __slots__ = ("smtp", "last_used")
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+
+
+class SMTPSessionPool:
+    def __init__(self, settings: SMTPSettings | None = None):
+        """Pool of authenticated SMTP sessions keyed by sender account
+
+        :param settings: server and pool settings, defaults to ``SMTPSettings.from_env()``
+        :type settings: SMTPSettings | None
+        """
+        self.settings = settings or SMTPSettings.from_env()
+        self._idle: dict[tuple, deque[_Session]] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _key(self, sender_email: str, sender_password: str) -> tuple:
+        return _session_key(self.settings, sender_email, sender_password)
+
+    def _connect(self, sender_email: str, sender_password: str) -> _Session:
+        settings = self.settings
+        if settings.security == "ssl":
+            smtp = smtplib.SMTP_SSL(settings.host, settings.port, timeout=settings.timeout)
+        else:
+            smtp = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+            if settings.security == "starttls":
+                smtp.starttls()
+        try:
+            smtp.ehlo_or_helo_if_needed()
+            if settings.security != "none" or smtp.has_extn("auth"):
+                smtp.login(sender_email, sender_password)
+        except Exception:
+            _close_quietly(smtp)
+            raise
+        logger.debug(f"Opened SMTP session for {sender_email}")
+        return _Session(smtp)
+
+    def _healthy(self, session: _Session) -> bool:
+        idle = time.monotonic() - session.last_used
+        if idle >= self.settings.max_idle:
+            return False
+        if idle < self.settings.probe_after:
+            return True
+        try:
+            return session.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def checkout(self, sender_email: str, sender_password: str) -> tuple[tuple, _Session]:
+        """ Take a healthy idle session for the sender, or log in a new one """
+        key = self._key(sender_email, sender_password)
+        if time.monotonic() - self._last_sweep >= self.settings.probe_after:
+            self._last_sweep = time.monotonic()
+            self.evict_idle()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                session = idle.pop() if idle else None
+            if session is None:
+                return key, self._connect(sender_email, sender_password)
+            if self._healthy(session):
+                return key, session
+            _close_quietly(session.smtp)
+
+    def checkin(self, key: tuple, session: _Session):
+        """ Return a session to the pool; sessions beyond max_per_sender are closed """
+        session.last_used = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self.settings.max_per_sender:
+                idle.append(session)
+                return
+        _close_quietly(session.smtp)
+
+    def discard(self, session: _Session):
+        _close_quietly(session.smtp)
+
+    def send(self, sender_email: str, sender_password: str, message: EmailMessage) -> dict:
+        """ Send ``message`` on a pooled session, retrying once on a fresh one after 421 / disconnect.
+
+        :return: refused recipients as returned by ``smtplib.SMTP.send_message``
+        :rtype: dict
+        """
+        with self.hold(sender_email, sender_password) as session:
+            return session.send(message)
+
+    @contextmanager
+    def hold(self, sender_email: str, sender_password: str):
+        """ Keep one session of the sender for a series of sends, e.g. a coalesced batch.
+
+        The session is checked out on the first send and returned to the pool on exit;
+        a session that broke in between is replaced transparently.
+
+        :return: context manager yielding an object with ``send(message) -> dict``
+        """
+        held = _HeldSession(self, sender_email, sender_password)
+        try:
+            yield held
+        finally:
+            held.release()
+
+    def _reset(self, session: _Session) -> bool:
+        """ RSET after a rejected message; False (and the session closed) if that fails too """
+        try:
+            session.smtp.rset()
+        except (smtplib.SMTPException, OSError):
+            self.discard(session)
+            return False
+        return True
+
+    def evict_idle(self):
+        """ Close every pooled session idle for longer than max_idle """
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for idle in self._idle.values():
+                keep = deque(s for s in idle if now - s.last_used < self.settings.max_idle)
+                stale.extend(s for s in idle if now - s.last_used >= self.settings.max_idle)
+                idle.clear()
+                idle.extend(keep)
+        for session in stale:
+            _close_quietly(session.smtp)
+
+    def close(self):
+        """ Close every pooled session """
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+        for session in sessions:
+            _close_quietly(session.smtp)
+
+
+class _HeldSession:
+    def __init__(self, pool: SMTPSessionPool, sender_email: str, sender_password: str):
+        self.pool = pool
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self._key: tuple | None = None
+        self._session: _Session | None = None
+
+    def _drop(self):
+        self.pool.discard(self._session)
+        self._session = None
+
+    def send(self, message: EmailMessage) -> dict:
+        """ Send on the held session, retrying once on a fresh one after 421 / disconnect """
+        for attempt in (1, 2):
+            if self._session is None:
+                self._key, self._session = self.pool.checkout(self.sender_email, self.sender_password)
+            try:
+                return self._session.smtp.send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                self._drop()
+                if attempt == 2:
+                    raise
+                logger.warning(f"SMTP session of {self.sender_email} dropped, reconnecting")
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code in _RECONNECT_CODES:
+                    self._drop()
+                    if attempt == 2:
+                        raise
+                    logger.warning(f"SMTP server closing session of {self.sender_email} ({e.smtp_code}), reconnecting")
+                    continue
+                #! a per-message rejection leaves the session usable
+                if not self.pool._reset(self._session):
+                    self._session = None
+                raise
+            except smtplib.SMTPRecipientsRefused:
+                if not self.pool._reset(self._session):
+                    self._session = None
+                raise
+            except Exception:
+                self._drop()
+                raise
+        return {}
+
+    def release(self):
+        if self._session is not None:
+            self.pool.checkin(self._key, self._session)
+            self._session = None
+
+
+def _close_quietly(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        try:
+            smtp.close()
+        except OSError:
+            pass
+
+
+_pool: SMTPSessionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPSessionPool:
+    """ Return the process-wide SMTP session pool """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SMTPSessionPool()
+    return _pool
+
+
+def _attachment_payload(attachment) -> tuple[bytes, str]:
+    """ Read a file path or an uploaded file object into (data, filename) """
+    if isinstance(attachment, (str, os.PathLike)):
+        with open(attachment, "rb") as f:
+            return f.read(), os.path.basename(attachment)
+    data = attachment.getvalue() if hasattr(attachment, "getvalue") else attachment.read()
+    return data, os.path.basename(getattr(attachment, "name", "attachment"))
+
+
+def build_message(sender_email: str, to, subject: str, contents: str, attachments=None) -> EmailMessage:
+    """ Build the MIME message for one email.
+
+    :param sender_email: The email address of the sender.
+    :type sender_email: str
+    :param to: One recipient address or a list of them.
+    :type to: str | list[str]
+    :param subject: The subject of the email.
+    :type subject: str
+    :param contents: The content of the email (can be text or HTML).
+    :type contents: str
+    :param attachments: File paths or file-like objects (e.g. Streamlit uploads), defaults to None.
+    :return: the message, ready for ``send_message``
+    :rtype: EmailMessage
+    """
+    recipients = [to] if isinstance(to, str) else list(to)
+    message = EmailMessage()
+    message["From"] = sender_email
+    message["To"] = ", ".join(recipients)
+    message["Subject"] = subject
+    message["Date"] = formatdate(localtime=True)
+    message["Message-ID"] = make_msgid()
+
+    contents = contents or ""
+    message.set_content(contents)
+    if "<" in contents and "</" in contents:
+        message.add_alternative(contents, subtype="html")
+
+    if attachments is not None and not isinstance(attachments, (list, tuple)):
+        attachments = [attachments]
+    for attachment in attachments or []:
+        data, filename = _attachment_payload(attachment)
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        maintype, subtype = mime_type.split("/", 1)
+        message.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    return message
+
 
 def send_email(
             sender_email:str ,
@@ -10,7 +360,7 @@ def send_email(
             contents: str ,
             attachments: list[str] | None = None,
             ) -> bool :
-    """ Send an email using yagmail.
+    """ Send an email through the pooled SMTP sessions of the sender.
 
     :param sender_email: The email address of the sender.
     :type sender_email: str
@@ -30,13 +380,8 @@ def send_email(
     """
     try:
         _validate_credentials(sender_email=sender_email,sender_password=sender_password)
-        with yagmail.SMTP(user = sender_email, password= sender_password) as yag:
-            yag.send(
-                to=to,
-                contents=contents,
-                subject=subject,
-                attachments=attachments,
-            )
+        message = build_message(sender_email, to, subject, contents, attachments)
+        get_smtp_pool().send(sender_email, sender_password, message)
         logger.success("Email Sent Successfully")
         return True
 
@@ -49,3 +394,344 @@ def send_email(
 def _validate_credentials(sender_email, sender_password):
     if not sender_email or not sender_password:
             raise ValueError("Sender Email or Password is Missing, Try again")
+
+
+# ================== asyncio delivery engine ==================
+
+_local_hostname: str | None = None
+
+
+def _hostname() -> str:
+    global _local_hostname
+    if _local_hostname is None:
+        _local_hostname = socket.getfqdn()
+    return _local_hostname
+
+
+class AsyncSMTPConnection:
+    def __init__(self, settings: SMTPSettings):
+        """One SMTP conversation over asyncio streams
+
+        :param settings: server settings, shared with the blocking pool
+        :type settings: SMTPSettings
+        """
+        self.settings = settings
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.extensions: dict[str, str] = {}
+        self.last_used = time.monotonic()
+
+    async def connect(self, sender_email: str, sender_password: str):
+        """ Open the connection, greet, upgrade to TLS if configured and log in """
+        settings = self.settings
+        context = ssl.create_default_context() if settings.security in ("ssl", "starttls") else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(settings.host, settings.port, ssl=context if settings.security == "ssl" else None),
+            settings.timeout,
+        )
+        try:
+            code, text = await self._reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, text)
+            await self.ehlo()
+            if settings.security == "starttls":
+                await self._expect("STARTTLS", 220)
+                await asyncio.wait_for(self.writer.start_tls(context, server_hostname=settings.host), settings.timeout)
+                await self.ehlo()
+            if settings.security != "none" or "auth" in self.extensions:
+                await self.login(sender_email, sender_password)
+        except BaseException:
+            self.abort()
+            raise
+        logger.debug(f"Opened async SMTP session for {sender_email}")
+
+    async def _reply(self) -> tuple[int, bytes]:
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.settings.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b"-":
+                try:
+                    return int(line[:3]), b"\n".join(lines)
+                except ValueError:
+                    raise smtplib.SMTPResponseException(-1, line) from None
+
+    async def _command(self, command: str) -> tuple[int, bytes]:
+        self.writer.write(command.encode() + b"\r\n")
+        await self.writer.drain()
+        return await self._reply()
+
+    async def _expect(self, command: str, *codes: int) -> tuple[int, bytes]:
+        code, text = await self._command(command)
+        if code not in codes:
+            raise smtplib.SMTPResponseException(code, text)
+        return code, text
+
+    async def ehlo(self):
+        code, text = await self._command(f"EHLO {_hostname()}")
+        if code != 250:
+            await self._expect(f"HELO {_hostname()}", 250)
+            self.extensions = {}
+            return
+        #! the first line is the greeting, the rest are "KEYWORD [params]"
+        self.extensions = {}
+        for line in text.decode("latin-1").split("\n")[1:]:
+            keyword, _, params = line.partition(" ")
+            self.extensions[keyword.lower()] = params
+
+    async def login(self, sender_email: str, sender_password: str):
+        mechanisms = self.extensions.get("auth", "").upper().split()
+        if "PLAIN" in mechanisms or not mechanisms:
+            token = base64.b64encode(f"\0{sender_email}\0{sender_password}".encode()).decode()
+            code, text = await self._command(f"AUTH PLAIN {token}")
+        else:
+            await self._expect("AUTH LOGIN", 334)
+            await self._expect(base64.b64encode(sender_email.encode()).decode(), 334)
+            code, text = await self._command(base64.b64encode(sender_password.encode()).decode())
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, text)
+
+    async def send_message(self, message: EmailMessage) -> dict:
+        """ Send ``message``, pipelining the envelope when the server allows it.
+
+        :return: refused recipients, like ``smtplib.SMTP.send_message``
+        :rtype: dict
+        """
+        sender = getaddresses([message["Sender"] or message["From"]])[0][1]
+        recipients = [address for _, address in getaddresses(
+            message.get_all("To", []) + message.get_all("Cc", []) + message.get_all("Bcc", [])) if address]
+        if not recipients:
+            raise smtplib.SMTPRecipientsRefused({})
+        if "Bcc" in message:
+            message = copy.copy(message)
+            del message["Bcc"]
+        data = re.sub(rb"(?m)^\.", b"..", message.as_bytes(policy=email.policy.SMTP))
+        if not data.endswith(b"\r\n"):
+            data += b"\r\n"
+
+        body_option = " BODY=8BITMIME" if "8bitmime" in self.extensions else ""
+        envelope = [f"MAIL FROM:<{sender}>{body_option}"] + [f"RCPT TO:<{r}>" for r in recipients]
+        data_reply = None
+        if "pipelining" in self.extensions:
+            self.writer.write("".join(f"{command}\r\n" for command in envelope + ["DATA"]).encode())
+            await self.writer.drain()
+            mail_reply, *rcpt_replies, data_reply = [await self._reply() for _ in range(len(envelope) + 1)]
+        else:
+            mail_reply = await self._command(envelope[0])
+            rcpt_replies = [await self._command(c) for c in envelope[1:]] if mail_reply[0] == 250 else []
+
+        if mail_reply[0] != 250:
+            await self._abandon(data_reply)
+            raise smtplib.SMTPSenderRefused(*mail_reply, sender)
+        refused = {r: reply for r, reply in zip(recipients, rcpt_replies) if reply[0] not in (250, 251)}
+        if len(refused) == len(recipients):
+            await self._abandon(data_reply)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_reply is None:
+            data_reply = await self._command("DATA")
+        if data_reply[0] != 354:
+            await self.rset()
+            raise smtplib.SMTPDataError(*data_reply)
+
+        self.writer.write(data + b".\r\n")
+        await self.writer.drain()
+        code, text = await self._reply()
+        self.last_used = time.monotonic()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+        return refused
+
+    async def _abandon(self, data_reply: tuple[int, bytes] | None):
+        #! a pipelined DATA may have been accepted although the envelope failed; close it empty
+        if data_reply is not None and data_reply[0] == 354:
+            self.writer.write(b".\r\n")
+            await self.writer.drain()
+            await self._reply()
+        await self.rset()
+
+    async def rset(self):
+        await self._command("RSET")
+
+    async def noop(self) -> bool:
+        try:
+            return (await self._command("NOOP"))[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    async def quit(self):
+        try:
+            await self._command("QUIT")
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.abort()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.transport.abort()
+            self.writer = None
+
+
+class _SenderConnections:
+    __slots__ = ("idle", "slots")
+
+    def __init__(self, limit: int):
+        self.idle: list[AsyncSMTPConnection] = []
+        self.slots = asyncio.Semaphore(limit)
+
+
+class _LoopThread:
+    def __init__(self, name: str, max_in_flight: int):
+        self.loop = asyncio.new_event_loop()
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        #! only touched from this loop, so no lock is needed
+        self.senders: dict[tuple, _SenderConnections] = {}
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+class AsyncDeliveryEngine:
+    def __init__(self, settings: SMTPSettings | None = None, loops: int | None = None,
+                 max_in_flight: int | None = None):
+        """Concurrent SMTP delivery on a few asyncio event-loop threads
+
+        :param settings: server settings, defaults to ``SMTPSettings.from_env()``;
+            ``max_per_sender`` bounds the concurrent conversations of one sender account
+        :type settings: SMTPSettings | None
+        :param loops: event-loop threads, defaults to EMS_SMTP_LOOPS or 1
+        :type loops: int | None
+        :param max_in_flight: messages in flight per loop, defaults to EMS_SMTP_MAX_IN_FLIGHT or 1000
+        :type max_in_flight: int | None
+        """
+        self.settings = settings or SMTPSettings.from_env()
+        self.loops = loops or int(os.getenv("EMS_SMTP_LOOPS", 1))
+        self.max_in_flight = max_in_flight or int(os.getenv("EMS_SMTP_MAX_IN_FLIGHT", 1000))
+        self._workers: list[_LoopThread] = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Start the event-loop threads; called implicitly by ``submit`` """
+        with self._lock:
+            if not self._workers:
+                self._workers = [_LoopThread(f"ems-smtp-{i}", self.max_in_flight) for i in range(self.loops)]
+
+    def _worker(self, sender_email: str) -> _LoopThread:
+        #! a sender always lands on the same loop so its connections are never shared across loops
+        return self._workers[zlib.crc32(sender_email.encode()) % len(self._workers)]
+
+    def submit(self, sender_email: str, sender_password: str, message: EmailMessage,
+               delay: float = 0.0) -> concurrent.futures.Future:
+        """ Queue ``message`` for delivery; thread-safe.
+
+        :param delay: seconds to wait before the delivery starts, e.g. a rate-limit reservation
+        :type delay: float
+        :return: future resolving to the refused recipients, or raising the smtplib error
+        :rtype: concurrent.futures.Future
+        """
+        self.start()
+        worker = self._worker(sender_email)
+        return asyncio.run_coroutine_threadsafe(
+            self._deliver(worker, sender_email, sender_password, message, delay), worker.loop)
+
+    def send_many(self, sender_email: str, sender_password: str, messages: list[EmailMessage]) -> list:
+        """ Deliver ``messages`` concurrently and wait for all of them.
+
+        :return: per message, the refused recipients dict or the exception raised
+        :rtype: list[dict | Exception]
+        """
+        futures = [self.submit(sender_email, sender_password, message) for message in messages]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def _deliver(self, worker: _LoopThread, sender_email: str, sender_password: str, message: EmailMessage,
+                       delay: float = 0.0) -> dict:
+        key = _session_key(self.settings, sender_email, sender_password)
+        if delay > 0:
+            #! a waiting message holds no in-flight slot
+            await asyncio.sleep(delay)
+        async with worker.in_flight:
+            connections = worker.senders.get(key)
+            if connections is None:
+                connections = worker.senders[key] = _SenderConnections(self.settings.max_per_sender)
+            async with connections.slots:
+                for attempt in (1, 2):
+                    connection = await self._checkout(connections, sender_email, sender_password)
+                    try:
+                        refused = await connection.send_message(message)
+                    except smtplib.SMTPResponseException as e:
+                        if e.smtp_code in _RECONNECT_CODES:
+                            connection.abort()
+                            if attempt == 2:
+                                raise
+                            continue
+                        #! per-message rejection: the conversation was reset and stays usable
+                        connections.idle.append(connection)
+                        raise
+                    except smtplib.SMTPRecipientsRefused:
+                        connections.idle.append(connection)
+                        raise
+                    except OSError as e:
+                        #! smtplib errors are OSErrors too; only disconnects and socket errors get here
+                        connection.abort()
+                        if attempt == 2:
+                            raise
+                        logger.warning(f"Async SMTP session of {sender_email} dropped ({e!s}), reconnecting")
+                        continue
+                    except BaseException:
+                        connection.abort()
+                        raise
+                    connections.idle.append(connection)
+                    return refused
+        return {}
+
+    async def _checkout(self, connections: _SenderConnections, sender_email: str, sender_password: str) -> AsyncSMTPConnection:
+        while connections.idle:
+            connection = connections.idle.pop()
+            idle = time.monotonic() - connection.last_used
+            if idle < self.settings.probe_after:
+                return connection
+            if idle < self.settings.max_idle and await connection.noop():
+                return connection
+            await connection.quit()
+        connection = AsyncSMTPConnection(self.settings)
+        await connection.connect(sender_email, sender_password)
+        return connection
+
+    async def _close_all(self, worker: _LoopThread):
+        for connections in worker.senders.values():
+            while connections.idle:
+                await connections.idle.pop().quit()
+        worker.senders.clear()
+
+    def close(self):
+        """ Quit every connection and stop the event-loop threads """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            asyncio.run_coroutine_threadsafe(self._close_all(worker), worker.loop).result(self.settings.timeout)
+            worker.loop.call_soon_threadsafe(worker.loop.stop)
+            worker.thread.join()
+
+
+_engine: AsyncDeliveryEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_delivery_engine() -> AsyncDeliveryEngine:
+    """ Return the process-wide asyncio delivery engine """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AsyncDeliveryEngine()
+    return _engine
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+""" Signed session tokens for EMS pages.
+
+    At login Home.py issues an HMAC-SHA256 signed token carrying the user id, email, issue
+    time and expiry, and keeps it in ``st.session_state``. Pages verify the token in memory
+    on every rerun and only go back to the database when it has expired, or when
+    ``update_user`` / ``delete_user`` revoked every token issued to that user before.
+
+    Revocations are kept in process memory, which matches the lifetime of Streamlit
+    sessions: a restart drops both the sessions and the revocation list.
+
+    Functions:
+        issue_token(user_id, email, ttl): Create a signed token.
+        verify_token(token, user_id, email): Check signature, expiry, owner and revocation.
+        revoke_user(user_id): Invalidate every token issued to ``user_id`` so far.
+        check_session(state, user_id, email, db): Verify the token in ``state``, falling back
+            to the database and re-issuing on success.
+
+    Environment variables:
+        EMS_SESSION_SECRET: HMAC key; a random per-process key is used when unset.
+        EMS_SESSION_TTL: token lifetime in seconds (default 900).
+"""
+
+SESSION_KEY = "session_token"
+
+_secret = os.getenv("EMS_SESSION_SECRET", "").encode() or os.urandom(32)
+_default_ttl = float(os.getenv("EMS_SESSION_TTL", 900))
+_revoked: dict[int, float] = {}
+_revoked_lock = threading.Lock()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_secret, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, email: str, ttl: float | None = None) -> str:
+    """ Create a signed session token for ``user_id`` / ``email``.
+
+    :param user_id: logged in user
+    :type user_id: int
+    :param email: logged in user's email
+    :type email: str
+    :param ttl: lifetime in seconds, defaults to EMS_SESSION_TTL
+    :type ttl: float | None
+    :return: ``<payload>.<signature>``, both base64url encoded
+    :rtype: str
+    """
+    now = time.time()
+    claims = {"uid": user_id, "email": email, "iat": now, "exp": now + (ttl or _default_ttl)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str, user_id: int, email: str) -> bool:
+    """ Return True if ``token`` is authentic, unexpired, unrevoked and belongs to ``user_id`` / ``email`` """
+    try:
+        payload, signature = token.split(".", 1)
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return False
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, AttributeError):
+        return False
+
+    if claims.get("uid") != user_id or claims.get("email") != email:
+        return False
+    if claims.get("exp", 0) <= time.time():
+        return False
+    with _revoked_lock:
+        revoked_at = _revoked.get(user_id)
+    return revoked_at is None or claims.get("iat", 0) > revoked_at
+
+
+def revoke_user(user_id: int):
+    """ Invalidate every token issued to ``user_id`` up to now """
+    with _revoked_lock:
+        _revoked[user_id] = time.time()
+    logger.info(f"Session tokens of user {user_id} revoked")
+
+
+def check_session(state, user_id: int, email: str, db=None) -> bool:
+    """ Authorize a page render for ``user_id`` / ``email``.
+
+    :param state: session storage holding the token, e.g. ``st.session_state``
+    :param user_id: user id stored at login
+    :type user_id: int
+    :param email: email stored at login
+    :type email: str
+    :param db: DataBaseManagement used on fallback, created lazily when needed
+    :return: True if the user is authorized, False otherwise
+    :rtype: bool
+    """
+    token = state.get(SESSION_KEY)
+    if token and verify_token(token, user_id, email):
+        return True
+
+    #! expired, revoked or missing token: ask the database once and re-issue
+    if db is None:
+        from utils.db import DataBaseManagement
+        db = DataBaseManagement()
+    if user_id is not None and db.get_user_profile(user_id, email, fields=("user_id",)):
+        state[SESSION_KEY] = issue_token(user_id, email)
+        return True
+
+    if SESSION_KEY in state:
+        del state[SESSION_KEY]
+    return False
@@ -0,0 +1,424 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+import faiss
+import numpy as np
+from loguru import logger
+
+""" Persistent FAISS index for the EMS email search.
+
+    ``PersistentIndex`` keeps vectors keyed by Email_id (``faiss.IndexIDMap``) in two tiers:
+
+    - a base index on disk, opened memory-mapped and never modified in place, so opening
+      it at startup costs milliseconds and its pages are shared by every process;
+    - a small in-memory delta receiving new vectors.
+
+    Searches query both tiers and merge the hits by distance. Once the delta grows past
+    ``compact_threshold`` it is merged with the base into a new file that atomically
+    replaces the old one, together with its checkpoint. The checkpoint records the
+    high-water mark (the largest Email_id indexed), so after a restart the caller feeds
+    the rows above it, plus the rows just below it that ``missing`` reports as not
+    indexed (ids that committed after a higher one). If the checkpoint and the index
+    disagree after a crash, the high-water mark is recomputed from the ids in the index.
+
+    The base index type is pluggable (``index_type``). ``flat`` searches exactly and scales
+    linearly with the history; ``hnsw`` (graph), ``ivf_flat`` (inverted lists) and
+    ``ivf_pq`` (inverted lists of product-quantized codes, about 16x smaller) search
+    approximately in sub-linear time. An approximate base is trained during the first
+    compaction after the index holds ``train_threshold`` vectors, from the exact vectors of
+    the flat base; until then the base stays flat. Later compactions add to the trained
+    base. The inverted lists and PQ codebooks of an IVF base only fit the data they were
+    trained on, so once the index has grown to ``retrain_factor`` times its training size
+    (recorded in the checkpoint) the next compaction trains it again from the vectors it
+    holds: exact for ``ivf_flat``, decoded codes for ``ivf_pq``, whose originals are not
+    kept. An index trained as another type is discarded on open and rebuilt by the
+    incremental sync, which reads the embeddings from the embedding cache.
+    ``python -m utils.index_benchmark`` compares the types on synthetic corpora.
+
+    ``PartitionedIndex`` gives every user a PersistentIndex of their own under
+    ``<directory>/users/<user_id>``, so a search only ever scans that user's vectors and can
+    never return another user's email. Partitions are opened on first use and kept in an
+    LRU; partitions idle for ``idle_seconds`` or beyond ``max_partitions`` are flushed and
+    closed. A partition is pinned while in use (``PartitionedIndex.use``) and never
+    evicted under a running sync or search; it stays in the LRU while it is flushed, and
+    is only dropped if nobody used it in the meantime.
+
+    Classes:
+        VectorStoreSettings: Location, compaction, index type and partition limits, read from the environment.
+        PersistentIndex: Memory-mapped base index plus in-memory delta, keyed by id.
+        PartitionedIndex: Lazily opened, evictable PersistentIndex per user.
+
+    Functions:
+        build_index(vectors, ids, index_type, settings): Trained, filled index of a type.
+        tune_index(index, index_type, settings): Apply the search-time parameters of a type.
+
+    Environment variables:
+        EMS_VECTOR_DIR (default "data/vectors"), EMS_VECTOR_COMPACT_THRESHOLD (default 1000),
+        EMS_VECTOR_MAX_PARTITIONS (open partitions, default 64),
+        EMS_VECTOR_IDLE_SECONDS (default 900),
+        EMS_VECTOR_INDEX (flat, hnsw, ivf_flat or ivf_pq, default flat),
+        EMS_VECTOR_TRAIN_THRESHOLD (vectors before an approximate index is trained, default 10000),
+        EMS_VECTOR_RETRAIN_FACTOR (growth over the training size that retrains an IVF index,
+        default 4, 0 never retrains),
+        EMS_VECTOR_HNSW_M (graph degree, default 32), EMS_VECTOR_EF_SEARCH (default 64),
+        EMS_VECTOR_NLIST (inverted lists, default 0 = sized from the data), EMS_VECTOR_NPROBE (default 16),
+        EMS_VECTOR_PQ_M (PQ sub-quantizers, must divide the dimension, default 16)
+"""
+
+INDEX_FILE = "emails.faiss"
+CHECKPOINT_FILE = "emails.checkpoint.json"
+#! zero-copy mmap of flat codes needs faiss >= 1.11; older versions only mmap IVF lists and read flat codes
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+#! types whose trained parameters (inverted lists, codebooks) depend on the data
+_IVF_TYPES = ("ivf_flat", "ivf_pq")
+
+
+@dataclass(frozen=True)
+class VectorStoreSettings:
+    directory: str = "data/vectors"
+    compact_threshold: int = 1000
+    max_partitions: int = 64
+    idle_seconds: float = 900.0
+    index_type: str = "flat"
+    train_threshold: int = 10000
+    retrain_factor: float = 4.0     # retrain an IVF base once it holds this many times its training size
+    hnsw_m: int = 32
+    ef_search: int = 64
+    nlist: int = 0              # 0 sizes the inverted lists from the data at training time
+    nprobe: int = 16
+    pq_m: int = 16
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"unknown vector index type {self.index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+
+    @classmethod
+    def from_env(cls) -> "VectorStoreSettings":
+        """ Build settings from EMS_VECTOR_* environment variables, falling back to defaults """
+        return cls(
+            directory=os.getenv("EMS_VECTOR_DIR", cls.directory),
+            compact_threshold=int(os.getenv("EMS_VECTOR_COMPACT_THRESHOLD", cls.compact_threshold)),
+            max_partitions=int(os.getenv("EMS_VECTOR_MAX_PARTITIONS", cls.max_partitions)),
+            idle_seconds=float(os.getenv("EMS_VECTOR_IDLE_SECONDS", cls.idle_seconds)),
+            index_type=os.getenv("EMS_VECTOR_INDEX", cls.index_type).lower(),
+            train_threshold=int(os.getenv("EMS_VECTOR_TRAIN_THRESHOLD", cls.train_threshold)),
+            retrain_factor=float(os.getenv("EMS_VECTOR_RETRAIN_FACTOR", cls.retrain_factor)),
+            hnsw_m=int(os.getenv("EMS_VECTOR_HNSW_M", cls.hnsw_m)),
+            ef_search=int(os.getenv("EMS_VECTOR_EF_SEARCH", cls.ef_search)),
+            nlist=int(os.getenv("EMS_VECTOR_NLIST", cls.nlist)),
+            nprobe=int(os.getenv("EMS_VECTOR_NPROBE", cls.nprobe)),
+            pq_m=int(os.getenv("EMS_VECTOR_PQ_M", cls.pq_m)),
+        )
+
+
+def _new_index(dimension: int) -> faiss.IndexIDMap:
+    return faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
+
+
+def _ids(index: faiss.IndexIDMap) -> np.ndarray:
+    return faiss.vector_to_array(index.id_map)
+
+
+def _vectors(index: faiss.IndexIDMap) -> np.ndarray:
+    """ Vectors of ``index`` in the order of ``_ids``; IVF lists are scanned, so no direct map is needed """
+    return faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+
+
+def build_index(vectors: np.ndarray, ids: np.ndarray, index_type: str,
+                settings: VectorStoreSettings) -> faiss.IndexIDMap:
+    """ A new index of ``index_type`` holding ``vectors`` under ``ids``, trained on them if the type needs it.
+
+    :param vectors: float32 array of shape (n, dimension)
+    :type vectors: np.ndarray
+    :param ids: int64 ids, one per vector
+    :type ids: np.ndarray
+    :param index_type: one of INDEX_TYPES
+    :type index_type: str
+    :param settings: graph, list and quantizer parameters
+    :type settings: VectorStoreSettings
+    :return: the filled index, tuned for search
+    :rtype: faiss.IndexIDMap
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+    if index_type == "flat":
+        inner = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        inner = faiss.IndexHNSWFlat(dimension, settings.hnsw_m)
+    else:
+        #! about sqrt(n) lists, with the ~39 training points per centroid k-means asks for
+        nlist = settings.nlist or max(1, min(4 * int(math.sqrt(len(vectors))), len(vectors) // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat":
+            inner = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            inner = faiss.IndexIVFPQ(quantizer, dimension, nlist, settings.pq_m, 8)
+        inner.train(vectors)
+    index = faiss.IndexIDMap(inner)
+    index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    tune_index(index, index_type, settings)
+    return index
+
+
+def tune_index(index: faiss.Index, index_type: str, settings: VectorStoreSettings):
+    """ Set the search-time parameters of ``index_type``, which are not stored in the index file """
+    if index_type == "hnsw":
+        faiss.ParameterSpace().set_index_parameter(index, "efSearch", settings.ef_search)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        faiss.ParameterSpace().set_index_parameter(index, "nprobe", settings.nprobe)
+
+
+class PersistentIndex:
+    def __init__(self, dimension: int, model: str, settings: VectorStoreSettings | None = None):
+        """Id-keyed vector index persisted to disk
+
+        :param dimension: vector dimension
+        :type dimension: int
+        :param model: name of the embedding model; an index built by another model is discarded
+        :type model: str
+        :param settings: location and compaction settings, defaults to ``VectorStoreSettings.from_env()``
+        :type settings: VectorStoreSettings | None
+        """
+        self.dimension = dimension
+        self.model = model
+        self.settings = settings or VectorStoreSettings.from_env()
+        self.high_water = 0
+        self._base: faiss.IndexIDMap | None = None
+        #! sorted ids of the base, read from the mapped file on first use
+        self._base_ids: np.ndarray | None = None
+        #! type the base was built as; flat until it is trained
+        self.base_type = "flat"
+        #! vectors the base was last trained on, 0 for a flat base
+        self.trained_size = 0
+        self._delta = _new_index(dimension)
+        self._lock = threading.RLock()
+        self._open()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.settings.directory, INDEX_FILE)
+
+    @property
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.settings.directory, CHECKPOINT_FILE)
+
+    @property
+    def ntotal(self) -> int:
+        return self._delta.ntotal + (self._base.ntotal if self._base is not None else 0)
+
+    def _open(self):
+        """ Map the base index and read its checkpoint; start empty if there is none or it does not fit """
+        if not os.path.exists(self._index_path):
+            return
+        try:
+            with open(self._checkpoint_path) as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            checkpoint = {}
+        if checkpoint.get("model", self.model) != self.model or checkpoint.get("dimension", self.dimension) != self.dimension:
+            logger.warning(f"Vector index at {self._index_path} was built by another model, rebuilding")
+            return
+        base_type = checkpoint.get("index_type", "flat")
+        if base_type not in ("flat", self.settings.index_type):
+            logger.warning(f"Vector index at {self._index_path} is a {base_type} index, rebuilding as {self.settings.index_type}")
+            return
+        try:
+            base = faiss.read_index(self._index_path, _MMAP_FLAGS)
+        except RuntimeError as e:
+            logger.error(f"Could not open vector index {self._index_path}, rebuilding: {e}")
+            return
+        high_water = checkpoint.get("high_water", 0)
+        if checkpoint.get("count") != base.ntotal:
+            #! the checkpoint is written after the index; trust the ids actually in it
+            high_water = int(_ids(base).max()) if base.ntotal else 0
+        tune_index(base, base_type, self.settings)
+        self._base, self.base_type, self.high_water = base, base_type, high_water
+        #! checkpoints written before retraining have no training size; take the base as trained on everything
+        self.trained_size = checkpoint.get("trained_size", base.ntotal if base_type != "flat" else 0)
+        self._base_ids = None
+        logger.info(f"Opened {base_type} vector index with {base.ntotal} vectors up to id {high_water}")
+
+    def add(self, ids: list[int], vectors: np.ndarray):
+        """ Add vectors under ``ids``, which must not be indexed yet; compacts when the delta is full """
+        if not ids:
+            return
+        with self._lock:
+            self._delta.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+            self.high_water = max(self.high_water, max(ids))
+            if self._delta.ntotal >= self.settings.compact_threshold:
+                self.compact()
+
+    def missing(self, ids: list[int]) -> list[int]:
+        """ The ids in ``ids`` that are in neither base nor delta, in the order given """
+        if not ids:
+            return []
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            if self._base_ids is None:
+                self._base_ids = np.sort(_ids(self._base)) if self._base is not None else np.empty(0, dtype=np.int64)
+            #! only the tail of the base at or above the smallest asked id can match
+            base = self._base_ids[np.searchsorted(self._base_ids, ids.min()):]
+            known = np.concatenate([base, _ids(self._delta)])
+        return ids[~np.isin(ids, known)].tolist()
+
+    def search(self, vector: np.ndarray, k: int) -> list[tuple[int, float]]:
+        """ The ``k`` nearest ids to ``vector`` over base and delta.
+
+        :return: (id, squared L2 distance) pairs, nearest first
+        :rtype: list[tuple[int, float]]
+        """
+        query = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, -1)
+        hits: list[tuple[int, float]] = []
+        with self._lock:
+            for index in (self._base, self._delta):
+                if index is None or index.ntotal == 0:
+                    continue
+                distances, ids = index.search(query, min(k, index.ntotal))
+                hits += [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i != -1]
+        hits.sort(key=lambda hit: hit[1])
+        return hits[:k]
+
+    def _needs_training(self) -> bool:
+        if self.settings.index_type == "flat":
+            return False
+        if self.base_type == "flat":
+            return self.ntotal >= self.settings.train_threshold
+        return (self.base_type in _IVF_TYPES and self.settings.retrain_factor > 0
+                and self.ntotal >= self.settings.retrain_factor * self.trained_size)
+
+    def compact(self):
+        """ Merge the delta into a new base file, replace the old one atomically and map it again.
+        The first compaction past ``train_threshold`` trains the configured index type, and
+        an IVF base is trained again once it has grown ``retrain_factor`` times over.
+        """
+        with self._lock:
+            trained_size = self.trained_size
+            if self._base is not None and not self._needs_training():
+                #! a private copy of the base; the mapped file itself is read-only
+                merged, index_type = faiss.read_index(self._index_path), self.base_type
+                if self._delta.ntotal:
+                    merged.add_with_ids(_vectors(self._delta), _ids(self._delta))
+            else:
+                parts = [index for index in (self._base, self._delta) if index is not None and index.ntotal]
+                vectors = np.concatenate([_vectors(index) for index in parts]
+                                         or [np.empty((0, self.dimension), dtype=np.float32)])
+                ids = np.concatenate([_ids(index) for index in parts] or [np.empty(0, dtype=np.int64)])
+                index_type = self.settings.index_type if len(ids) >= self.settings.train_threshold else "flat"
+                merged = build_index(vectors, ids, index_type, self.settings)
+                trained_size = len(ids) if index_type != "flat" else 0
+            os.makedirs(self.settings.directory, exist_ok=True)
+            faiss.write_index(merged, self._index_path + ".tmp")
+            with open(self._checkpoint_path + ".tmp", "w") as file:
+                json.dump({"model": self.model, "dimension": self.dimension, "index_type": index_type,
+                           "high_water": self.high_water, "count": merged.ntotal, "trained_size": trained_size}, file)
+            os.replace(self._index_path + ".tmp", self._index_path)
+            os.replace(self._checkpoint_path + ".tmp", self._checkpoint_path)
+            self._base = faiss.read_index(self._index_path, _MMAP_FLAGS)
+            self._base_ids = None
+            tune_index(self._base, index_type, self.settings)
+            if trained_size != self.trained_size:
+                logger.info(f"Trained {index_type} vector index on {trained_size} vectors")
+            self.base_type, self.trained_size = index_type, trained_size
+            self._delta = _new_index(self.dimension)
+            logger.info(f"Compacted vector index: {merged.ntotal} vectors up to id {self.high_water}")
+
+    def flush(self):
+        """ Persist the delta now, e.g. after the initial bulk load, and train the base if it is due """
+        with self._lock:
+            if self._delta.ntotal or self._needs_training():
+                self.compact()
+
+
+class _Partition:
+    __slots__ = ("index", "pins", "last_used")
+
+    def __init__(self, index: PersistentIndex):
+        self.index = index
+        self.pins = 0
+        self.last_used = time.monotonic()
+
+
+class PartitionedIndex:
+    def __init__(self, dimension: int, model: str, settings: VectorStoreSettings | None = None):
+        """One PersistentIndex per user, opened lazily and evicted when idle
+
+        :param dimension: vector dimension
+        :type dimension: int
+        :param model: name of the embedding model
+        :type model: str
+        :param settings: location and limits, defaults to ``VectorStoreSettings.from_env()``
+        :type settings: VectorStoreSettings | None
+        """
+        self.dimension = dimension
+        self.model = model
+        self.settings = settings or VectorStoreSettings.from_env()
+        self._partitions: OrderedDict[int, _Partition] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._partitions)
+
+    @contextmanager
+    def use(self, user_id: int):
+        """ Pin and yield the PersistentIndex of ``user_id``, opening it if needed """
+        with self._lock:
+            partition = self._partitions.get(user_id)
+            if partition is None:
+                directory = os.path.join(self.settings.directory, "users", str(int(user_id)))
+                partition = _Partition(PersistentIndex(self.dimension, self.model,
+                                                       replace(self.settings, directory=directory)))
+                self._partitions[user_id] = partition
+            self._partitions.move_to_end(user_id)
+            partition.pins += 1
+        try:
+            yield partition.index
+        finally:
+            with self._lock:
+                partition.pins -= 1
+                partition.last_used = time.monotonic()
+            self.evict()
+
+    def evict(self) -> int:
+        """ Flush and close unpinned partitions that are idle or beyond ``max_partitions``
+
+        :return: number of partitions closed
+        :rtype: int
+        """
+        now = time.monotonic()
+        with self._lock:
+            excess = len(self._partitions) - self.settings.max_partitions
+            closing = []
+            #! least recently used first
+            for user_id, partition in self._partitions.items():
+                if partition.pins:
+                    continue
+                if excess > 0 or now - partition.last_used >= self.settings.idle_seconds:
+                    closing.append((user_id, partition))
+                    excess -= 1
+        return self._close(closing)
+
+    def _close(self, closing: list[tuple[int, _Partition]]) -> int:
+        """ Flush each partition while it is still in the map, then drop it unless it was used meanwhile """
+        closed = 0
+        for user_id, partition in closing:
+            last_used = partition.last_used
+            #! a concurrent use() still finds this index, so it is never reopened from a stale file
+            partition.index.flush()
+            with self._lock:
+                if self._partitions.get(user_id) is partition and not partition.pins and partition.last_used == last_used:
+                    del self._partitions[user_id]
+                    closed += 1
+        return closed
+
+    def close(self):
+        """ Flush and close every partition that is not in use """
+        with self._lock:
+            partitions = list(self._partitions.items())
+        self._close(partitions)
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+from tests.smtp_sink import SMTPSink
+
+#! the app runs from src/ (streamlit run Home.py), so its modules import as utils.*
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def smtp_sink():
+    """ A running SMTPSink that refuses bad@example.com (550) and slow@example.com (451) """
+    with SMTPSink(refuse={"bad@example.com": 550, "slow@example.com": 451}) as sink:
+        yield sink
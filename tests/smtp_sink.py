@@ -0,0 +1,193 @@
+import asyncio
+import base64
+import threading
+from dataclasses import dataclass, field
+
+""" In-process SMTP server for the delivery tests.
+
+    ``SMTPSink`` runs an asyncio SMTP server on a daemon thread and keeps what it receives
+    instead of relaying it. It speaks enough ESMTP for smtplib and the asyncio engine of
+    utils.send_mail: EHLO (advertising PIPELINING and AUTH PLAIN LOGIN), AUTH, MAIL, RCPT,
+    DATA, RSET, NOOP and QUIT. Recipients listed in ``refuse`` get the given reply code.
+
+    Every read from a client socket is recorded as the command lines it held, so a test
+    can tell pipelined commands (one read) from lock-step ones.
+
+    Classes:
+        Delivery: One accepted message.
+        SMTPSink: The server.
+"""
+
+
+@dataclass
+class Delivery:
+    sender: str
+    recipients: list[str]
+    data: bytes = b""
+
+
+class _Conversation:
+    """ State of one client connection """
+
+    def __init__(self, sink: "SMTPSink"):
+        self.sink = sink
+        self.envelope: Delivery | None = None
+        self.data: list[bytes] | None = None
+        self.auth_prompts: list[bytes] = []
+        self.closed = False
+
+    def feed(self, line: bytes) -> bytes:
+        """ Take one line from the client and return the reply, empty inside DATA """
+        if self.data is not None:
+            if line != b".":
+                self.data.append(line[1:] if line.startswith(b"..") else line)
+                return b""
+            self.envelope.data, self.data = b"\r\n".join(self.data), None
+            self.sink._delivered(self.envelope)
+            self.envelope = None
+            return b"250 queued\r\n"
+        if self.auth_prompts:
+            prompt = self.auth_prompts.pop(0)
+            if prompt:
+                return b"334 " + base64.b64encode(prompt) + b"\r\n"
+            self.sink._logged_in()
+            return b"235 authenticated\r\n"
+        return self.command(line.decode())
+
+    def command(self, line: str) -> bytes:
+        verb, _, argument = line.strip().partition(" ")
+        verb = verb.upper()
+        if verb in ("EHLO", "HELO"):
+            self.envelope = None
+            extensions = (["PIPELINING"] if self.sink.pipelining else []) + ["8BITMIME", "AUTH PLAIN LOGIN"]
+            return ("250-sink\r\n" + "".join(f"250-{ext}\r\n" for ext in extensions[:-1])
+                    + f"250 {extensions[-1]}\r\n").encode()
+        if verb == "AUTH":
+            mechanism, _, initial = argument.partition(" ")
+            if mechanism.upper() == "PLAIN" and initial:
+                self.sink._logged_in()
+                return b"235 authenticated\r\n"
+            #! LOGIN asks for user and password, PLAIN without initial response for the credentials
+            self.auth_prompts = [b"Password:", b""] if mechanism.upper() == "LOGIN" else [b""]
+            return b"334 " + (base64.b64encode(b"Username:") if mechanism.upper() == "LOGIN" else b"") + b"\r\n"
+        if verb == "MAIL":
+            self.envelope = Delivery(_address(argument), [])
+            return b"250 sender ok\r\n"
+        if verb == "RCPT":
+            recipient = _address(argument)
+            code = self.sink.refuse.get(recipient)
+            if code is not None:
+                return f"{code} {recipient} refused\r\n".encode()
+            if self.envelope is None:
+                return b"503 need MAIL first\r\n"
+            self.envelope.recipients.append(recipient)
+            return b"250 recipient ok\r\n"
+        if verb == "DATA":
+            if self.envelope is None or not self.envelope.recipients:
+                return b"554 no valid recipients\r\n"
+            self.data = []
+            return b"354 go ahead\r\n"
+        if verb == "RSET":
+            self.envelope = None
+            return b"250 reset\r\n"
+        if verb == "NOOP":
+            return b"250 ok\r\n"
+        if verb == "QUIT":
+            self.closed = True
+            return b"221 bye\r\n"
+        return b"500 unknown command\r\n"
+
+
+def _address(argument: str) -> str:
+    """ Address of a MAIL FROM / RCPT TO argument """
+    return argument.split(":", 1)[1].split()[0].strip("<>")
+
+
+@dataclass
+class SMTPSink:
+    refuse: dict[str, int] = field(default_factory=dict)
+    pipelining: bool = True
+    host: str = "127.0.0.1"
+    port: int = 0
+    deliveries: list[Delivery] = field(default_factory=list)
+    reads: list[list[bytes]] = field(default_factory=list)
+    connections: int = 0
+    logins: int = 0
+
+    def __post_init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="smtp-sink", daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        server.close()
+        #! connections the clients left open are dropped before the loop goes away
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.run_until_complete(server.wait_closed())
+        self._loop.close()
+
+    def start(self) -> "SMTPSink":
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+    def __enter__(self) -> "SMTPSink":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def recipients(self) -> list[str]:
+        """ Recipients of every accepted message, in arrival order """
+        with self._lock:
+            return [recipient for delivery in self.deliveries for recipient in delivery.recipients]
+
+    def _delivered(self, delivery: Delivery):
+        with self._lock:
+            self.deliveries.append(delivery)
+
+    def _logged_in(self):
+        with self._lock:
+            self.logins += 1
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        with self._lock:
+            self.connections += 1
+        conversation = _Conversation(self)
+        writer.write(b"220 sink ESMTP\r\n")
+        buffer = b""
+        try:
+            while not conversation.closed:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\r\n")
+                commands, replies = [], []
+                for line in lines:
+                    if conversation.data is None and not conversation.auth_prompts:
+                        commands.append(line)
+                    replies.append(conversation.feed(line))
+                if commands:
+                    with self._lock:
+                        self.reads.append(commands)
+                writer.write(b"".join(replies))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,12 @@
+import re
+
+from utils.migrations import MIGRATIONS
+
+_DATA = re.compile(r"^\s*(UPDATE|INSERT|DELETE)\b", re.IGNORECASE)
+
+
+def test_data_statements_follow_the_ddl_of_their_step():
+    #! DDL commits implicitly; a data change before it would be committed without the version row
+    for migration in MIGRATIONS:
+        kinds = [bool(_DATA.match(statement)) for statement in migration.statements if isinstance(statement, str)]
+        assert kinds == sorted(kinds), f"migration {migration.version} runs DDL after a data statement"
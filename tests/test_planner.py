@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from utils.planner import assign_slots
+
+START = pytz.utc.localize(datetime(2026, 1, 5, 12, 0, 45))
+
+
+def test_first_minute_only_takes_what_is_left_of_it():
+    slots = assign_slots(60, START, 60, 10000)
+
+    #! 15 seconds of the first minute are left: 15 slots, one per second; the other 45 spread over the next minute
+    assert slots[:15] == [START + timedelta(seconds=i) for i in range(15)]
+    assert slots[15] == pytz.utc.localize(datetime(2026, 1, 5, 12, 1))
+    assert slots[-1] < pytz.utc.localize(datetime(2026, 1, 5, 12, 2))
+    assert len(set(slots)) == len(slots)
+
+
+def test_day_quota_moves_the_rest_to_the_next_utc_day():
+    load = {pytz.utc.localize(datetime(2026, 1, 5, 8, 0)): 9}
+
+    slots = assign_slots(3, START, 60, 10, load)
+
+    assert slots[0] == START
+    assert slots[1:] == [pytz.utc.localize(datetime(2026, 1, 6, 0, 0)),
+                         pytz.utc.localize(datetime(2026, 1, 6, 0, 0, 30))]
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+import pytest
+
+from utils.db import LOCAL_TZ
+from utils.recurrence import first_occurrence, next_occurrence
+
+
+def _local(*args) -> datetime:
+    return LOCAL_TZ.localize(datetime(*args))
+
+
+def test_first_occurrence_includes_the_start():
+    monday_nine = _local(2026, 10, 19, 9, 0)
+
+    assert first_occurrence("0 9 * * 1-5", monday_nine) == monday_nine
+    assert first_occurrence("0 9 * * 1-5", _local(2026, 10, 19, 9, 0, 30)) == _local(2026, 10, 20, 9, 0)
+    assert first_occurrence("daily", monday_nine) == monday_nine
+    #! the following occurrence is strictly after the one that fired
+    assert next_occurrence("0 9 * * 1-5", monday_nine, monday_nine) == _local(2026, 10, 20, 9, 0)
+
+
+def test_unsatisfiable_cron_raises_value_error():
+    with pytest.raises(ValueError):
+        first_occurrence("0 0 31 2 *", _local(2026, 10, 19, 9, 0))
@@ -0,0 +1,126 @@
+import time
+from datetime import datetime
+
+import pytest
+import pytz
+
+from utils.send_executor import OutgoingEmail, SendExecutor, SenderLimits
+from utils.send_mail import SMTPSessionPool, SMTPSettings
+
+SENDER = "sender@example.com"
+
+
+def _emails(*recipients: str) -> list[OutgoingEmail]:
+    return [OutgoingEmail(to, f"Subject for {to}", "Hello") for to in recipients]
+
+
+@pytest.fixture
+def executor_for(smtp_sink):
+    """ Build SendExecutors delivering to the sink and shut them down after the test """
+    executors = []
+
+    def build(limits: SenderLimits, sent_since=None) -> SendExecutor:
+        pool = SMTPSessionPool(SMTPSettings(host=smtp_sink.host, port=smtp_sink.port, security="none", timeout=5))
+        executor = SendExecutor(max_workers=4, limits=limits, smtp_pool=pool, sent_since=sent_since)
+        executors.append(executor)
+        return executor
+
+    yield build
+    for executor in executors:
+        executor.shutdown()
+        executor.smtp_pool.close()
+
+
+@pytest.fixture
+def fast_limits() -> SenderLimits:
+    return SenderLimits(concurrency=2, per_minute=60000, per_day=1000)
+
+
+def test_send_campaign_reports_every_recipient(smtp_sink, executor_for, fast_limits):
+    results = executor_for(fast_limits).send_campaign(
+        SENDER, "secret", _emails("a@example.com", "bad@example.com", "c@example.com"))
+
+    assert [r.recipient for r in results] == ["a@example.com", "bad@example.com", "c@example.com"]
+    assert [r.ok for r in results] == [True, False, True]
+    assert [r.code for r in results] == [None, 550, None]
+    assert not results[1].deferred
+    assert sorted(smtp_sink.recipients) == ["a@example.com", "c@example.com"]
+
+
+def test_send_batch_goes_on_after_a_refused_recipient(smtp_sink, executor_for, fast_limits):
+    results = executor_for(fast_limits).send_batch(
+        SENDER, "secret", _emails("a@example.com", "bad@example.com", "c@example.com", "d@example.com"))
+
+    assert [r.ok for r in results] == [True, False, True, True]
+    assert results[1].code == 550
+    assert smtp_sink.recipients == ["a@example.com", "c@example.com", "d@example.com"]
+    #! the whole batch goes over one held session
+    assert smtp_sink.connections == 1
+    assert smtp_sink.logins == 1
+
+
+def test_per_minute_bucket_spaces_sends(smtp_sink, executor_for):
+    #! 120 / minute is 2 per second with a burst of 2: the 3rd and 4th send wait 0.5 s each
+    executor = executor_for(SenderLimits(concurrency=1, per_minute=120, per_day=1000))
+
+    started = time.monotonic()
+    results = executor.send_batch(SENDER, "secret", _emails(*(f"r{i}@example.com" for i in range(4))))
+    elapsed = time.monotonic() - started
+
+    assert all(r.ok for r in results)
+    assert 0.9 <= elapsed < 3.0
+
+
+def test_daily_cap_defers_the_rest(smtp_sink, executor_for):
+    executor = executor_for(SenderLimits(concurrency=2, per_minute=60000, per_day=2))
+
+    results = executor.send_batch(SENDER, "secret", _emails("a@example.com", "b@example.com", "c@example.com"))
+
+    assert [r.ok for r in results] == [True, True, False]
+    assert results[2].deferred
+    assert results[2].code is None
+    assert results[2].error == "daily sending quota exhausted"
+    assert len(smtp_sink.deliveries) == 2
+    assert executor.quota_wait(SENDER) > 0
+
+    #! the cap is per sender, shared by campaigns and batches
+    later = executor.send_campaign(SENDER, "secret", _emails("d@example.com"))
+    assert later[0].deferred and not later[0].ok
+    assert executor.send_campaign("other@example.com", "secret", _emails("d@example.com"))[0].ok
+
+
+def test_daily_cap_counts_what_was_sent_earlier_today(smtp_sink, executor_for):
+    asked = []
+
+    def sent_since(sender, midnight):
+        asked.append((sender, midnight))
+        return 2
+
+    executor = executor_for(SenderLimits(concurrency=2, per_minute=60000, per_day=3), sent_since)
+    results = executor.send_batch(SENDER, "secret", _emails("a@example.com", "b@example.com"))
+
+    #! a fresh executor, e.g. after a restart, starts from the day's deliveries, not from a full quota
+    assert [r.ok for r in results] == [True, False]
+    assert results[1].deferred
+    assert len(asked) == 1
+    assert asked[0][1].time() == datetime.min.time() and asked[0][1].date() == datetime.now(pytz.utc).date()
+    #! the wait runs until the next UTC day, where the planner puts the next slot
+    assert 0 < executor.quota_wait(SENDER) <= 86400
+
+
+def test_throttle_reply_stops_the_batch(smtp_sink, executor_for, fast_limits):
+    results = executor_for(fast_limits).send_batch(
+        SENDER, "secret", _emails("a@example.com", "slow@example.com", "c@example.com", "d@example.com"))
+
+    assert [r.ok for r in results] == [True, False, False, False]
+    assert [r.code for r in results[1:]] == [451, 451, 451]
+    #! throttled messages are deferred to a later slot, not failed
+    assert all(r.deferred for r in results[1:])
+    assert smtp_sink.recipients == ["a@example.com"]
+
+
+def test_throttle_reply_in_a_campaign_is_deferred(smtp_sink, executor_for, fast_limits):
+    results = executor_for(fast_limits).send_campaign(SENDER, "secret", _emails("slow@example.com", "a@example.com"))
+
+    assert (results[0].ok, results[0].code, results[0].deferred) == (False, 451, True)
+    assert results[1].ok
@@ -0,0 +1,94 @@
+import smtplib
+
+import pytest
+
+from tests.smtp_sink import SMTPSink
+from utils.send_executor import OutgoingEmail, SendExecutor, SenderLimits
+from utils.send_mail import AsyncDeliveryEngine, SMTPSettings, build_message
+
+SENDER = "sender@example.com"
+
+
+def _message(to: str, sender: str = SENDER):
+    return build_message(sender, to, f"Subject for {to}", "Hello\n.leading dot")
+
+
+@pytest.fixture
+def engine_for(smtp_sink):
+    """ Build AsyncDeliveryEngines delivering to the sink and close them after the test """
+    engines = []
+
+    def build(sink: SMTPSink = smtp_sink, loops: int = 1, max_per_sender: int = 4) -> AsyncDeliveryEngine:
+        settings = SMTPSettings(host=sink.host, port=sink.port, security="none", max_per_sender=max_per_sender, timeout=5)
+        engine = AsyncDeliveryEngine(settings, loops=loops)
+        engines.append(engine)
+        return engine
+
+    yield build
+    for engine in engines:
+        engine.close()
+
+
+def test_envelope_is_pipelined(smtp_sink, engine_for):
+    refused = engine_for().submit(SENDER, "secret", _message("a@example.com")).result(5)
+
+    assert refused == {}
+    assert smtp_sink.recipients == ["a@example.com"]
+    #! MAIL, RCPT and DATA reach the server in one read
+    envelopes = [read for read in smtp_sink.reads if read[0].startswith(b"MAIL")]
+    assert [[line.split(b":")[0] for line in read] for read in envelopes] == [[b"MAIL FROM", b"RCPT TO", b"DATA"]]
+    #! dot-stuffing is undone by the server, so the body arrives intact
+    assert b"\r\n.leading dot" in smtp_sink.deliveries[0].data
+
+
+def test_envelope_is_sent_in_lock_step_without_pipelining(engine_for):
+    with SMTPSink(pipelining=False) as sink:
+        engine_for(sink).submit(SENDER, "secret", _message("a@example.com")).result(5)
+
+        assert sink.recipients == ["a@example.com"]
+        assert all(len(read) == 1 for read in sink.reads)
+
+
+def test_refused_recipient_raises_and_keeps_the_connection(smtp_sink, engine_for):
+    engine = engine_for(max_per_sender=1)
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused) as refused:
+        engine.submit(SENDER, "secret", _message("bad@example.com")).result(5)
+    assert refused.value.recipients["bad@example.com"][0] == 550
+
+    #! the conversation was reset, the next message goes over the same connection
+    assert engine.submit(SENDER, "secret", _message("a@example.com")).result(5) == {}
+    assert smtp_sink.recipients == ["a@example.com"]
+    assert smtp_sink.connections == 1
+
+
+def test_connections_are_reused_across_loops(smtp_sink, engine_for):
+    engine = engine_for(loops=2, max_per_sender=1)
+    senders = [f"sender{i}@example.com" for i in range(4)]
+
+    for _ in range(2):
+        futures = [engine.submit(sender, "secret", _message(f"to{n}@example.com", sender))
+                   for sender in senders for n in range(3)]
+        assert [future.result(5) for future in futures] == [{}] * len(futures)
+
+    assert len(smtp_sink.deliveries) == 24
+    #! one connection per sender for both rounds, each sender pinned to one of the loops
+    assert smtp_sink.connections == len(senders)
+    assert smtp_sink.logins == len(senders)
+    assert {id(engine._worker(sender)) for sender in senders} <= {id(worker) for worker in engine._workers}
+
+
+def test_send_executor_delivers_campaigns_through_the_engine(smtp_sink, engine_for):
+    executor = SendExecutor(max_workers=1, limits=SenderLimits(concurrency=1, per_minute=60000, per_day=1000),
+                            engine=engine_for())
+    try:
+        emails = [OutgoingEmail(to, "Subject", "Hello") for to in ("a@example.com", "bad@example.com",
+                                                                    "slow@example.com", "c@example.com")]
+        results = executor.send_campaign(SENDER, "secret", emails)
+    finally:
+        executor.shutdown()
+
+    assert [r.ok for r in results] == [True, False, False, True]
+    assert [r.code for r in results] == [None, 550, 451, None]
+    assert [r.deferred for r in results] == [False, False, True, False]
+    assert sorted(smtp_sink.recipients) == ["a@example.com", "c@example.com"]
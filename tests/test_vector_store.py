@@ -0,0 +1,109 @@
+import threading
+from dataclasses import replace
+
+import faiss
+import numpy as np
+import pytest
+
+from utils.vector_store import PartitionedIndex, PersistentIndex, VectorStoreSettings
+
+DIMENSION = 8
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION), dtype=np.float32)
+
+
+@pytest.fixture
+def settings(tmp_path) -> VectorStoreSettings:
+    return VectorStoreSettings(directory=str(tmp_path), compact_threshold=1000)
+
+
+def test_missing_reports_ids_in_neither_tier(settings):
+    index = PersistentIndex(DIMENSION, "model", settings)
+    index.add([1, 2, 5], _vectors(3))
+    index.flush()
+    index.add([9], _vectors(1, seed=1))
+
+    #! 3 committed after 5 and 9 were indexed
+    assert index.missing([2, 3, 5, 9, 10]) == [3, 10]
+    assert index.high_water == 9
+
+    index.add([3], _vectors(1, seed=2))
+    assert index.missing([2, 3, 5, 9, 10]) == [10]
+    assert index.high_water == 9
+
+    reopened = PersistentIndex(DIMENSION, "model", settings)
+    assert reopened.missing([1, 2, 3, 5, 9]) == [3, 9]
+
+
+def test_partition_used_while_it_is_evicted_is_not_reopened(settings):
+    partitions = PartitionedIndex(DIMENSION, "model", replace(settings, idle_seconds=3600))
+    with partitions.use(1) as index:
+        index.add([1], _vectors(1))
+
+    flushing, proceed = threading.Event(), threading.Event()
+    flush = index.flush
+
+    def slow_flush():
+        flushing.set()
+        proceed.wait(5)
+        flush()
+
+    index.flush = slow_flush
+    partitions._partitions[1].last_used -= 7200
+    evicting = threading.Thread(target=partitions.evict)
+    evicting.start()
+    assert flushing.wait(5)
+
+    #! the partition is still mapped while its flush runs, so this is the same index
+    with partitions.use(1) as again:
+        assert again is index
+        again.add([2], _vectors(1, seed=1))
+    proceed.set()
+    evicting.join(5)
+
+    #! used during the flush, so it stayed open with both emails
+    assert len(partitions) == 1
+    with partitions.use(1) as again:
+        assert again is index
+        assert again.missing([1, 2]) == []
+
+
+def test_close_flushes_every_partition(settings):
+    partitions = PartitionedIndex(DIMENSION, "model", settings)
+    for user_id in (1, 2):
+        with partitions.use(user_id) as index:
+            index.add([user_id * 10], _vectors(1, seed=user_id))
+
+    partitions.close()
+
+    assert len(partitions) == 0
+    with partitions.use(2) as index:
+        assert index.missing([20]) == []
+
+
+def test_ivf_index_is_retrained_once_it_has_grown(settings):
+    settings = replace(settings, index_type="ivf_flat", train_threshold=200, retrain_factor=2)
+    index = PersistentIndex(DIMENSION, "model", settings)
+    first, second = _vectors(200), _vectors(200, seed=1)
+    index.add(list(range(1, 201)), first)
+    index.flush()
+    assert (index.base_type, index.trained_size) == ("ivf_flat", 200)
+    nlist = faiss.downcast_index(index._base.index).nlist
+
+    #! below twice the training size new vectors are only added to the trained lists
+    index.add(list(range(201, 300)), second[:99])
+    index.flush()
+    assert index.trained_size == 200
+
+    index.add(list(range(300, 401)), second[99:])
+    index.flush()
+    assert index.trained_size == 400
+    assert faiss.downcast_index(index._base.index).nlist > nlist
+
+    reopened = PersistentIndex(DIMENSION, "model", settings)
+    assert reopened.trained_size == 400
+    assert reopened.missing(list(range(1, 401))) == []
+    #! retrained from the exact vectors, so every one is still its own nearest neighbour
+    assert reopened.search(second[-1], 1)[0][0] == 400